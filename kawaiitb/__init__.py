@@ -11,21 +11,66 @@ __license__ = "MIT"
 __copyright__ = "Copyright (c) 2025 BPuffer"
 __description__ = "A kawaii Python traceback beautifier with multilingual support"
 
-import kawaiitb.handlers as handlers
-import kawaiitb.kraceback as traceback
-from kawaiitb.kraceback import KTBException
-from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc, load_config, set_config
 from kawaiitb.tools import load, unload
 
+# 以下成员在第一次访问时才导入，import kawaiitb / kawaiitb.load() 只安装钩子。
+# 处理器模块很重，短命的子进程里大多根本用不到。
+_LAZY_MODULES = {
+    "traceback": "kawaiitb.kraceback",
+    "handlers": "kawaiitb.handlers",
+    "snapshot": "kawaiitb.snapshot",
+    "logging": "kawaiitb.logging",  # 不放进__all__，免得import *覆盖标准库的logging
+}
+_LAZY_ATTRS = {
+    "KTBException": "kawaiitb.kraceback",
+    "ErrorSuggestHandler": "kawaiitb.kwihandler",
+    "KTBReporter": "kawaiitb.reporter",
+    "Deduplicator": "kawaiitb.dedup",
+    "RateLimiter": "kawaiitb.ratelimit",
+}
+_HANDLER_NAMES = [  # 与kawaiitb.handlers.__all__保持一致
+    "StopIterationHandler",
+    "StopAsyncIterationHandler",
+    "OverflowErrorHandler",
+    "ZeroDivisionErrorHandler",
+    "AssertionErrorHandler",
+    "KeyboardInterruptHandler",
+    "EOFErrorHandler",
+    "SystemExitHandler",
+    "AttributeErrorHandler",
+    "ImportErrorHandler",
+    "SyntaxErrorSuggestHandler",
+    "ImportErrorSuggestHandler",
+    "NameAttributeErrorSuggestHandler",
+]
+
 __all__ = [
     "traceback",
+    "snapshot",
     "rc",
     "load",
     "unload",
     "ErrorSuggestHandler",
     "KTBException",
+    "KTBReporter",
+    "Deduplicator",
+    "RateLimiter",
     "load_config",
     "set_config",
-    *handlers.__all__,
-]
\ No newline at end of file
+    *_HANDLER_NAMES,
+]
+
+
+def __getattr__(name):
+    import importlib
+    if name in _LAZY_MODULES:
+        value = importlib.import_module(_LAZY_MODULES[name])
+    elif name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    elif name in _HANDLER_NAMES:
+        value = getattr(importlib.import_module("kawaiitb.handlers"), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
@@ -71,6 +71,24 @@ DEFAULT_CONFIG = {
             "config.file.parsed_filename_withfoldup": "[{namespace}] (+{foldups}) {filename}",
             "config.module": "<module>",
             "config.string": "<string>",
+            "config.lambda": "<lambda>",
+
+            # 输出
+            "config.output.streaming": False,  # 逐行写出并flush(旧行为)。默认整个traceback拼好后一次写出
+
+            # 指纹与去重，见kawaiitb.utils.fingerprint和kawaiitb.dedup
+            "config.fingerprint.lines": "number",  # "number" | "text" | "ignore"
+            "config.fingerprint.collapse_recursion": True,
+            "config.dedup.window": 0,  # 秒。大于0时excepthook在这段时间内对同一个异常回溯只渲染一次
+            "dedup.repeated": "[KawaiiTB] {etype} (fingerprint {fingerprint}) was seen {count} more times\n",
+            "dedup.omitted": "{etype}: {value} (traceback {fingerprint} omitted, repeated {count} times)\n",
+            # 限流，见kawaiitb.ratelimit。rate或global_rate大于0时excepthook启用限流，超出的异常只计数
+            "config.ratelimit.rate": 0,  # 每个异常回溯(按指纹)每秒允许报告的次数
+            "config.ratelimit.burst": 10,
+            "config.ratelimit.global_rate": 0,  # 所有异常每秒允许报告的次数
+            "config.ratelimit.global_burst": 100,
+            "config.ratelimit.window": 60,  # 秒。被抑制的异常按这个窗口汇总
+            "ratelimit.summary": "[KawaiiTB] {etype} in {location}: {count:,} suppressed in last {window:g}s\n",
 
             # 锚点
             "config.anchor.indent": ' ' * 4,
@@ -90,6 +108,7 @@ DEFAULT_CONFIG = {
             "stack.context": "\nDuring handling of the above exception, another exception occurred:\n\n",
             "stack.summary": "Traceback (most recent call last):\n",
             "stack.group_summary": "Exception Group Traceback (most recent call last):\n",
+            "stack.stack_info": "Stack (most recent call last):\n",
 
             # 各个异常格式化
             "exception.message": "{etype}: {value}\n",
@@ -111,6 +130,10 @@ DEFAULT_CONFIG = {
             "stack.cause": "\n该异常引发了另一个异常:\n\n",
             "stack.context": "\n处理上面的异常时，发生了如下异常:\n\n",
             "stack.summary": "异常回溯 (到最近一次调用):\n",
+            "stack.stack_info": "调用栈 (到最近一次调用):\n",
+            "dedup.repeated": "[KawaiiTB] {etype} (指纹 {fingerprint}) 又出现了 {count} 次\n",
+            "dedup.omitted": "{etype}: {value} (相同的异常回溯 {fingerprint} 已省略，第 {count} 次重复)\n",
+            "ratelimit.summary": "[KawaiiTB] {location} 中的 {etype}: 最近 {window:g} 秒内有 {count:,} 个被限流\n",
             "config.stack.line_repeat_more": '  * 这一帧重复了 {count} 次\n',
             "config.stack.module_repeat": '  | *模块 {module} 的帧重复了 {count} 次\n',
         },
@@ -0,0 +1,127 @@
+"""
+重复异常回溯的去重。
+
+同一个异常回溯在短时间内大量出现时(比如工作线程一分钟报了五万次同样的错)，
+每一次都完整美化、输出，既浪费时间又淹没了其他输出。
+Deduplicator按指纹(见kawaiitb.utils.fingerprint)识别重复的异常回溯:
+在一个时间窗口内，同一个指纹只有第一次需要渲染，之后只计数。
+窗口结束时(同一个指纹再次出现、或者调用pop_summaries/flush时)产生一行"又出现了N次"的汇总。
+
+指纹直接从异常计算，不构造KTBException，所以被去重的异常几乎没有开销。
+
+usage:
+>>> dedup = Deduplicator(window=60)
+>>> def report(exc):
+...     for line in dedup.pop_summaries():
+...         sys.stderr.write(line)
+...     fingerprint, repeat = dedup.hit(exc)
+...     if repeat == 0:
+...         KTBException.from_exception(exc).print()
+
+excepthook(配置config.dedup.window)、KawaiiFormatter和KTBReporter的dedup参数都使用它。
+"""
+import threading
+import time
+from typing import Callable
+
+from kawaiitb.kraceback import KTBException, _exc_type_name
+from kawaiitb.runtimeconfig import rc
+from kawaiitb.utils.fingerprint import FingerprintLines, fingerprint_exception
+
+__all__ = [
+    "Deduplicator",
+]
+
+
+class _Window:
+    __slots__ = ("start", "repeats", "etype")
+
+    def __init__(self, start: float, etype: str):
+        self.start = start
+        self.repeats = 0
+        self.etype = etype
+
+
+def _etype_of(exc: BaseException | KTBException) -> str:
+    exc_type = exc.exc_type if isinstance(exc, KTBException) else type(exc)
+    return _exc_type_name(exc_type) or "UnknownError"
+
+
+class Deduplicator:
+    """
+    按指纹对异常回溯去重。线程安全。
+
+    :param window: 时间窗口(秒)。窗口内同一个指纹只渲染一次。
+    :param maxsize: 最多同时跟踪的指纹数，超出时最早的窗口提前结束。
+    :param chain, lines, collapse_recursion: 计算指纹的选项，见kawaiitb.utils.fingerprint。
+    :param clock: 时钟，默认time.monotonic。
+    """
+
+    def __init__(self, window: float = 60.0, *, maxsize: int = 4096, chain: bool = True,
+                 lines: FingerprintLines | None = None, collapse_recursion: bool | None = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if window <= 0:
+            raise ValueError("[KawaiiTB] window must be positive")
+        if maxsize <= 0:
+            raise ValueError("[KawaiiTB] maxsize must be positive")
+        self.window = window
+        self.maxsize = maxsize
+        self.chain = chain
+        self.lines = lines
+        self.collapse_recursion = collapse_recursion
+        self._clock = clock
+        self._windows: dict[str, _Window] = {}  # 按窗口开始的先后排列
+        self._ended: list[tuple[str, _Window]] = []  # 已经结束、还没有汇总的窗口
+        self._lock = threading.Lock()
+
+    def fingerprint(self, exc: BaseException | KTBException) -> str:
+        if isinstance(exc, KTBException):
+            return exc.fingerprint(chain=self.chain, lines=self.lines, collapse_recursion=self.collapse_recursion)
+        return fingerprint_exception(exc, chain=self.chain, lines=self.lines, collapse_recursion=self.collapse_recursion)
+
+    def hit(self, exc: BaseException | KTBException) -> tuple[str, int]:
+        """
+        记录一次异常，返回(指纹, 窗口内的重复次数)。
+        重复次数为0表示这是窗口内第一次出现，需要渲染；否则调用方只需要丢弃它。
+        """
+        fingerprint = self.fingerprint(exc)
+        now = self._clock()
+        with self._lock:
+            window = self._windows.get(fingerprint)
+            if window is not None and now - window.start >= self.window:
+                self._end(fingerprint)
+                window = None
+            if window is None:
+                self._windows[fingerprint] = _Window(now, _etype_of(exc))
+                if len(self._windows) > self.maxsize:
+                    self._end(next(iter(self._windows)))
+                return fingerprint, 0
+            window.repeats += 1
+            return fingerprint, window.repeats
+
+    def _end(self, fingerprint: str):
+        window = self._windows.pop(fingerprint)
+        if window.repeats:
+            self._ended.append((fingerprint, window))
+
+    def pop_summaries(self) -> list[str]:
+        """结束所有已经到期的窗口，返回其中有重复的窗口的汇总行"""
+        now = self._clock()
+        with self._lock:
+            for fingerprint, window in list(self._windows.items()):
+                if now - window.start < self.window:
+                    break  # 窗口按开始的先后排列，后面的都还没到期
+                self._end(fingerprint)
+            return self._take_summaries()
+
+    def flush(self) -> list[str]:
+        """结束所有窗口(比如退出前)，返回有重复的窗口的汇总行"""
+        with self._lock:
+            for fingerprint in list(self._windows):
+                self._end(fingerprint)
+            return self._take_summaries()
+
+    def _take_summaries(self) -> list[str]:
+        ended, self._ended = self._ended, []
+        return [rc.translate("dedup.repeated", etype=window.etype, fingerprint=fingerprint, count=window.repeats)
+                for fingerprint, window in ended]
@@ -1,15 +1,16 @@
 from typing import Generator
 
-from astroid import nodes
+import ast
 
 from kawaiitb.kraceback import KTBException
 from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc
 from kawaiitb.utils import safe_string
+from kawaiitb.utils.ast_parse import node_to_string
 
 
 @KTBException.register
-class AssertionErrorHandler(ErrorSuggestHandler, priority=1.0):
+class AssertionErrorHandler(ErrorSuggestHandler, priority=1.0, exc_types=AssertionError):
     """
     AssertionError异常处理器
     ```
@@ -23,93 +24,75 @@ class AssertionErrorHandler(ErrorSuggestHandler, priority=1.0):
 (1) [AssertionError] 断言 a == b, 但是 a=1, b=2.
     ```
     """
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, AssertionError)
-        self.exc_value = exc_value
-        self.exc_traceback = exc_traceback
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
-
-    @classmethod
-    def translation_keys(cls):
-        return {
-            "default": {
-                "native.AssertionError.msg": "Assertion {assertion} failed.",
-                "native.AssertionError.msg_with_values": "Assertion {assertion}, but {values}."
-            },
-            "zh_hans": {
-                "native.AssertionError.msg": "断言 {assertion} 失败。",
-                "native.AssertionError.msg_with_values": "断言 {assertion}, 但是 {values}."
-            }
-        }
-
-    def handle(self, ktb_exc: KTBException) -> Generator[str, None, None]:
-        # 如果有信息，直接返回信息
-        if (self.exc_value is not None and safe_string(self.exc_value, "") != ""
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        # 如果有信息，直接使用信息
+        self.message = None
+        self.assert_expr = None
+        self.values: list[str] = []
+        self.eval_errors: list[str] = []
+        if (exc_value is not None and safe_string(exc_value, "") != ""
             or len(ktb_exc.stack) == 0):
-            yield rc.exc_line("AssertionError", safe_string(self.exc_value, "<exception>"))
+            self.message = safe_string(exc_value, "<exception>")
             return
 
         # 从栈帧中获取断言的表达式字符串
         assert_expr = None
         assert_exprs: set[str] = set()
         exc_frame = ktb_exc.stack[0]
-        for node in self.parse_ast_from_exc(exc_frame, parse_line=True):
-            if not isinstance(node, nodes.Assert):
+        for node in self.query_ast_from_exc(exc_frame, parse_line=True):
+            if not isinstance(node, ast.Assert):
                 continue
             expr = node.test
-            assert_expr = expr.as_string()
+            assert_expr = node_to_string(expr)
             if not assert_expr:
                 continue
             # 收集断言表达式中的变量名
-            if isinstance(expr, nodes.Compare):
+            if isinstance(expr, ast.Compare):
                 # 比较表达式: a == b, a > b > c 等
-                assert_exprs.add(expr.left.as_string())
-                for _, right in expr.ops:
-                    assert_exprs.add(right.as_string())
+                assert_exprs.add(node_to_string(expr.left))
+                for right in expr.comparators:
+                    assert_exprs.add(node_to_string(right))
                     # TODO: 支持递归的表达式
                     # 问题: 如何判断递归下的表达式是用户所需要看到的
                     # 阻力: 断言表达式通常大道至简, 甚至第二层嵌套都很少看到, 实用型存疑
-            elif isinstance(expr, nodes.BoolOp):
+            elif isinstance(expr, ast.BoolOp):
                 # 布尔运算: a and b and c 等
-                assert_exprs.add(expr.as_string())
+                assert_exprs.add(node_to_string(expr))
                 for value in expr.values:
-                    if isinstance(value, nodes.Name):
-                        assert_exprs.add(value.as_string())
-            elif isinstance(expr, nodes.Name):
+                    if isinstance(value, ast.Name):
+                        assert_exprs.add(node_to_string(value))
+            elif isinstance(expr, ast.Name):
                 # 简单变量: assert a
-                assert_exprs.add(expr.as_string())
-            elif isinstance(expr, nodes.Call):
+                assert_exprs.add(node_to_string(expr))
+            elif isinstance(expr, ast.Call):
                 # 函数调用: assert a()
                 # 如果函数以"is""not""has"开头, 则取得所有函数参数, 否则只取整个表达式的值
-                if isinstance(expr.func, nodes.Name):
-                    func_name = expr.func.as_string().split(".")[-1]
+                if isinstance(expr.func, ast.Name):
+                    func_name = node_to_string(expr.func).split(".")[-1]
                     if func_name.startswith(("is", "not", "has")):
                         [
-                            assert_exprs.add(arg.as_string())
+                            assert_exprs.add(node_to_string(arg))
                             for arg in expr.args
-                            if isinstance(arg, (nodes.Name, nodes.Expr))
+                            if isinstance(arg, (ast.Name, ast.Expr))
                         ]
                         # for arg in expr.args:
-                        #     assert_exprs.add(arg.as_string())
+                        #     assert_exprs.add(node_to_string(arg))
                     else:
-                        assert_exprs.add(expr.as_string())
-            elif isinstance(expr, (nodes.BinOp, nodes.UnaryOp)):
+                        assert_exprs.add(node_to_string(expr))
+            elif isinstance(expr, (ast.BinOp, ast.UnaryOp)):
                 # 一二元运算等直接求值, 这些变量的最终值不是布尔, 用户只需要这个值.
-                for operand in [expr.left, expr.right]:
-                    if isinstance(operand, nodes.Name):
-                        assert_exprs.add(operand.as_string())
+                operands = [expr.operand] if isinstance(expr, ast.UnaryOp) else [expr.left, expr.right]
+                for operand in operands:
+                    if isinstance(operand, ast.Name):
+                        assert_exprs.add(node_to_string(operand))
             break
 
         if assert_expr is None:
-            yield rc.exc_line("AssertionError", rc.translate("native.AssertionError.msg", assertion="<Unknown Expression>"))
             return
+        self.assert_expr = assert_expr
 
-        # 获取变量的实际值
-        values = []
-        frame = self.exc_traceback.tb_frame
+        # 获取变量的实际值。必须在异常仍然存活时求值，之后帧可能已经被清理
+        frame = exc_traceback.tb_frame
         globals_dict = frame.f_globals
         locals_dict = frame.f_locals
 
@@ -117,26 +100,46 @@ class AssertionErrorHandler(ErrorSuggestHandler, priority=1.0):
             try:
                 evaluated = eval(expr_str, globals_dict, locals_dict)
                 # 此处使用eval是因为原表达式一定已经求值成功了，才会报AssertionError
-                values.append(f"{expr_str}={evaluated!r}")
+                self.values.append(f"{expr_str}={evaluated!r}")
             except Exception:
                 # 理论上不会进入这个分支, 但安全起见.
-                yield f"[KawaiiTB Error] strange error when eval {expr_str}"
+                self.eval_errors.append(f"[KawaiiTB Error] strange error when eval {expr_str}")
+
+    @classmethod
+    def translation_keys(cls):
+        return {
+            "default": {
+                "native.AssertionError.msg": "Assertion {assertion} failed.",
+                "native.AssertionError.msg_with_values": "Assertion {assertion}, but {values}."
+            },
+            "zh_hans": {
+                "native.AssertionError.msg": "断言 {assertion} 失败。",
+                "native.AssertionError.msg_with_values": "断言 {assertion}, 但是 {values}."
+            }
+        }
+
+    def handle(self, ktb_exc: KTBException) -> Generator[str, None, None]:
+        if self.message is not None:
+            yield rc.exc_line("AssertionError", self.message)
+            return
+
+        if self.assert_expr is None:
+            yield rc.exc_line("AssertionError", rc.translate("native.AssertionError.msg", assertion="<Unknown Expression>"))
+            return
 
-        values_str = ", ".join(values)
-        if len(values_str) > 50:
-            values_str = values_str[:50] + "..."
+        yield from self.eval_errors
 
-        if values:
+        if self.values:
             yield rc.exc_line(
                 "AssertionError",
                 rc.translate("native.AssertionError.msg_with_values",
-                             assertion=assert_expr,
-                             values=", ".join(values)))
+                             assertion=self.assert_expr,
+                             values=", ".join(self.values)))
         else:
             yield rc.exc_line(
                 "AssertionError",
                 rc.translate(
                     "native.AssertionError.msg",
-                    assertion=assert_expr
+                    assertion=self.assert_expr
                 )
             )
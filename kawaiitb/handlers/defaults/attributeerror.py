@@ -1,42 +1,136 @@
 from typing import Generator, TYPE_CHECKING
 import inspect
 
-import astroid
-from astroid import nodes
+import ast
 
 from kawaiitb.kraceback import KTBException, ENV
 from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc
 from kawaiitb.utils import safe_string, is_sysstdlib_name
+from kawaiitb.utils.ast_parse import node_to_string
 from kawaiitb.utils.suggestions import find_weighted_closest_matches, VarsGroup, merge_sorted_suggestions
 if TYPE_CHECKING:
     from kawaiitb.kraceback import FrameSummary
 
 
+def _is_callable_attr(obj, name: str) -> bool | None:
+    """
+    属性是否可调用，取不到时返回None。
+    静态查找，不会求值property等描述符: 这里在KTBException构造时对dir()的每一项调用，
+    求值可能有副作用，也可能抛出任意异常。只有__getattr__提供的动态属性才实际取一次。
+    """
+    try:
+        attr = inspect.getattr_static(obj, name)
+    except AttributeError:
+        try:
+            attr = getattr(obj, name)
+        except Exception:
+            return None
+    except Exception:
+        return None
+    if isinstance(attr, (classmethod, staticmethod)):
+        attr = attr.__func__
+    try:
+        return callable(attr)
+    except Exception:
+        return None
+
+
 @KTBException.register
-class AttributeErrorHandler(ErrorSuggestHandler, priority=1.0):
-    def __init__(self, exc_type, exc_value: AttributeError, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, AttributeError)
-        if not self._can_handle:
-            return
+class AttributeErrorHandler(ErrorSuggestHandler, priority=1.0, exc_types=AttributeError):
+    def capture(self, ktb_exc, exc_value: AttributeError, exc_traceback):
         self.msg = safe_string(exc_value, "<exception>")
         obj = exc_value.obj
-        self.obj = obj
         self.wrong_name = exc_value.name
         self.obj_rawname = safe_string(obj, "<unknown obj>")
         self.obj_type = safe_string(type(obj).__name__, "<unknown type>")
         self.obj_is_none = obj is None
         self.obj_is_module = False if obj is None else inspect.ismodule(obj)
         self.obj_module_name = getattr(obj, "__name__") if self.obj_is_module else None
+        self.obj_file = getattr(obj, "__file__", None) if self.obj_is_module else None
         self.candidates = None
         try:
             self.candidates = dir(obj)
         except:
             pass
 
-    def can_handle(self, etype: KTBException) -> bool:
-        return self._can_handle
+        # UC: 可调用对象(public, callable)
+        # UP: 不可调用对象(public, property)
+        # RC: 私有可调用对象(private, callable)
+        # RP: 私有不可调用对象(private, property)
+        # DU: 双下划线对象(double underscore)
+        # 分类需要访问对象本身，所以在这里做完，之后不再保留对象的引用
+        self.candidate_vars: dict[VarsGroup, list] = {"UC": [], "UP": [], "RC": [], "RP": [], "DU": []}
+        for name in self.candidates or ():
+            is_callable = _is_callable_attr(obj, name)
+            if is_callable is None:
+                continue
+            is_private = name.startswith('_')
+            is_dunder = name.startswith('__') and name.endswith('__')
+
+            if is_dunder:
+                self.candidate_vars["DU"].append(name)
+            elif is_private:
+                if is_callable:
+                    self.candidate_vars["RC"].append(name)
+                else:
+                    self.candidate_vars["RP"].append(name)
+            else:
+                if is_callable:
+                    self.candidate_vars["UC"].append(name)
+                else:
+                    self.candidate_vars["UP"].append(name)
+
+        # 获取代码当时使用时的情况
+        self.node_kind = None  # "import" | "attribute" | None(没有找到可用的节点)
+        self.node_obj_rawname = self.obj_rawname
+        self.node_attr_rawname = self.wrong_name
+        self.node_usage = ""  # "C": 被调用, "P": 作为属性使用
+        self.stdlib_shadow = None  # "module" | "var" | None, 名字覆盖了标准库且标准库里有这个属性
+        if self.candidates is None or len(ktb_exc.stack) == 0:
+            return
+        exc_frame = ktb_exc.stack[0]
+        # 先看字节码: 出错的LOAD_ATTR/LOAD_METHOD直接给出属性名、对象和是否被调用
+        operation = self.locate_operation_from_exc(exc_frame, exc_traceback)
+        if operation is not None:
+            if operation.kind == "import":
+                self.node_kind = "import"
+                return
+            if operation.kind != "attribute":
+                return  # 出错的不是这一帧里的属性访问
+            obj = operation.operands[0]
+            if obj.text is not None:
+                self.node_kind = "attribute"
+                self.node_obj_rawname = obj.text
+                self.node_attr_rawname = operation.argval
+                self.node_usage = "C" if operation.method else "P"
+                self._check_stdlib_shadow()
+                return
+
+        # 字节码无法确定时回退到语法树
+        for node in self.query_ast_from_exc(exc_frame):
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                self.node_kind = "import"
+                break
+            if isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Load):  # 赋值/删除属性不算
+                if not isinstance(node.value, (ast.Name, ast.Constant)):  # 找出最终的不可进一步分解的节点
+                    continue
+                self.node_kind = "attribute"
+                self.node_obj_rawname = node_to_string(node.value)
+                self.node_attr_rawname = node.attr
+                self._check_stdlib_shadow()
+                self.node_usage = "C" if isinstance(node.parent, ast.Call) else "P"
+                break
+
+    def _check_stdlib_shadow(self):
+        """对象的名字覆盖了标准库模块，且标准库里确实有这个属性时记录下来"""
+        if is_sysstdlib_name(self.node_obj_rawname):
+            orig_lib = __import__(self.node_obj_rawname)
+            try:
+                getattr(orig_lib, self.node_attr_rawname)
+                self.stdlib_shadow = "module" if self.obj_is_module else "var"
+            except AttributeError:
+                pass
 
     @classmethod
     def translation_keys(cls):
@@ -97,9 +191,9 @@ class AttributeErrorHandler(ErrorSuggestHandler, priority=1.0):
         """
         if not self.obj_is_module or not ktb_exc or len(ktb_exc.stack) == 0:
             return None  # 不是模块/没有tb, 无法判断
-        if not hasattr(self.obj, '__file__'):
+        if self.obj_file is None:
             return None
-        error_ocuring_file = getattr(self.obj, '__file__')
+        error_ocuring_file = self.obj_file
         start_recording = False
         interdependent_nodes: list["FrameSummary"] = []
         for frame in ktb_exc.stack:
@@ -111,13 +205,41 @@ class AttributeErrorHandler(ErrorSuggestHandler, priority=1.0):
             return None  # 不成环
         return interdependent_nodes  # 成环
 
+    def _rank_suggestions(self, wrong_usage_type: VarsGroup) -> list[tuple[int, str]]:
+        """按相似度排好序的建议，(距离, 属性名)"""
+        all_suggestions = find_weighted_closest_matches(self.wrong_name, self.candidate_vars)
+        if all_suggestions[wrong_usage_type]:
+            suggestions = [all_suggestions[wrong_usage_type][0]]
+            if wrong_usage_type == "UP" and all_suggestions["UC"]:
+                if all_suggestions["UP"][0][0] > all_suggestions["UC"][0][0]:
+                    # print(f"{all1_suggestions["UP"][0][1]}={all_suggestions["UP"][0][0]}, {all_suggestions["UC"][0][1]}={all_suggestions["UC"][0][0]}")
+                    suggestions.append(all_suggestions["UC"][0])
+        else:
+            suggestions = merge_sorted_suggestions(all_suggestions)[1]
+        return suggestions
+
+    def findings(self):
+        data = super().findings()
+        # dir()的结果可能很长，只导出计算好的建议
+        data.pop("candidates", None)
+        data.pop("candidate_vars", None)
+        data["suggestions"] = []
+        if not isinstance(self.wrong_name, str) or self.obj_is_none or self.candidates is None:
+            return data
+        if self.wrong_name.startswith('__') and self.wrong_name.endswith('__'):
+            wrong_usage_type = "DU"
+        elif self.node_kind == "attribute":
+            wrong_usage_type = ("R" if self.wrong_name.startswith('_') else "U") + self.node_usage
+        else:
+            return data
+        data["suggestions"] = [word for _, word in self._rank_suggestions(wrong_usage_type)]  # noqa
+        return data
+
     def _handle(self, ktb_exc: KTBException) -> Generator[str, None, None]:
         # 如果对象本身就有问题, 直接返回
         if not isinstance(self.wrong_name, str) or self.obj_is_none:
             yield from self._default_handle()
-        if self.candidates is not None:
-            candidates = self.candidates
-        else:
+        if self.candidates is None:
             yield from self._default_handle()
             return
 
@@ -126,50 +248,25 @@ class AttributeErrorHandler(ErrorSuggestHandler, priority=1.0):
             yield from self._default_handle()
             return
 
-        # UC: 可调用对象(public, callable)
-        # UP: 不可调用对象(public, property)
-        # RC: 私有可调用对象(private, callable)
-        # RP: 私有不可调用对象(private, property)
-        # DU: 双下划线对象(double underscore)
         wrong_usage_type: VarsGroup
         # 是否私有
         wrong_usage_type = "R" if self.wrong_name.startswith('_') else "U"  # noqa
         # 是否可调用
-        exc_frame = ktb_exc.stack[0]
-        obj_rawname = self.obj_rawname
-        attr_rawname = self.wrong_name
-        for node in self.parse_ast_from_exc(exc_frame):
-            if isinstance(node, (nodes.Import, nodes.ImportFrom)):
-                extra_hint = ""
-                if is_sysstdlib_name(self.obj_rawname) and self.obj_is_module:
-                    extra_hint = rc.translate("native.AttributeError.rename_from_shadowing_stdlib")
-                yield rc.exc_line("AttributeError", rc.translate("native.AttributeError.modulepremsg",
-                                                                 obj_module_name=self.obj_module_name,
-                                                                 name=attr_rawname) + extra_hint)
-                break
-            if isinstance(node, nodes.Attribute):
-                if not isinstance(node.expr, (nodes.Name, nodes.Const)):  # 找出最终的不可进一步分解的节点
-                    continue
-                obj_rawname = node.expr.as_string()
-                attr_rawname = node.attrname
-
-                if is_sysstdlib_name(obj_rawname):
-                    orig_lib = __import__(obj_rawname)
-                    try:
-                        getattr(orig_lib, attr_rawname)
-                        if self.obj_is_module:
-                            yield rc.translate('native.AttributeError.rename_from_shadowing_stdlib', obj=obj_rawname, attr=attr_rawname)
-                        else:
-                            yield rc.translate('native.AttributeError.rename_from_shadowing_stdlib_var', obj=obj_rawname, attr=attr_rawname)
-                    except AttributeError:
-                        pass
-
-
-                if isinstance(node.parent, nodes.Call):
-                    wrong_usage_type += "C"
-                else:
-                    wrong_usage_type += "P"
-                break
+        obj_rawname = self.node_obj_rawname
+        attr_rawname = self.node_attr_rawname
+        if self.node_kind == "import":
+            extra_hint = ""
+            if is_sysstdlib_name(self.obj_rawname) and self.obj_is_module:
+                extra_hint = rc.translate("native.AttributeError.rename_from_shadowing_stdlib")
+            yield rc.exc_line("AttributeError", rc.translate("native.AttributeError.modulepremsg",
+                                                             obj_module_name=self.obj_module_name,
+                                                             name=attr_rawname) + extra_hint)
+        elif self.node_kind == "attribute":
+            if self.stdlib_shadow == "module":
+                yield rc.translate('native.AttributeError.rename_from_shadowing_stdlib', obj=obj_rawname, attr=attr_rawname)
+            elif self.stdlib_shadow == "var":
+                yield rc.translate('native.AttributeError.rename_from_shadowing_stdlib_var', obj=obj_rawname, attr=attr_rawname)
+            wrong_usage_type += self.node_usage
         else:
             # never find an availd Attribute node
             yield from self._default_handle()
@@ -194,42 +291,12 @@ class AttributeErrorHandler(ErrorSuggestHandler, priority=1.0):
         if self.wrong_name.startswith('__') and self.wrong_name.endswith('__'):
             wrong_usage_type = "DU"
 
-        candidate_vars: dict[VarsGroup, list] = {"UC": [], "UP": [], "RC": [], "RP": [], "DU": []}
-        for name in candidates:
-            if not hasattr(self.obj, name):
-                continue
-
-            attr = getattr(self.obj, name)
-            is_callable = callable(attr)
-            is_private = name.startswith('_')
-            is_dunder = name.startswith('__') and name.endswith('__')
-
-            if is_dunder:
-                candidate_vars["DU"].append(name)
-            elif is_private:
-                if is_callable:
-                    candidate_vars["RC"].append(name)
-                else:
-                    candidate_vars["RP"].append(name)
-            else:
-                if is_callable:
-                    candidate_vars["UC"].append(name)
-                else:
-                    candidate_vars["UP"].append(name)
-
+        candidate_vars = self.candidate_vars
         if wrong_usage_type != "DU" and not any((candidate_vars[t] for t in ("UC", "UP", "RC", "RP"))):  # noqa
             yield rc.translate("native.AttributeError.no_any_prop")
             return
 
-        all_suggestions = find_weighted_closest_matches(self.wrong_name, candidate_vars)
-        if all_suggestions[wrong_usage_type]:
-            suggestions = [all_suggestions[wrong_usage_type][0]]
-            if wrong_usage_type == "UP" and all_suggestions["UC"]:
-                if all_suggestions["UP"][0][0] > all_suggestions["UC"][0][0]:
-                    # print(f"{all1_suggestions["UP"][0][1]}={all_suggestions["UP"][0][0]}, {all_suggestions["UC"][0][1]}={all_suggestions["UC"][0][0]}")
-                    suggestions.append(all_suggestions["UC"][0])
-        else:
-            suggestions = merge_sorted_suggestions(all_suggestions)[1]
+        suggestions = self._rank_suggestions(wrong_usage_type)
 
         max_len = rc.translate("native.AttributeError.max_suggest_list")
         if len(suggestions) == 0:  # 没有针对性的建议，只能列出所有属性
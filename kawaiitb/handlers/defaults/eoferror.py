@@ -7,7 +7,7 @@ from kawaiitb.utils import safe_string
 
 
 @KTBException.register
-class EOFErrorHandler(ErrorSuggestHandler, priority=1.0):
+class EOFErrorHandler(ErrorSuggestHandler, priority=1.0, exc_types=EOFError):
     r"""
     EOFError异常处理器
     ```
@@ -23,16 +23,12 @@ class EOFErrorHandler(ErrorSuggestHandler, priority=1.0):
 (1) [EOFError] 输入结束
     ```
     """
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, EOFError)
-        if self._can_handle:
-            self.err_msg_key = {
-                "EOF when reading a line": "native.EOFError.when_reading_line",
-            }.get(safe_string(exc_value, '<exception>'), exc_value or "native.EOFError.msg")
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        # 已知的消息和空消息使用翻译，其他消息原样输出。只保存字符串，不保留异常本身
+        self.message = safe_string(exc_value, '<exception>')
+        self.err_msg_key = {
+            "EOF when reading a line": "native.EOFError.when_reading_line",
+        }.get(self.message, None if self.message else "native.EOFError.msg")
 
     @classmethod
     def translation_keys(cls):
@@ -48,5 +44,5 @@ class EOFErrorHandler(ErrorSuggestHandler, priority=1.0):
         }
 
     def handle(self, ktb_exc) -> Generator[str, None, None]:
-        self.err_msg = rc.translate(self.err_msg_key)
+        self.err_msg = rc.translate(self.err_msg_key) if self.err_msg_key else self.message
         yield rc.exc_line("EOFError", self.err_msg)
@@ -5,7 +5,7 @@ from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc
 
 @KTBException.register
-class ImportErrorHandler(ErrorSuggestHandler, priority=1.0):
+class ImportErrorHandler(ErrorSuggestHandler, priority=1.0, exc_types=ImportError):
     """
     ImportError异常处理器
 
@@ -22,12 +22,8 @@ class ImportErrorHandler(ErrorSuggestHandler, priority=1.0):
     ```
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, ImportError)
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        self.module_name = getattr(exc_value, "name", None)
 
     @classmethod
     def translation_keys(cls):
@@ -38,5 +34,4 @@ class ImportErrorHandler(ErrorSuggestHandler, priority=1.0):
         }
     
     def handle(self, ktb_exc: KTBException) -> Generator[str, None, None]:
-        module_name = self.exc_value.name
-        yield self.translate("native.ImportError.msg", module_name=module_name)
+        yield rc.exc_line("ImportError", rc.translate("native.ImportError.msg", module_name=self.module_name))
@@ -6,7 +6,7 @@ from kawaiitb.runtimeconfig import rc
 
 
 @KTBException.register
-class KeyboardInterruptHandler(ErrorSuggestHandler, priority=1.0):
+class KeyboardInterruptHandler(ErrorSuggestHandler, priority=1.0, exc_types=KeyboardInterrupt):
     """
     KeyboardInterrupt异常处理器
 
@@ -23,13 +23,6 @@ class KeyboardInterruptHandler(ErrorSuggestHandler, priority=1.0):
     ```
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, KeyboardInterrupt)
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
-
     @classmethod
     def translation_keys(cls):
         return {
@@ -7,7 +7,7 @@ from kawaiitb.utils import safe_string
 
 
 @KTBException.register
-class OverflowErrorHandler(ErrorSuggestHandler, priority=1.0):
+class OverflowErrorHandler(ErrorSuggestHandler, priority=1.0, exc_types=OverflowError):
     """
     OverflowError异常处理器
     ```
@@ -24,21 +24,14 @@ class OverflowErrorHandler(ErrorSuggestHandler, priority=1.0):
     ```
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, OverflowError)
-        if self._can_handle:
-            self.orig_msg = ""
-            self.err_msg_key = {
-                "math range error": "native.OverflowError.msg.math_range_error",  # 数学范围错误
-            }.get(safe_string(exc_value, '<exception>'))
-            if not self.err_msg_key:
-                self.err_msg_key = "native.OverflowError.msg.novalue"
-                self.orig_msg = safe_string(exc_value, '<exception>')
-
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        self.orig_msg = ""
+        self.err_msg_key = {
+            "math range error": "native.OverflowError.msg.math_range_error",  # 数学范围错误
+        }.get(safe_string(exc_value, '<exception>'))
+        if not self.err_msg_key:
+            self.err_msg_key = "native.OverflowError.msg.novalue"
+            self.orig_msg = safe_string(exc_value, '<exception>')
 
     @classmethod
     def translation_keys(cls):
@@ -1,15 +1,16 @@
 from typing import Generator
 
-import astroid
-from astroid import nodes
+import ast
 
 from kawaiitb.kraceback import KTBException
 from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc
+from kawaiitb.utils import safe_string
+from kawaiitb.utils.ast_parse import node_to_string
 
 
 @KTBException.register
-class StopAsyncIterationHandler(ErrorSuggestHandler, priority=1.0):  # 原生
+class StopAsyncIterationHandler(ErrorSuggestHandler, priority=1.0, exc_types=StopAsyncIteration):  # 原生
     """
     StopAsyncIteration异常处理器
     ```
@@ -32,69 +33,63 @@ class StopAsyncIterationHandler(ErrorSuggestHandler, priority=1.0):  # 原生
     ```
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, StopAsyncIteration)
-        if not self._can_handle:
-            return
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        # 只保存返回值的字符串，不保留返回值对象本身
+        return_value = getattr(exc_value, 'value', None)
+        self.return_value = None if return_value is None else safe_string(return_value, '<value>')
 
-        self.return_value = exc_value.value if hasattr(exc_value, 'value') else None
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
-
-    @classmethod
-    def translation_keys(cls):
-        return {
-            "default": {
-                "native.StopAsyncIteration.hint": "Async generator '{generator}' stopped iterating.",
-                "native.StopAsyncIteration.hint_with_return": "Async generator '{generator}' stopped: {ret}",
-            },
-            "zh_hans": {
-                "native.StopAsyncIteration.hint": "异步生成器'{generator}'没有更多值了。",
-                "native.StopAsyncIteration.hint_with_return": "异步生成器'{generator}'没有更多值了: {ret}",
-            }
-        }
-
-    def handle(self, ktb_exc) -> Generator[str, None, None]:
         # 从栈帧中获取异步生成器在代码里的名称
         self.generator = "<...>"
         if len(ktb_exc.stack) > 0:
             exc_frame = ktb_exc.stack[0]
-            for node in self.parse_ast_from_exc(exc_frame):
+            for node in self.query_ast_from_exc(exc_frame):
                 # case: anext(g) -> Call(
-                #     func=Name(name=anext),
+                #     func=Name(id=anext),
                 #     args=[...])
                 if (
-                    isinstance(node, nodes.Call) and  # 是函数调用
-                    isinstance(node.func, nodes.Name) and  # 是显式函数名
-                    node.func.name == 'anext'  # 是anext调用
+                    isinstance(node, ast.Call) and  # 是函数调用
+                    isinstance(node.func, ast.Name) and  # 是显式函数名
+                    node.func.id == 'anext'  # 是anext调用
                 ):
-                    self.generator = node.args[0].as_string()
+                    self.generator = node_to_string(node.args[0])
                     break
 
                 # case: g.__anext__() -> Call(
                 #     func=Attr(
-                #         expr=<?>,
-                #         attrname=__anext__),
+                #         value=<?>,
+                #         attr=__anext__),
                 #     args=[...])
                 if (
-                    isinstance(node, nodes.Call) and  # 是函数调用
-                    isinstance(node.func, nodes.Attribute) and  # 是属性访问
-                    node.func.attrname == '__anext__'  # 是__anext__方法调用
+                    isinstance(node, ast.Call) and  # 是函数调用
+                    isinstance(node.func, ast.Attribute) and  # 是属性访问
+                    node.func.attr == '__anext__'  # 是__anext__方法调用
                 ):
                     # 获取异步生成器表达式字符串
-                    self.generator = node.func.expr.as_string()
+                    self.generator = node_to_string(node.func.value)
                     break
 
                 # case: async for i in g: -> AsyncFor(
                 #     target=<?>,
                 #     iter=<?>,
                 #     body=[...])
-                if isinstance(node, nodes.AsyncFor):
-                    self.generator = node.iter.as_string()
+                if isinstance(node, ast.AsyncFor):
+                    self.generator = node_to_string(node.iter)
                     break
 
+    @classmethod
+    def translation_keys(cls):
+        return {
+            "default": {
+                "native.StopAsyncIteration.hint": "Async generator '{generator}' stopped iterating.",
+                "native.StopAsyncIteration.hint_with_return": "Async generator '{generator}' stopped: {ret}",
+            },
+            "zh_hans": {
+                "native.StopAsyncIteration.hint": "异步生成器'{generator}'没有更多值了。",
+                "native.StopAsyncIteration.hint_with_return": "异步生成器'{generator}'没有更多值了: {ret}",
+            }
+        }
+
+    def handle(self, ktb_exc) -> Generator[str, None, None]:
         if self.return_value is not None:
             hint = rc.translate("native.StopAsyncIteration.hint_with_return",
                              generator=self.generator,
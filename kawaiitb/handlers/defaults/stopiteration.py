@@ -1,15 +1,16 @@
 from typing import Generator
 
-import astroid
-from astroid import nodes
+import ast
 
 from kawaiitb.kraceback import KTBException
 from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc
+from kawaiitb.utils import safe_string
+from kawaiitb.utils.ast_parse import node_to_string
 
 
 @KTBException.register
-class StopIterationHandler(ErrorSuggestHandler, priority=1.0):  # 原生
+class StopIterationHandler(ErrorSuggestHandler, priority=1.0, exc_types=StopIteration):  # 原生
     """
     StopIteration异常处理器
     ```
@@ -33,63 +34,81 @@ class StopIterationHandler(ErrorSuggestHandler, priority=1.0):  # 原生
     ```
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, StopIteration)
-        if not self._can_handle:
-            return
-
+    def capture(self, ktb_exc, exc_value, exc_traceback):
         # Python 3.7 之后，对于使用return 关键字的生成器，抛出的StopIteration异常会包含 return 的值。
-        self.return_value = exc_value.value if hasattr(exc_value, 'value') else None
-
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
-
-    @classmethod
-    def translation_keys(cls):
-        return {
-            "default": {
-                "native.StopIteration.hint": "Generator '{generator}' stopped iterating.",
-                "native.StopIteration.hint_with_return": "Generator '{generator}' stopped: {ret}",
-            },
-            "zh_hans": {
-                "native.StopIteration.hint": "生成器'{generator}'没有更多值了。",
-                "native.StopIteration.hint_with_return": "生成器'{generator}'没有更多值了: {ret}",
-            }
-        }
+        # 只保存返回值的字符串，不保留返回值对象本身
+        return_value = getattr(exc_value, 'value', None)
+        self.return_value = None if return_value is None else safe_string(return_value, '<value>')
 
-    def handle(self, ktb_exc: KTBException) -> Generator[str, None, None]:
         # 从栈帧中获取生成器在代码里的名称
         self.generator = "<...>"
         if len(ktb_exc.stack) > 0:
             exc_frame = ktb_exc.stack[0]
-            for node in self.parse_ast_from_exc(exc_frame):
+            operation = self.locate_operation_from_exc(exc_frame, exc_traceback)
+            if operation is not None:
+                is_next_call, generator = self._generator_from_operation(operation)
+                if not is_next_call:
+                    return  # 出错的不是这一帧里的next调用
+                if generator is not None:
+                    self.generator = generator
+                    return
+            # 字节码无法确定时回退到语法树
+            for node in self.query_ast_from_exc(exc_frame):
                 # case: next(g) -> Call(
-                #     func=Name(name=next),
+                #     func=Name(id=next),
                 #     args=[...])
                 if (
-                        isinstance(node, nodes.Call) and  # 是函数调用
-                        isinstance(node.func, nodes.Name) and  # 是显式函数名
-                        node.func.name == 'next'  # 是next调用
+                        isinstance(node, ast.Call) and  # 是函数调用
+                        isinstance(node.func, ast.Name) and  # 是显式函数名
+                        node.func.id == 'next'  # 是next调用
                 ):
-                    self.generator = node.args[0].as_string()
+                    self.generator = node_to_string(node.args[0])
                     break
 
                 # case: g.__next__() -> Call(
                 #     func=Attr(
-                #         expr=<?>,
-                #         attrname=__next__),
+                #         value=<?>,
+                #         attr=__next__),
                 #     args=[...])
                 if (
-                    isinstance(node, nodes.Call) and  # 是函数调用
-                    isinstance(node.func, nodes.Attribute) and  # 是属性访问
-                    node.func.attrname == '__next__'  # 是__next__方法调用
+                    isinstance(node, ast.Call) and  # 是函数调用
+                    isinstance(node.func, ast.Attribute) and  # 是属性访问
+                    node.func.attr == '__next__'  # 是__next__方法调用
                 ):
                     # 获取生成器表达式字符串
-                    self.generator = node.func.expr.as_string()
+                    self.generator = node_to_string(node.func.value)
                     break
 
+    @staticmethod
+    def _generator_from_operation(operation) -> tuple[bool, str | None]:
+        """判断出错的操作是不是next(g)或g.__next__()，是的话取出生成器的源码(可能取不到)"""
+        if operation.kind != "call":
+            return False, None
+        callee = operation.operands[0]
+        # case: next(g)
+        if callee.simple and callee.argval == "next" and operation.argval >= 1:
+            return True, operation.operands[1].text
+        # case: g.__next__()
+        if callee.opname in ("LOAD_ATTR", "LOAD_METHOD") and callee.argval == "__next__":
+            if callee.text is not None and callee.text.endswith(".__next__"):
+                return True, callee.text[:-len(".__next__")]
+            return True, None
+        return False, None
+
+    @classmethod
+    def translation_keys(cls):
+        return {
+            "default": {
+                "native.StopIteration.hint": "Generator '{generator}' stopped iterating.",
+                "native.StopIteration.hint_with_return": "Generator '{generator}' stopped: {ret}",
+            },
+            "zh_hans": {
+                "native.StopIteration.hint": "生成器'{generator}'没有更多值了。",
+                "native.StopIteration.hint_with_return": "生成器'{generator}'没有更多值了: {ret}",
+            }
+        }
+
+    def handle(self, ktb_exc: KTBException) -> Generator[str, None, None]:
         if self.return_value is not None:
             hint = rc.translate("native.StopIteration.hint_with_return", generator=self.generator, ret=self.return_value)
         else:
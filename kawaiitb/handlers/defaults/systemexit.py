@@ -2,9 +2,10 @@ from typing import Generator, Any
 
 from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc
+from kawaiitb.utils import safe_string
 
 
-class SystemExitHandler(ErrorSuggestHandler, priority=1.0):
+class SystemExitHandler(ErrorSuggestHandler, priority=1.0, exc_types=SystemExit):
     """
     SystemExit异常处理器
 >>> exit(114514)
@@ -16,15 +17,8 @@ class SystemExitHandler(ErrorSuggestHandler, priority=1.0):
 (1) [SystemExit] 程序退出: 114514
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, SystemExit)
-        self.value = None
-        if self._can_handle:
-            self.value = exc_value
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        self.value = safe_string(exc_value, '<exception>')
 
     def translation_keys(cls) -> dict[str, dict[str, Any]]:
         return {
@@ -1,16 +1,16 @@
 from typing import Generator
 
-import astroid
-from astroid import nodes
+import ast
 
 from kawaiitb.kraceback import KTBException
 from kawaiitb.kwihandler import ErrorSuggestHandler
 from kawaiitb.runtimeconfig import rc
 from kawaiitb.utils import safe_string
+from kawaiitb.utils.ast_parse import node_to_string
 
 
 @KTBException.register
-class ZeroDivisionErrorHandler(ErrorSuggestHandler, priority=1.0):
+class ZeroDivisionErrorHandler(ErrorSuggestHandler, priority=1.0, exc_types=ZeroDivisionError):
     """
     ZeroDivisionError异常处理器
     ```
@@ -25,14 +25,49 @@ class ZeroDivisionErrorHandler(ErrorSuggestHandler, priority=1.0):
 (1) [ZeroDivisionError] 除以零 - '(1 - 1)'的值为0
     ```
     """
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
-        self._can_handle = issubclass(exc_type, ZeroDivisionError)
-        self.exc_value = exc_value
-        self.stack = exc_traceback
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        # 一般ZeroDivisionError的错误信息都是division by zero, 或者没有。这两种情况都可以直接用翻译
+        self.easter_egg = False
+        self.divisor = None  # 除数的源码，None表示没有定位到除法
+        self.custom_msg = None  # 非标准错误信息时原样展示
+        if exc_value is not None and \
+                safe_string(exc_value, "") not in ("division by zero", "float division by zero"):
+            self.custom_msg = safe_string(exc_value, "<exception>")
+        if not ktb_exc.stack:
+            return
+        # 先看字节码: 出错的指令就是那次除法，操作数直接可得
+        operation = self.locate_operation_from_exc(ktb_exc.stack[0], exc_traceback)
+        if operation is not None:
+            if operation.kind != "binary" or operation.argval not in ("/", "//", "/=", "//="):
+                return  # 出错的不是这一帧里的除法
+            left, right = operation.operands
+            if operation.argval == "/" and left.simple and left.argval == 1 and right.simple and right.argval == 0:
+                self.easter_egg = True  # 输入1/0触发彩蛋
+                return
+            if right.text is not None:
+                self.divisor = right.text
+                return
 
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
+        # 字节码无法确定时回退到语法树
+        for node in self.query_ast_from_exc(ktb_exc.stack[0]):
+            # case: 1 / 0 -> BinOp(
+            #     left=Constant(value=1),
+            #     op=Div(),
+            #     right=Constant(value=0))
+            if (
+                isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div) and  # 是转浮点除
+                isinstance(node.left, ast.Constant) and node.left.value == 1 and  # 被除数是1  # noqa
+                isinstance(node.right, ast.Constant) and node.right.value == 0  # 除数是0
+            ):
+                # 输入1/0触发彩蛋
+                self.easter_egg = True
+                break
+            elif(
+                isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Div, ast.FloorDiv))  # 是除法
+            ):
+                # 这就够了。不需要太麻烦的匹配，二元操作的错误帧定位本身就很精准了
+                self.divisor = node_to_string(node.right)
+                break
 
     @classmethod
     def translation_keys(cls):
@@ -58,33 +93,15 @@ class ZeroDivisionErrorHandler(ErrorSuggestHandler, priority=1.0):
         }
 
     def handle(self, ktb_exc) -> Generator[str, None, None]:
-        # 一般ZeroDivisionError的错误信息都是division by zero, 或者没有。这两种情况都可以直接用翻译
-        for node in self.parse_ast_from_exc(ktb_exc.stack[0]):
-            # case: 1 / 0 -> BinOp(
-            #     left=Num(n=1),
-            #     op=Div(),
-            #     right=Num(n=0))
-            if (
-                isinstance(node, nodes.BinOp) and node.op == '/' and  # 是转浮点除
-                isinstance(node.left, nodes.Const) and node.left.value == 1 and  # 被除数是1  # noqa
-                isinstance(node.right, nodes.Const) and node.right.value == 0  # 除数是0
-            ):
-                # 输入1/0触发彩蛋
-                import random
-                egg = random.choice(rc.translate("native.ZeroDivisionError.easter_eggs"))
-                yield rc.exc_line("KawaiiTB", egg)
-                break
-            elif(
-                isinstance(node, nodes.BinOp) and node.op in ('/', '//')  # 是除法
-            ):
-                # 这就够了。不需要太麻烦的匹配，二元操作的错误帧定位本身就很精准了
-                if self.exc_value is None or \
-                        safe_string(self.exc_value, "") == "division by zero" or \
-                        safe_string(self.exc_value, "") == "float division by zero":
-                    hint = rc.translate("native.ZeroDivisionError.msg", divisor=node.right.as_string())
-                else:
-                    hint = self.exc_value
-                yield rc.exc_line("ZeroDivisionError", hint)
-                break
+        if self.easter_egg:
+            import random
+            egg = random.choice(rc.translate("native.ZeroDivisionError.easter_eggs"))
+            yield rc.exc_line("KawaiiTB", egg)
+        elif self.divisor is not None:
+            if self.custom_msg is None:
+                hint = rc.translate("native.ZeroDivisionError.msg", divisor=self.divisor)
+            else:
+                hint = self.custom_msg
+            yield rc.exc_line("ZeroDivisionError", hint)
         else:
             yield rc.exc_line("ZeroDivisionError", rc.translate("native.ZeroDivisionError.msg_plain"))
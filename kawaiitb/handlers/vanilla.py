@@ -14,34 +14,26 @@ __all__ = [
 ]
 
 @KTBException.register
-class SyntaxErrorSuggestHandler(ErrorSuggestHandler, priority=1.1):
+class SyntaxErrorSuggestHandler(ErrorSuggestHandler, priority=1.1, exc_types=SyntaxError):
     """
     本处理器模仿原生的语法错误处理器，为语法错误添加额外的锚点指示
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, *, limit=None,
-                 lookup_lines=True, capture_locals=False, compact=False,
-                 max_group_width=15, max_group_depth=10, _seen=None):
-        super().__init__(exc_type, exc_value, exc_traceback)
-        if exc_type and issubclass(exc_type, SyntaxError):
-            exc_value: SyntaxError
-            self.filename = exc_value.filename
-            lno = exc_value.lineno
-            self.lineno = str(lno) if lno is not None else None
-            end_lno = exc_value.end_lineno
-            self.end_lineno = str(end_lno) if end_lno is not None else None
-            self.text = exc_value.text
-            self.offset = exc_value.offset
-            self.end_offset = exc_value.end_offset
-            self.msg = exc_value.msg
+    def capture(self, ktb_exc, exc_value: SyntaxError, exc_traceback):
+        self.filename = exc_value.filename
+        lno = exc_value.lineno
+        self.lineno = str(lno) if lno is not None else None
+        end_lno = exc_value.end_lineno
+        self.end_lineno = str(end_lno) if end_lno is not None else None
+        self.text = exc_value.text
+        self.offset = exc_value.offset
+        self.end_offset = exc_value.end_offset
+        self.msg = exc_value.msg
 
     @classmethod
     def translation_keys(cls):
         return {}  # 翻译键均由默认配置提供，不需要额外的翻译键
 
-    def can_handle(self, ktb_exc) -> bool:
-        return issubclass(ktb_exc.exc_type, SyntaxError)
-
     def handle(self, ktb_exc) -> Generator[str, None, None]:
         r"""
         (-) Traceback (most recent call last):
@@ -88,26 +80,19 @@ class SyntaxErrorSuggestHandler(ErrorSuggestHandler, priority=1.1):
 
 
 @KTBException.register
-class ImportErrorSuggestHandler(ErrorSuggestHandler, priority=1.1):
+class ImportErrorSuggestHandler(ErrorSuggestHandler, priority=1.1, exc_types=ImportError):
     """
     本处理器模仿原生的ImportError的拼写错误检测
     为导入中的拼写错误添加额外的正确拼写提示
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, *, limit=None,
-                 lookup_lines=True, capture_locals=False, compact=False,
-                 max_group_width=15, max_group_depth=10, _seen=None):
-        super().__init__(exc_type, exc_value, exc_traceback)
-
-        self._can_handle = issubclass(exc_type, ImportError) and getattr(exc_value, "name_from", None) is not None
-
-        self.suggestion = None
-        if self._can_handle:
-            self.wrong_name = getattr(exc_value, "name_from")
-            self.suggestion = compute_suggestion_error(exc_value, exc_traceback, self.wrong_name)
+    @classmethod
+    def applies(cls, exc_type, exc_value) -> bool:
+        return getattr(exc_value, "name_from", None) is not None
 
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        self.wrong_name = getattr(exc_value, "name_from")
+        self.suggestion = compute_suggestion_error(exc_value, exc_traceback, self.wrong_name)
 
     @classmethod
     def translation_keys(cls):
@@ -127,38 +112,32 @@ class ImportErrorSuggestHandler(ErrorSuggestHandler, priority=1.1):
 
 
 # @KTBException.register  # 正在考虑完全移除，正在尝试使用更通用的处理器 NameError和AttributeError 的Handler替代
-class NameAttributeErrorSuggestHandler(ErrorSuggestHandler, priority=1.1):
+class NameAttributeErrorSuggestHandler(ErrorSuggestHandler, priority=1.1,
+                                        exc_types=(NameError, AttributeError)):
     """
     本处理器模仿原生的NameError的拼写错误检测
     为NameError的拼写错误添加额外的正确拼写提示
     并为存在于标准库和第三方库中的名字添加额外的提示
     """
 
-    def __init__(self, exc_type, exc_value, exc_traceback, *, limit=None,
-                 lookup_lines=True, capture_locals=False, compact=False,
-                 max_group_width=15, max_group_depth=10, _seen=None):
-        super().__init__(exc_type, exc_value, exc_traceback)
-
-        self._can_handle = (issubclass(exc_type, (NameError, AttributeError)) and
-                            getattr(exc_value, "name", None) is not None)
-
-        if self._can_handle:
-            self.wrong_name = getattr(exc_value, "name")
-            self.suggestion = compute_suggestion_error(exc_value, exc_traceback, self.wrong_name)
-            self.is_stdlib = self.wrong_name in sys.stdlib_module_names
-
-            self.is_3rd_party = False
-            import importlib.metadata
-            try:
-                importlib.metadata.distribution(self.wrong_name)
-                self.is_3rd_party = True
-            except importlib.metadata.PackageNotFoundError:
-                pass
-
-            self.is_lib = self.is_stdlib or self.is_3rd_party
-
-    def can_handle(self, ktb_exc) -> bool:
-        return self._can_handle
+    @classmethod
+    def applies(cls, exc_type, exc_value) -> bool:
+        return getattr(exc_value, "name", None) is not None
+
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        self.wrong_name = getattr(exc_value, "name")
+        self.suggestion = compute_suggestion_error(exc_value, exc_traceback, self.wrong_name)
+        self.is_stdlib = self.wrong_name in sys.stdlib_module_names
+
+        self.is_3rd_party = False
+        import importlib.metadata
+        try:
+            importlib.metadata.distribution(self.wrong_name)
+            self.is_3rd_party = True
+        except importlib.metadata.PackageNotFoundError:
+            pass
+
+        self.is_lib = self.is_stdlib or self.is_3rd_party
 
     @classmethod
     def translation_keys(cls):
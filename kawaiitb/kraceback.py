@@ -11,16 +11,21 @@ import linecache
 import os
 import site
 import sys
+import threading
+import weakref
 from contextlib import suppress
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path, PurePath
 from typing import Optional, Type, TYPE_CHECKING, Generator, LiteralString
 
 from kawaiitb.runtimeconfig import rc
 from kawaiitb.utils import (
     sys_getframe, extract_caret_anchors_from_line_segment,
-    safe_string, get_module_exec_file, parse_filename_sp_namespace
+    safe_string, get_frame_abs_filename, parse_filename_sp_namespace
 )
+from kawaiitb.utils.envcache import env_cache_key, load_env_cache, save_env_cache
+from kawaiitb.utils.fingerprint import FingerprintLines, fingerprint_ktb
 from kawaiitb.utils.fromtraceback import (
     sentinel, parse_value_tb, walk_tb_with_full_positions,
     byte_offset_to_character_offset, walk_stack,
@@ -32,9 +37,39 @@ if TYPE_CHECKING:
 
 
 class _ENV:
-    def __init__(self, cwd: PurePath =None, platform: str =None, stdlib_paths: set[PurePath]=None, site_packages: set[PurePath]=None):
+    def __init__(self, cwd: PurePath =None, platform: str =None, stdlib_paths: set[PurePath]=None, site_packages: set[PurePath]=None,
+                 *, lazy: bool = False):
+        if lazy:
+            # 延迟探测：直到第一次访问环境信息(通常是第一次分类帧的文件名)时才调用update
+            self._pending = (cwd, platform, stdlib_paths, site_packages)
+            return
         self.update(cwd, platform, stdlib_paths, site_packages)
 
+    _discover_lock = threading.RLock()  # 探测只发生一次，所有实例共用一把锁即可
+
+    def __getattr__(self, name):
+        # 只有在普通的属性查找失败时才会调用到这里
+        if "_pending" in self.__dict__:
+            with _ENV._discover_lock:
+                # 双重检查: 等锁期间别的线程可能已经探测完了。
+                # 探测完成、属性全部就位之后才移除_pending，其他线程不会看到只初始化了一半的环境
+                pending = self.__dict__.get("_pending")
+                if pending is not None and not self.__dict__.get("_discovering"):
+                    self._discovering = True  # 探测过程中(同一线程)读取还没设置的属性时照常报AttributeError
+                    try:
+                        self.update(*pending)
+                        del self._pending
+                    finally:
+                        del self._discovering
+            if "_pending" not in self.__dict__:
+                return getattr(self, name)
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    @property
+    def discovered(self) -> bool:
+        """环境信息是否已经探测过"""
+        return "_pending" not in self.__dict__
+
     def get_stdlib_paths(self):
         """获取所有可能的标准库路径"""
         paths: set[Path] = set()
@@ -65,29 +100,107 @@ class _ENV:
 
         return paths
 
+    def discover(self) -> tuple[set[Path], set[Path]]:
+        """
+        探测标准库路径和site-packages路径。
+        结果按解释器环境缓存在磁盘上，同一环境下的后续进程直接读取缓存，跳过文件系统探测。
+        """
+        key = env_cache_key()
+        cached = load_env_cache(key)
+        if cached is not None:
+            try:
+                return (set(Path(p) for p in cached["stdlib_paths"]),
+                        set(Path(p) for p in cached["site_packages"]))
+            except (KeyError, TypeError):
+                pass  # 缓存格式不对，重新探测
+
+        stdlib_paths = self.get_stdlib_paths()
+        site_packages = set(Path(p).resolve() for p in site.getsitepackages())
+        save_env_cache(key, {
+            "stdlib_paths": [str(p) for p in stdlib_paths],
+            "site_packages": [str(p) for p in site_packages],
+        })
+        return stdlib_paths, site_packages
+
     def update(self, cwd: Path =None, platform: str =None, stdlib_paths: set[Path]=None, site_packages: set[Path]=None):
         """更新环境信息"""
+        self._auto_cwd = cwd is None  # 未指定工作目录时跟随进程的工作目录，见sync_cwd
         self.cwd = cwd or Path(os.getcwd())
         self.platform = platform or sys.platform
 
-        # 获取标准库路径
-        self.stdlib_paths = stdlib_paths or self.get_stdlib_paths()
-
-        # 获取site-packages路径
-        self.site_packages = site_packages or set(Path(p).resolve() for p in site.getsitepackages())
+        # 获取标准库路径和site-packages路径
+        if not stdlib_paths or not site_packages:
+            discovered_stdlib_paths, discovered_site_packages = self.discover()
+            stdlib_paths = stdlib_paths or discovered_stdlib_paths
+            site_packages = site_packages or discovered_site_packages
+        self.stdlib_paths = stdlib_paths
+        self.site_packages = site_packages
         self.all_import_paths = self.stdlib_paths | self.site_packages
 
-        # 找出在工作目录之后的路径
-        self.all_import_paths_acwd = set(
-            [p for p in self.all_import_paths if self.cwd in p.parents]
-        )
+        self._refresh()
+
+    def _refresh(self):
+        """根据cwd和导入路径重新计算派生信息，并使文件名分类缓存失效"""
+        # 按路径组件建立前缀树，所有导入根目录和工作目录都挂在树上
+        # 查找一个文件的归属只需要沿着它的路径组件走一遍，而不需要逐个比较前缀
+        self.normalized_cwd = os.path.normpath(self.cwd)
+        self.path_trie: dict = {}
+        for path in self.all_import_paths:
+            self._trie_insert(os.path.normpath(path), os.path.normpath(path))
+        self._trie_insert(self.normalized_cwd, _ENV.CWD)
+
+        self.version = getattr(self, "version", 0) + 1
+        self.classify_cache: dict[str, tuple[str, str]] = {}  # 绝对文件名 -> (命名空间, 显示文件名)
+
+    CWD = object()  # 前缀树中工作目录的标记
+
+    def _trie_insert(self, path: str, mark):
+        node = self.path_trie
+        for part in path.split(os.sep):
+            node = node.setdefault(part, {})
+        # 导入根目录恰好是工作目录时，工作目录优先
+        if node.get(None) is not _ENV.CWD:
+            node[None] = mark
+
+    def import_roots_of(self, filename: str) -> list:
+        """
+        返回拥有该文件的所有候选根目录，按检查顺序排列。
+        元素是根目录的路径字符串，或表示工作目录的_ENV.CWD。
+
+        顺序与逐个按长度比较前缀时一致：
+        工作目录之内的导入路径(如工作目录下的虚拟环境)最先，深的在前；然后是工作目录；最后是其他导入路径，深的在前。
+        工作目录之内的根目录一定比工作目录深，其他根目录一定比工作目录浅，所以按深度从深到浅排即可。
+        """
+        node = self.path_trie
+        marks = []
+        for part in os.path.normpath(filename).split(os.sep):
+            node = node.get(part)
+            if node is None:
+                break
+            mark = node.get(None)
+            if mark is not None:
+                marks.append(mark)
+        marks.reverse()
+        return marks
+
+    def sync_cwd(self):
+        """
+        如果进程的工作目录变了，跟着更新。只对未指定cwd构建的环境生效。
+        每次提取堆栈时调用一次，而不是每帧调用。
+        """
+        if not self.discovered or not self._auto_cwd:
+            return  # 还没有探测过的环境会在探测时读取当前工作目录
+        cwd = os.getcwd()
+        if cwd != str(self.cwd):
+            self.cwd = Path(cwd)
+            self._refresh()
 
     def get_invalid_site_packages_paths(self):
         """获取无效的site-packages路径。仅小写，使用时需转换为小写比较"""
         return {'site-packages', 'lib', f'python{sys.version_info.major}.{sys.version_info.minor}',
                 f'python3', '..'}
 
-ENV = _ENV()
+ENV = _ENV(lazy=True)
 
 
 #
@@ -380,10 +493,128 @@ class FrameSummary:
     def line(self):
         return self.load_line()
 
+    def to_dict(self) -> dict:
+        """转为结构化数据，见KTBException.to_dict"""
+        return {
+            "filename": self.filename,
+            "refined_filename": self.refined_filename,
+            "abs_filename": self.abs_filename,
+            "namespace": self.namespace,
+            "name": self.name,
+            "positions": {
+                "lineno": self.lineno,
+                "end_lineno": self.end_lineno,
+                "colno": self.colno,
+                "end_colno": self.end_colno,
+            },
+            "line": self.line,
+            "locals": self.locals_,
+        }
+
 
 
 # _RECURSIVE_CUTOFF = 3  # Also hardcoded in traceback.c.
 
+OUTPUT_CHUNK_LIMIT = 64 * 1024  # 缓冲输出时，累积的文本超过这个字符数就先写出一次
+
+
+def write_traceback(chunks, file=None, *, streaming: bool | None = None):
+    """
+    把格式化好的traceback写到file(默认sys.stderr)。
+    默认把所有文本拼起来一次write、一次flush，特别长的traceback按OUTPUT_CHUNK_LIMIT分段写出，
+    避免在行缓冲或者管道输出上每行都产生一次系统调用。
+    streaming为True时逐段write+flush，为None时按配置config.output.streaming决定。
+    """
+    if file is None:
+        file = sys.stderr
+    if streaming is None:
+        streaming = rc.translate("config.output.streaming")
+    if streaming:
+        for chunk in chunks:
+            file.write(chunk)
+            file.flush()
+        return
+
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= OUTPUT_CHUNK_LIMIT:
+            file.write("".join(buffer))
+            buffer.clear()
+            size = 0
+    if buffer:
+        file.write("".join(buffer))
+    file.flush()
+
+
+@lru_cache(maxsize=1024)
+def _anchor_line(line: str, frame_line: str, colno: int, end_colno: int, single_line: bool,
+                 lang: str, config_version: int) -> str | None:
+    """
+    计算帧的定位锚行(~~^~~)，没有锚行时返回None。
+    锚点位置、显示宽度和渲染结果整体缓存: 同一处代码在递归、重试和反复抛出时布局都一样。
+    渲染依赖锚点的翻译，所以键里带上语言和rc.version，语言或配置变化后旧的条目自然不再命中。
+    """
+    orig_line_len = len(line)
+    frame_line_len = len(frame_line.lstrip())
+    stripped_characters = orig_line_len - frame_line_len
+    start_offset = byte_offset_to_character_offset(line, colno)
+    end_offset = byte_offset_to_character_offset(line, end_colno)
+    code_segment = line[start_offset:end_offset]
+
+    # 如果是单行问题帧, 语法树定位到引起错误的操作
+    offsets = None
+    if single_line:
+        with suppress(Exception):
+            offsets = extract_caret_anchors_from_line_segment(code_segment)
+
+    else:
+        # 不计算换行符，因为锚点只需定位到行的最后一个字符
+        end_offset = len(line.rstrip())
+
+    # 如果主字符未跨越整行则添加定位锚行 ~~^~~
+    if offsets and offsets[1] - offsets[0] > 0:
+        anchor_left, anchor_right = offsets
+
+        # 在终端显示时，某些非ASCII字符可能被渲染为双宽度字符，
+        # 因此在计算行长度时需要考虑这一点
+        dp_start_offset = display_width(line, start_offset) + 1
+        dp_left_end_offset = display_width(code_segment, anchor_left) + dp_start_offset
+        dp_right_start_offset = display_width(code_segment, anchor_right) + dp_start_offset
+        dp_end_offset = display_width(line, end_offset) + 1
+        anchor_indent = rc.translate("config.anchor.indent") + ' ' * (dp_start_offset - stripped_characters)
+        #  a =   1     /     0
+        # ....|~~~~~|^^^^^|~~~~~|
+        #   SO|  LEO|  RSO|   EO|
+        return rc.anchors(
+            indent=anchor_indent,
+            left_start=dp_start_offset,
+            left_end=dp_left_end_offset,
+            right_start=dp_right_start_offset,
+            right_end=dp_end_offset,
+            crlf=True,
+        )
+
+    # 如果主字符未跨越整行则添加全指锚行 ^^^^^
+    elif end_offset - start_offset < len(frame_line.strip()):
+        dp_start_offset = display_width(line, start_offset) + 1
+        dp_end_offset = display_width(line, end_offset) + 1
+        anchor_indent = rc.translate("config.anchor.indent") + ' ' * (dp_start_offset - stripped_characters)
+        # what caaaaaan i say?
+        # ....|^^^^^^^^|
+        #   SO=LEO  RSO=EO
+        return rc.anchors(
+            indent=anchor_indent,
+            left_start=dp_start_offset,
+            left_end=dp_start_offset,
+            right_start=dp_end_offset,
+            right_end=dp_end_offset,
+            crlf=True,
+        )
+    return None
+
 
 class StackSummary(list[FrameSummary]):
     """FrameSummary对象的list, 表示异常帧的栈"""
@@ -440,6 +671,7 @@ class StackSummary(list[FrameSummary]):
 
         result = cls()  # 创建结果对象
         fnames = set()  # 用于存储所有文件名，避免重复加载
+        ENV.sync_cwd()  # 工作目录变化时使文件名分类缓存失效
 
         # 遍历frame_gen，构建FrameSummary对象
         for f, (lineno, end_lineno, colno, end_colno) in frame_gen:
@@ -448,10 +680,7 @@ class StackSummary(list[FrameSummary]):
             co = f.f_code  # 获取代码对象。代码对象是静态的，安。
 
             orig_filename = co.co_filename  # 获取文件名
-            if not orig_filename.startswith("<") and not os.path.isabs(orig_filename):
-                abs_filename = get_module_exec_file(f)  # 谨防 Cython 偷家
-            else:
-                abs_filename = orig_filename
+            abs_filename = get_frame_abs_filename(f)
             namespace, display_filename = parse_filename_sp_namespace(abs_filename, ENV)
 
             name = co.co_name  # 获取函数名
@@ -556,67 +785,12 @@ class StackSummary(list[FrameSummary]):
                     frame_summary.colno is not None
                     and frame_summary.end_colno is not None
             ):
-                # a = "s" + 1  语法上'"s" + 1'是错误产生的位置
-                #     ~~~~^~~  而主字符"+"是错误产生的根本原因。
-
-                # 处理问题帧的代码段基本内容
-                line = frame_summary.original_line
-                orig_line_len = len(line)
-                frame_line_len = len(frame_summary.line.lstrip())
-                stripped_characters = orig_line_len - frame_line_len
-                start_offset = byte_offset_to_character_offset(line, frame_summary.colno)
-                end_offset = byte_offset_to_character_offset(line, frame_summary.end_colno)
-                code_segment = line[start_offset:end_offset]
-
-                # 如果是单行问题帧, 语法树定位到引起错误的操作
-                offsets = None
-                if frame_summary.lineno == frame_summary.end_lineno:
-                    with suppress(Exception):
-                        offsets = extract_caret_anchors_from_line_segment(code_segment)
-
-                else:
-                    # 不计算换行符，因为锚点只需定位到行的最后一个字符
-                    end_offset = len(line.rstrip())
-
-                # 如果主字符未跨越整行则添加定位锚行 ~~^~~
-                if offsets and offsets[1] - offsets[0] > 0:
-                    anchor_left, anchor_right = offsets
-
-                    # 在终端显示时，某些非ASCII字符可能被渲染为双宽度字符，
-                    # 因此在计算行长度时需要考虑这一点
-                    dp_start_offset = display_width(line, start_offset) + 1
-                    dp_left_end_offset = display_width(code_segment, anchor_left) + dp_start_offset
-                    dp_right_start_offset = display_width(code_segment, anchor_right) + dp_start_offset
-                    dp_end_offset = display_width(line, end_offset) + 1
-                    anchor_indent = rc.translate("config.anchor.indent") + ' ' * (dp_start_offset - stripped_characters)
-                    #  a =   1     /     0
-                    # ....|~~~~~|^^^^^|~~~~~|
-                    #   SO|  LEO|  RSO|   EO|
-                    row.append(rc.anchors(
-                        indent=anchor_indent,
-                        left_start=dp_start_offset,
-                        left_end=dp_left_end_offset,
-                        right_start=dp_right_start_offset,
-                        right_end=dp_end_offset,
-                        crlf=True,
-                    ))
-
-                # 如果主字符未跨越整行则添加全指锚行 ^^^^^
-                elif end_offset - start_offset < len(stripped_line):
-                    dp_start_offset = display_width(line, start_offset) + 1
-                    dp_end_offset = display_width(line, end_offset) + 1
-                    anchor_indent = rc.translate("config.anchor.indent") + ' ' * (dp_start_offset - stripped_characters)
-                    # what caaaaaan i say?
-                    # ....|^^^^^^^^|
-                    #   SO=LEO  RSO=EO
-                    row.append(rc.anchors(
-                        indent=anchor_indent,
-                        left_start=dp_start_offset,
-                        left_end=dp_start_offset,
-                        right_start=dp_end_offset,
-                        right_end=dp_end_offset,
-                        crlf=True,
-                    ))
+                anchor_line = _anchor_line(frame_summary.original_line, frame_summary.line,
+                                           frame_summary.colno, frame_summary.end_colno,
+                                           frame_summary.lineno == frame_summary.end_lineno,
+                                           rc.lang, rc.version)
+                if anchor_line:
+                    row.append(anchor_line)
 
         # 如果这个帧有携带的局部变量
         if frame_summary.locals_:
@@ -737,6 +911,24 @@ class StackSummary(list[FrameSummary]):
         return result
 
 
+EXPORT_SCHEMA_VERSION = 1  # KTBException.to_dict的结构版本，结构有不兼容的变化时加一
+
+
+def _exc_type_name(exc_type) -> str | None:
+    """异常类型的完整名称，内置和__main__中的类型不带模块名"""
+    if exc_type is None:
+        return None
+    stype = exc_type.__qualname__
+    smod = exc_type.__module__
+    if smod not in ("__main__", "builtins"):
+        if not isinstance(smod, str):
+            smod = "<unknown>"
+        stype = smod + '.' + stype
+    return stype
+
+
+_RENDER_CACHE_ATTRS = frozenset({"_suggest_handler", "_exc_only_cache", "_render_cache"})
+
 
 class KTBException:
     """
@@ -771,13 +963,72 @@ class KTBException:
     - :attr:`msg` 语法错误的编译器的错误消息。
     """
     _handler_types: list[Type["ErrorSuggestHandler"]] = []
+    # 分派索引: 处理器声明的异常类型 -> [(注册序号, 处理器类型)]，注册新处理器时清空重建
+    _dispatch_index: dict[type, list[tuple[int, Type["ErrorSuggestHandler"]]]] = {}
+    # 分派缓存: 异常类型 -> 按注册顺序排列的可用处理器类型。弱引用键，动态创建的异常类型被回收时自动清除
+    _dispatch_cache: "weakref.WeakKeyDictionary[type, tuple[Type[ErrorSuggestHandler], ...]]" = weakref.WeakKeyDictionary()
+    # 内置处理器在第一次真正需要分派异常时才导入，见load_default_handlers
+    _default_handlers_loaded: bool = False
+
+    @classmethod
+    def load_default_handlers(cls):
+        """
+        导入内置处理器模块，处理器在导入时注册自己和翻译键。
+        import kawaiitb / kawaiitb.load() 不会导入它们，第一次分派异常时才会调用这里。
+        """
+        if cls._default_handlers_loaded:
+            return
+        cls._default_handlers_loaded = True  # 先置位，避免处理器模块导入期间重入
+        try:
+            with rc.batch_registration():
+                import kawaiitb.handlers  # noqa: F401
+        except BaseException:
+            cls._default_handlers_loaded = False
+            raise
 
     @classmethod
     def register(cls, Handler: Type["ErrorSuggestHandler"]):
         cls._handler_types.append(Handler)
+        cls._dispatch_index.clear()
+        cls._dispatch_cache.clear()
         rc.register_handler(Handler)
         return Handler
 
+    @classmethod
+    def handler_types_for(cls, exc_type) -> tuple[Type["ErrorSuggestHandler"], ...]:
+        """
+        返回可能处理该异常类型的处理器类型，保持注册顺序。
+
+        处理器通过`__exc_types__`声明自己处理的异常类型，这里沿异常类型的MRO查索引，
+        所以ZeroDivisionError永远不会构建AttributeError等无关的处理器。结果按异常类型缓存。
+        """
+        if exc_type is None:
+            return ()
+        cls.load_default_handlers()
+        try:
+            return cls._dispatch_cache[exc_type]
+        except KeyError:
+            pass
+        except TypeError:  # 不可弱引用的奇怪类型，不缓存
+            return cls._match_handler_types(exc_type)
+
+        handler_types = cls._match_handler_types(exc_type)
+        cls._dispatch_cache[exc_type] = handler_types
+        return handler_types
+
+    @classmethod
+    def _match_handler_types(cls, exc_type) -> tuple[Type["ErrorSuggestHandler"], ...]:
+        if not cls._dispatch_index:
+            for order, handler_type in enumerate(cls._handler_types):
+                for declared_type in handler_type.__exc_types__:
+                    cls._dispatch_index.setdefault(declared_type, []).append((order, handler_type))
+
+        matched: dict[int, Type["ErrorSuggestHandler"]] = {}
+        for base in getattr(exc_type, "__mro__", ()):
+            for order, handler_type in cls._dispatch_index.get(base, ()):
+                matched[order] = handler_type
+        return tuple(matched[order] for order in sorted(matched))
+
     def __init__(self, exc_type, exc_value, exc_traceback, *, limit=None,
                  lookup_lines=True, capture_locals=False, compact=False,
                  max_group_width=15, max_group_depth=10, _seen=None):
@@ -827,13 +1078,43 @@ class KTBException:
 
         self.final_exc_str = self.exc_str
 
-        # 构建各个异常建议处理器便于后续提建议
+        # 构建建议处理器便于后续提建议
+        # 新式处理器只按类级声明(exc_types + applies)选出优先级最高的一个来构建和捕获信息，
+        # 旧式处理器(重写了can_handle)仍然全部构建，在格式化时由can_handle判断
+        handler_types = self.handler_types_for(exc_type)
+        winner_type = None
+        for handler_type in handler_types:
+            if handler_type.is_legacy() or not handler_type.applies(exc_type, exc_value):
+                continue
+            if winner_type is None or handler_type.__priority__ > winner_type.__priority__:
+                winner_type = handler_type
+
+        handler_kwargs = dict(limit=limit, lookup_lines=lookup_lines, capture_locals=capture_locals,
+                              compact=compact, max_group_width=max_group_width,
+                              max_group_depth=max_group_depth, _seen=_seen)
         self._handlers: list["ErrorSuggestHandler"] = []
-        for handler_type in self._handler_types:
-            self._handlers.append(handler_type(exc_type, exc_value, exc_traceback, limit=limit,
-                                               lookup_lines=lookup_lines, capture_locals=capture_locals,
-                                               compact=compact, max_group_width=max_group_width,
-                                               max_group_depth=max_group_depth, _seen=_seen))
+        winner_failed = False
+        for handler_type in handler_types:
+            if handler_type is not winner_type and not handler_type.is_legacy():
+                continue
+            handler = handler_type(exc_type, exc_value, exc_traceback, **handler_kwargs)
+            if handler_type is winner_type or handler_type.applies(exc_type, exc_value):
+                try:
+                    handler.capture(self, exc_value, exc_traceback)
+                except Exception:
+                    # 处理器的分析失败不能让异常本身无法格式化，丢弃这个处理器
+                    winner_failed = winner_failed or handler_type is winner_type
+                    continue
+            self._handlers.append(handler)
+        if winner_failed:
+            # 退回到基础处理器，只输出异常本身
+            from kawaiitb.kwihandler import ErrorSuggestHandler
+            self._handlers.append(ErrorSuggestHandler(exc_type, exc_value, exc_traceback, **handler_kwargs))
+
+        # 渲染缓存，见format和invalidate
+        self._suggest_handler: Optional["ErrorSuggestHandler"] = None
+        self._exc_only_cache: dict[tuple, tuple[str, ...]] = {}
+        self._render_cache: dict[tuple, tuple[str, ...]] = {}
 
         # 如果需要，加载源代码行
         if lookup_lines:
@@ -918,6 +1199,17 @@ class KTBException:
         """Create a TracebackException from an exception."""
         return cls(type(exc), exc, exc.__traceback__, *args, **kwargs)
 
+    def __reduce__(self):
+        # pickle时使用快照格式，不需要pickle处理器实例和替身类型
+        from kawaiitb.snapshot import dumps, loads
+        return loads, (dumps(self),)
+
+    def __copy__(self):
+        # 浅拷贝不需要经过快照
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        return new
+
     def _load_lines(self):
         """Private API. force all lines in the stack to be loaded."""
         for frame in self.stack:
@@ -925,15 +1217,113 @@ class KTBException:
 
     def __eq__(self, other):
         if isinstance(other, KTBException):
-            return self.__dict__ == other.__dict__
+            return self._comparable_dict() == other._comparable_dict()
         return NotImplemented
 
+    def _comparable_dict(self) -> dict:
+        """比较相等时不考虑渲染缓存"""
+        return {k: v for k, v in self.__dict__.items() if k not in _RENDER_CACHE_ATTRS}
+
+    def to_dict(self, *, chain=True) -> dict:
+        """
+        把异常转为结构化数据，不经过翻译和文本格式化，供日志管道等下游直接使用。
+
+        结构(EXPORT_SCHEMA_VERSION = 1):
+        - schema: 结构版本，只在最外层
+        - type: 异常类型的完整名称，内置和__main__中的类型不带模块名
+        - message: 异常的原始信息
+        - stack: 帧列表，见FrameSummary.to_dict
+        - handler: 胜出处理器的类型名(handler.type)和它提取的信息(handler.findings)
+        - notes: __notes__，字符串列表或None
+        - cause, context: 链式异常，结构相同。chain为False时总是None
+        - suppress_context: 是否抑制了context
+        - exceptions: 异常组的子异常列表，不是异常组时为None
+        """
+        root = {"schema": EXPORT_SCHEMA_VERSION} | self._to_dict_node()
+        queue = [(self, root)]
+        while queue:  # 和__init__一样用队列代替递归，长异常链不会爆栈
+            exc, data = queue.pop()
+            if chain:
+                for key, sub in (("cause", exc.__cause__), ("context", exc.__context__)):
+                    if sub is not None:
+                        data[key] = sub._to_dict_node()
+                        queue.append((sub, data[key]))
+            if exc.exceptions is not None:
+                data["exceptions"] = [sub._to_dict_node() for sub in exc.exceptions]
+                queue.extend(zip(exc.exceptions, data["exceptions"]))
+        return root
+
+    def _to_dict_node(self) -> dict:
+        """单个异常的数据，链式异常和子异常由to_dict填入"""
+        if isinstance(self.__notes__, collections.abc.Sequence) and not isinstance(self.__notes__, (str, bytes)):
+            notes = [safe_string(note, 'note') for note in self.__notes__]
+        elif self.__notes__ is not None:
+            notes = [safe_string(self.__notes__, '__notes__', func=repr)]
+        else:
+            notes = None
+
+        if self.exc_type is None:
+            handler = None
+        else:
+            selected = self._select_handler()
+            handler = {"type": type(selected).__qualname__, "findings": selected.findings()}
+
+        return {
+            "type": _exc_type_name(self.exc_type),
+            "message": self.final_exc_str,
+            "stack": [frame.to_dict() for frame in self.stack],
+            "handler": handler,
+            "notes": notes,
+            "cause": None,
+            "context": None,
+            "suppress_context": self.__suppress_context__,
+            "exceptions": None,
+        }
+
+    def to_json(self, file=None, *, chain=True, indent=None) -> str | None:
+        """
+        把to_dict的结果编码为JSON。file为None时返回字符串，
+        否则边编码边分段写入file，不在内存里拼出整个文档。
+        """
+        import json
+        chunks = json.JSONEncoder(ensure_ascii=False, indent=indent).iterencode(self.to_dict(chain=chain))
+        if file is None:
+            return "".join(chunks)
+        write_traceback(chunks, file, streaming=False)
+        return None
+
+    def fingerprint(self, *, chain=True, lines: FingerprintLines | None = None,
+                    collapse_recursion: bool | None = None) -> str:
+        """
+        异常回溯的指纹，由异常类型和每一帧的(绝对文件名, 函数名, 行号)计算，跨进程稳定。
+        lines和collapse_recursion控制行号漂移和递归的归一化，见kawaiitb.utils.fingerprint。
+        """
+        return fingerprint_ktb(self, chain=chain, lines=lines, collapse_recursion=collapse_recursion)
+
+    def invalidate(self):
+        """
+        清除这个异常及其异常链、异常组上的渲染缓存。
+        一般不需要手动调用: 语言和配置变化时缓存自然失效。
+        只有在构造之后修改了异常信息(比如final_exc_str)时才需要调用。
+        """
+        queue = [self]
+        while queue:
+            exc = queue.pop()
+            exc._suggest_handler = None
+            exc._exc_only_cache.clear()
+            exc._render_cache.clear()
+            queue.extend(e for e in (exc.__cause__, exc.__context__) if e is not None)
+            if exc.exceptions:
+                queue.extend(exc.exceptions)
+
     def __str__(self):
         return self.final_exc_str
 
     def format_exception_only(self):
         """格式化回溯中的异常部分。
 
+        结果按(语言, 配置版本)缓存，切换语言时只重新生成文本，不重新选择处理器。
+
         返回值是一个字符串Generator，每个字符串以换行符结尾。
 
         生成器会生成异常消息。
@@ -942,6 +1332,13 @@ class KTBException:
         显示语法错误发生的详细位置信息。
         在异常消息之后，生成器还会生成该异常的所有 ``__notes__`` 属性内容。
         """
+        key = (rc.lang, rc.version)
+        lines = self._exc_only_cache.get(key)
+        if lines is None:
+            lines = self._exc_only_cache[key] = tuple(self._format_exception_only())
+        yield from lines
+
+    def _format_exception_only(self):
         if self.exc_type is None:
             if self.final_exc_str is None or not self.final_exc_str:
                 yield rc.exc_line("UnknownError")
@@ -956,16 +1353,7 @@ class KTBException:
                 smod = "<unknown>"
             stype = smod + '.' + stype
 
-        # 选择一个处理器，让它提提建议
-        hi_priority = -1
-        hi_priority_handler = None
-        for handler in self._handlers:
-            if handler.can_handle(self) and handler.priority > hi_priority:
-                hi_priority = handler.priority
-                hi_priority_handler = handler
-
-        assert hi_priority_handler is not None, "No handler found for this exception. Use KTBException by `from kawaiitb import KTBException`"
-        yield from hi_priority_handler.handle(self)
+        yield from self._select_handler().handle(self)
 
 
         if (
@@ -979,6 +1367,21 @@ class KTBException:
             yield "{}\n".format(safe_string(self.__notes__, '__notes__', func=repr))
 
 
+    def _select_handler(self) -> "ErrorSuggestHandler":
+        """选择一个处理器，让它提提建议。旧式处理器的can_handle可能做分析，所以选择结果只算一次"""
+        if self._suggest_handler is not None:
+            return self._suggest_handler
+        hi_priority = -1
+        hi_priority_handler = None
+        for handler in self._handlers:
+            if handler.can_handle(self) and handler.priority > hi_priority:
+                hi_priority = handler.priority
+                hi_priority_handler = handler
+
+        assert hi_priority_handler is not None, "No handler found for this exception. Use KTBException by `from kawaiitb import KTBException`"
+        self._suggest_handler = hi_priority_handler
+        return hi_priority_handler
+
     def format(self, *, chain=True, _ctx=None) -> Generator[str, None, None]:
         """格式化异常.
 
@@ -990,11 +1393,26 @@ class KTBException:
 
         The message indicating which exception occurred is always the last
         string in the output.
+
+        渲染结果按(chain, 语言, 配置版本)缓存，同一个异常多次格式化(控制台、日志、错误页)只渲染一次。
+        未命中缓存时仍然边渲染边产生。
         """
+        if _ctx is not None:  # 异常组内部的递归调用，输出依赖上下文的缩进，不缓存
+            yield from self._format(chain=chain, _ctx=_ctx)
+            return
 
-        if _ctx is None:
-            _ctx = ExceptionPrintContext()
+        key = (chain, rc.lang, rc.version)
+        lines = self._render_cache.get(key)
+        if lines is not None:
+            yield from lines
+            return
+        rendered = []
+        for line in self._format(chain=chain, _ctx=ExceptionPrintContext()):
+            rendered.append(line)
+            yield line
+        self._render_cache[key] = tuple(rendered)
 
+    def _format(self, *, chain, _ctx) -> Generator[str, None, None]:
         output: list[tuple[Optional[str], Optional[KTBException]]] = []
         exc = self
         if chain:
@@ -1079,10 +1497,10 @@ class KTBException:
                     assert _ctx.exception_group_depth == 1
                     _ctx.exception_group_depth = 0
 
-    def print(self, *, file=None, chain=True):
-        """Print the result of self.format(chain=chain) to 'file'."""
-        if file is None:
-            file = sys.stderr
-        for line in self.format(chain=chain):
-            print(line, file=file, end="")
+    def print(self, *, file=None, chain=True, streaming=None):
+        """Print the result of self.format(chain=chain) to 'file'.
+
+        默认拼好整个traceback后一次写出，streaming为True(或配置了config.output.streaming)时逐行写出。
+        """
+        write_traceback(self.format(chain=chain), file, streaming=streaming)
 
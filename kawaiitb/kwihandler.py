@@ -1,15 +1,13 @@
 """
 这里定义错误处理器的基类，动态扩展的示例将在这里展示。
 """
-import linecache
 from types import TracebackType
 from typing import Generator, Any, Type, final
 
-import astroid
-
 from kawaiitb.kraceback import KTBException, FrameSummary
 from kawaiitb.runtimeconfig import rc
-from kawaiitb.utils.ast_parse import astroid_walk_inside
+from kawaiitb.utils.ast_parse import parse_file, parse_statement, walk_inside
+from kawaiitb.utils.fromtraceback import FailingOperation, get_code_position, locate_failing_operation
 
 __all__ = [
     "ErrorSuggestHandler"
@@ -21,8 +19,17 @@ class ErrorSuggestHandler:
     异常处理器的基类。
 
     优先级最高的处理器会最先认领异常。
-    在KTBException初始化时会顺带初始化所有的处理器。
-    在格式化时，KTBException传入自身并判断各处理器是否能处理异常，然后选择优先级最高的处理器。
+    处理器的生命周期分为两个阶段：
+    1. 声明(类级别，很便宜): 通过`exc_types`声明能处理的异常类型(默认为BaseException，即所有异常)，
+       再通过类方法`applies`根据异常值做进一步判断。KTBException初始化时只用这两者挑出优先级最高的处理器，
+       不会构建落选的处理器。
+    2. 捕获(实例级别，可能很贵): 只有胜出的处理器会被构建，并在异常仍然存活时调用`capture`，
+       把建议所需的信息(dir()、语法树分析、断言的值等)提取成普通数据保存下来。
+       capture之后traceback可能被释放、帧可能被清理，所以不要在实例上保存异常、帧或traceback的引用。
+    格式化时，KTBException调用胜出处理器的`handle`生成文本。
+
+    兼容旧式处理器：重写了`can_handle`的处理器被视为旧式处理器，
+    它们仍会在KTBException初始化时被构建(只要声明的类型匹配)，并在格式化时通过can_handle参与竞争。
 
     优先级原则：
     - 仅ErrorSuggestHandler父类使用0.0优先级。低于此优先级的均不可能认领。
@@ -41,33 +48,59 @@ class ErrorSuggestHandler:
     # 所有有效的处理器都应该高于此优先级以覆盖处理。
     # 所有不生效(如仅翻译)的处理器都应该低于此优先级。建议使用标准的: -1.0.
 
+    __exc_types__: tuple[Type[BaseException], ...] = (BaseException,)  # 声明能处理的异常类型
+    # KTBException按异常类型的MRO查找处理器，声明类型之外的异常不会构建本处理器。
+
     def __init__(self, exc_type: Type[BaseException], exc_value: BaseException, exc_traceback: TracebackType, *, limit=None,
                  lookup_lines=True, capture_locals=False, compact=False,
                  max_group_width=15, max_group_depth=10, _seen=None):
         ...
-        # 此处可以添加一些初始化逻辑，比如确定自己能不能处理这个异常。
-        # 也可以根据这个异常帧的信息处理一些值。
+        # 新式处理器不需要重写__init__，耗时的信息提取请放到capture中。
+        # 旧式处理器可以在这里确定自己能不能处理这个异常，并根据这个异常帧的信息处理一些值。
         # 上面传入的东西就是一个异常发生时所有传给你的信息，包括异常的语句，上下文代码，这这那那的。
-        # 可以看一些预设的处理器了解一下如何处理这些信息。
 
         # 另外，如果你是直接继承的ErrorSuggestHandler，其实可以省略super调用，
         # 因为init实际上并没有做什么……
 
-        # 如果也不需要后面的设置，可以用**kwargs来收取所有参数，然后按需提取和忽略。、
+        # 如果也不需要后面的设置，可以用**kwargs来收取所有参数，然后按需提取和忽略。
 
-    def __init_subclass__(cls, priority):
+    def __init_subclass__(cls, priority, exc_types=None):
         """
         初始化子类时，自动注册翻译键。
         可以通过priority参数来设置处理器的优先级。
->>> class MyHandler(ErrorSuggestHandler, priority=2.0):
+        可以通过exc_types参数声明处理器能处理的异常类型(单个类型或元组)，未声明时沿用父类的声明。
+>>> class MyHandler(ErrorSuggestHandler, priority=2.0, exc_types=ImportError):
 >>>     ...
         """
         cls.__priority__ = priority
+        if exc_types is not None:
+            cls.__exc_types__ = exc_types if isinstance(exc_types, tuple) else (exc_types,)
 
     @property
     def priority(self) -> float:
         return self.__priority__
 
+    @classmethod
+    def is_legacy(cls) -> bool:
+        """是否为重写了can_handle的旧式处理器。"""
+        return cls.can_handle is not ErrorSuggestHandler.can_handle
+
+    @classmethod
+    def applies(cls, exc_type: Type[BaseException], exc_value: BaseException) -> bool:
+        """
+        类级别的判断：在`exc_types`之外，根据异常值判断本处理器是否适用。
+        这里会对每个候选处理器调用，所以只应该做很便宜的检查，比如读取异常的属性。
+        """
+        return True
+
+    def capture(self, ktb_exc: KTBException, exc_value: BaseException, exc_traceback: TracebackType) -> None:
+        """
+        在异常仍然存活时提取建议所需的信息。只有胜出的处理器会被调用。
+
+        此时ktb_exc的stack、exc_type、exc_str等已经提取完毕，但__cause__等链式异常还没有。
+        请把结果保存为普通数据(字符串、数字、列表...)，不要保存异常值、帧或traceback本身。
+        """
+
     def can_handle(self, ktb_exc: KTBException) -> bool:
         """返回本处理器是否能处理异常。"""
         # 处理器接受异常需要满足以下条件：
@@ -77,7 +110,10 @@ class ErrorSuggestHandler:
         # 但前者只是基本的找不到包提醒，后者则是提供了更详细的解决方案，提示用户应该导入的是yaml。
         # 所以优先级PyyamlNotFoundErrorHandler(4.0) > ModuleNotFoundErrorHandler(2.0)。
 
-        return True  # 当然这里是基处理器，要处理所有异常
+        # 新式处理器在构建前已经由exc_types和applies筛选过了，这里只需确认类型。
+        # 旧式处理器重写此方法，在格式化时判断。
+        exc_type = ktb_exc.exc_type
+        return exc_type is None or issubclass(exc_type, self.__exc_types__)
 
     @classmethod
     def translation_keys(cls) -> dict[str, dict[str, Any]]:
@@ -104,25 +140,91 @@ class ErrorSuggestHandler:
             stype = smod + '.' + stype
         yield rc.exc_line(stype, ktb_exc.final_exc_str)
 
+    def findings(self) -> dict[str, Any]:
+        """
+        capture提取的信息，作为结构化数据导出(见KTBException.to_dict)，不经过翻译。
+        默认导出实例上所有公开的、由基本类型(字符串、数字、布尔、None及其列表和字典)组成的属性。
+        有更合适的表示(比如计算好的建议而不是原始候选列表)时请重写。
+        """
+        return {name: value for name, value in vars(self).items()
+                if not name.startswith("_") and _is_plain_data(value)}
+
+    @staticmethod
+    @final
+    def locate_operation_from_exc(exc_frame: FrameSummary,
+                                  exc_traceback: TracebackType | None) -> FailingOperation | None:
+        """
+        不解析源码，直接从字节码定位帧中出错的操作(除法、属性访问、函数调用、导入)。
+        exc_frame应为ktb_exc.stack[0]，它与traceback的第一帧对不上(如设置了limit)，
+        或者操作无法确定时返回None，这时应该回退到query_ast_from_exc。
+        """
+        if exc_traceback is None:
+            return None
+        code = exc_traceback.tb_frame.f_code
+        lasti = exc_traceback.tb_lasti
+        lineno, _, colno, _ = get_code_position(code, lasti)
+        if code.co_filename != exc_frame.filename or lineno != exc_frame.lineno or colno != exc_frame.colno:
+            return None
+        return locate_failing_operation(code, lasti)
+
+    @staticmethod
+    @final
+    def query_ast_from_exc(exc_frame: FrameSummary, parse_line=False):
+        """
+        从一个帧中解析并产生相关的AST节点(标准库ast节点，带有parent属性)。
+        源码无法解析时不产生任何节点。内置处理器都使用这个方法。
+        """
+        start_line = exc_frame.lineno
+        end_line = exc_frame.end_lineno
+        start_col = 0 if parse_line else exc_frame.colno
+        end_col = 99999999 if parse_line else exc_frame.end_colno
+        # 先只解析出错的那条语句，无法单独解析时才解析整个文件
+        tree = parse_statement(exc_frame.filename, start_line, end_line)
+        if tree is None:
+            tree = parse_file(exc_frame.filename)
+        if tree is None:
+            return
+
+        yield from walk_inside(tree, start_line, end_line, start_col, end_col)
+
     @staticmethod
     @final
     def parse_ast_from_exc(exc_frame: FrameSummary, parse_line=False):
         """
-        从一个帧中解析并产生相关的AST节点
+        从一个帧中解析并产生相关的astroid节点。
+        需要astroid的类型推断时使用，需要额外安装astroid(pip install kawaii-traceback[astroid])。
         """
+        from kawaiitb.utils.ast_parse import astroid_parse_file, astroid_walk_inside  # astroid很重，用到时才导入
+
         start_line = exc_frame.lineno
         end_line = exc_frame.end_lineno
         start_col = 0 if parse_line else exc_frame.colno
         end_col = 99999999 if parse_line else exc_frame.end_colno
-        tree = astroid.parse("".join(linecache.getlines(exc_frame.filename)))
+        tree = astroid_parse_file(exc_frame.filename)
 
         yield from astroid_walk_inside(tree, start_line, end_line, start_col, end_col)
 
 
 
 
+_PLAIN_SCALARS = (str, int, float, bool, type(None))
+
+
+def _is_plain_data(value, depth=0) -> bool:
+    """value是否能原样编码为JSON"""
+    if isinstance(value, _PLAIN_SCALARS):
+        return True
+    if depth >= 4:
+        return False
+    if isinstance(value, (list, tuple)):
+        return all(_is_plain_data(item, depth + 1) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and _is_plain_data(item, depth + 1) for key, item in value.items())
+    return False
+
+
 # 以下是示例代码
-class ImportErrorHandler(ErrorSuggestHandler, priority=2.0):
+class ImportErrorHandler(ErrorSuggestHandler, priority=2.0, exc_types=ImportError):
     ...
 
 #@KTBException.register  # 使用装饰器可以注册处理器。本示例中暂不使用。
@@ -130,22 +232,20 @@ class PyYamlImportErrorHandler(ImportErrorHandler, priority=4.0):
     """
     在pyyaml导入失败时提供更详细的解决方案。
 
-    一个Handler将在KTBException初始化时被初始化
-    初始化时，__init__会被传入异常的所有原始参数
-    (不需要的参数可以用**kwargs原样丢回super)
-    之后，KTBException会调用can_handle来判断是否能处理异常
-    如果最终以最高优先级被选中，则会调用handle来处理异常
+    一个Handler的生命周期:
+    1. KTBException初始化时，按exc_types(此处继承自ImportErrorHandler的ImportError)和applies
+       在类级别筛选候选处理器，这一步不会构建任何处理器
+    2. 优先级最高的候选处理器被构建，__init__会被传入异常的所有原始参数
+       (不需要的参数可以用**kwargs原样丢回super，不需要的话也可以不重写__init__)
+    3. 随后调用capture，在异常仍然存活时提取需要的信息
+    4. 格式化时调用handle来处理异常
     """
-    def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
-        super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
 
+    @classmethod
+    def applies(cls, exc_type, exc_value) -> bool:
         # 检查是否是pyyaml相关的导入错误
-        # 这里从__init__接受的参数的一部分也可以在后面从KTBException中获取,
-        # 但其中的一些参数可能会在处理时被修改，所以最好还是从这里获取。
-        # 如果需要修改后的参数，可以在handle中获取。
-
-        self._can_handle = (issubclass(exc_type, ImportError) and
-                            getattr(exc_value, "name", "") == "pyyaml")
+        # 这里对每个候选处理器都会调用，只做便宜的检查
+        return getattr(exc_value, "name", "") == "pyyaml"
 
     # 注册扩展翻译键到运行时配置，以供后续使用
     @classmethod
@@ -164,11 +264,6 @@ class PyYamlImportErrorHandler(ImportErrorHandler, priority=4.0):
             }
         }
 
-    def can_handle(self, ktb_exc) -> bool:
-        # 因为__init__和can_handle都是每个handle的必经之路
-        # 所以在那边存储在这处理和直接在那处理保存结果效率都差不多
-        return self._can_handle
-
     def handle(self, ktb_exc) -> Generator[str, None, None]:
         """
         1. 继承原则
@@ -184,10 +279,10 @@ class PyYamlImportErrorHandler(ImportErrorHandler, priority=4.0):
         但我强烈建议你使用翻译, 并至少准备default的英语语种.
         这样你的代码可以令全世界程序员都能看懂.
         3. yield原则
-        如上, __init__和can_handle都是每个handle的必经之路,
-        但只有handle是处理器确定要处理异常时才会被调用.
-        只有在handle中, 你才能处理一些真正耗时的部分,
-        比如复杂的ast解析等.
+        如上, applies是每个候选处理器的必经之路,
+        但只有capture和handle是处理器确定要处理异常时才会被调用.
+        真正耗时的部分，比如复杂的ast解析等，应该放在capture(需要存活的异常/帧时)
+        或handle(只需要KTBException中的信息时)中.
         大量的处理器在初始化时一个个做这件事是很不划算的.
         """
         yield from super().handle(ktb_exc)
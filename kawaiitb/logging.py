@@ -0,0 +1,166 @@
+"""
+logging集成。
+
+KawaiiFormatter用KTBException格式化日志记录里的异常和调用栈:
+>>> import logging
+>>> from kawaiitb.logging import KawaiiFormatter
+>>> handler = logging.StreamHandler()
+>>> handler.setFormatter(KawaiiFormatter("%(levelname)s %(message)s"))
+>>> logging.getLogger().addHandler(handler)
+
+同一条记录常常会发给好几个处理器(控制台、文件、socket)。
+异常和调用栈的渲染结果按(异常, 语言, 配置版本)缓存在记录上，所以每条记录只美化一次。
+语言或配置变化后缓存自然失效。(内置异常不支持弱引用，所以不用弱引用表按异常缓存)
+
+标准库的Formatter会把格式化结果写进record.exc_text，之后所有格式化器都直接用它。
+KawaiiFormatter不读也不写exc_text(只有exc_info已经被丢弃时才用它)，
+这样和普通的Formatter挂在同一个logger上时互不干扰。
+"""
+import logging
+import sys
+import threading
+from typing import TYPE_CHECKING
+
+from kawaiitb.runtimeconfig import rc
+from kawaiitb.utils import safe_string
+
+if TYPE_CHECKING:
+    from kawaiitb.dedup import Deduplicator
+
+__all__ = [
+    "KawaiiFormatter",
+]
+
+_EXC_CACHE_ATTR = "_kawaiitb_exc_text"
+_STACK_CACHE_ATTR = "_kawaiitb_stack_text"
+_DEDUP_ATTR = "_kawaiitb_dedup"
+RATELIMIT_SUMMARY_ATTR = "kawaiitb_ratelimit_summary"  # RateLimiter作为过滤器时，汇总行挂在记录的这个属性上
+
+
+class KawaiiFormatter(logging.Formatter):
+    """
+    使用KawaiiTB格式化异常和调用栈的logging.Formatter。
+
+    stack_info=True时，如果记录是在当前线程里同步处理的，调用栈从仍然存活的帧中重新提取，
+    用KawaiiTB的格式输出；否则(QueueHandler等异步处理)原样使用标准库生成的调用栈文本。
+
+    传入dedup(kawaiitb.dedup.Deduplicator)时，窗口内重复的异常回溯不再渲染，只输出一行带重复次数的说明，
+    窗口结束后的汇总行附在下一次完整渲染的异常回溯前面。
+
+    限流器(kawaiitb.ratelimit.RateLimiter)作为过滤器挂在logger或handler上时，
+    它挂在记录上的汇总行由KawaiiFormatter附在消息后面输出。
+    """
+
+    def __init__(self, *args, chain: bool = True, dedup: "Deduplicator | None" = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chain = chain
+        self.dedup = dedup
+
+    def formatException(self, ei) -> str:
+        _, value, tb = ei
+        if value is None:
+            return super().formatException(ei)
+        try:
+            from kawaiitb.kraceback import KTBException
+            text = "".join(KTBException(type(value), value, tb, compact=True).format(chain=self.chain))
+        except Exception:  # 日志里的异常格式化失败不能影响业务，退回标准库的格式
+            return super().formatException(ei)
+        if text[-1:] == "\n":
+            text = text[:-1]
+        return text
+
+    def _cached_exception_text(self, record: logging.LogRecord) -> str:
+        """record.exc_info的渲染结果，按(异常, 语言, 配置版本)缓存在记录上"""
+        cached = getattr(record, _EXC_CACHE_ATTR, None)
+        if cached is not None and cached[0] == self._exc_cache_key(record):
+            return cached[1]
+        if self.dedup is None:
+            text = self.formatException(record.exc_info)
+        else:
+            text = self._deduplicated_exception_text(record)
+        # 第一次渲染时会加载默认处理器，配置版本随之变化，所以键在渲染之后再取
+        setattr(record, _EXC_CACHE_ATTR, (self._exc_cache_key(record), text))
+        return text
+
+    def _deduplicated_exception_text(self, record: logging.LogRecord) -> str:
+        # 去重的判断也记在记录上，同一条记录发给多个处理器、或者换了语言重新渲染时不会重复计数
+        decision = getattr(record, _DEDUP_ATTR, None)
+        if decision is None or decision[0] is not self.dedup:
+            value = record.exc_info[1]
+            if value is None:
+                return self.formatException(record.exc_info)
+            fingerprint, repeat = self.dedup.hit(value)
+            decision = (self.dedup, fingerprint, repeat, "" if repeat else "".join(self.dedup.pop_summaries()))
+            setattr(record, _DEDUP_ATTR, decision)
+        _, fingerprint, repeat, summaries = decision
+        if not repeat:
+            return summaries + self.formatException(record.exc_info)
+
+        from kawaiitb.kraceback import _exc_type_name
+        value = record.exc_info[1]
+        text = rc.translate("dedup.omitted", etype=_exc_type_name(type(value)), value=safe_string(value, "exception"),
+                            fingerprint=fingerprint, count=repeat)
+        return text[:-1] if text[-1:] == "\n" else text
+
+    def _exc_cache_key(self, record: logging.LogRecord) -> tuple:
+        return id(record.exc_info[1]), rc.lang, rc.version, self.chain
+
+    def formatStack(self, stack_info, record: logging.LogRecord | None = None) -> str:
+        if record is None:
+            return super().formatStack(stack_info)
+        cached = getattr(record, _STACK_CACHE_ATTR, None)
+        if cached is not None and cached[0] == (rc.lang, rc.version):
+            return cached[1]
+
+        frame = _find_record_frame(record)
+        if frame is None:
+            return super().formatStack(stack_info)
+        try:
+            from kawaiitb.kraceback import extract_stack
+            text = rc.translate("stack.stack_info") + "".join(extract_stack(frame).format())
+        except Exception:
+            return super().formatStack(stack_info)
+        finally:
+            del frame
+        if text[-1:] == "\n":
+            text = text[:-1]
+        setattr(record, _STACK_CACHE_ATTR, ((rc.lang, rc.version), text))
+        return text
+
+    def format(self, record: logging.LogRecord) -> str:
+        # 与logging.Formatter.format相同，只是异常文本不经过record.exc_text
+        record.message = record.getMessage()
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+        s = self.formatMessage(record)
+        if record.exc_info:
+            exc_text = self._cached_exception_text(record)
+        else:
+            exc_text = record.exc_text
+        if exc_text:
+            if s[-1:] != "\n":
+                s = s + "\n"
+            s = s + exc_text
+        if record.stack_info:
+            if s[-1:] != "\n":
+                s = s + "\n"
+            s = s + self.formatStack(record.stack_info, record)
+        if summaries := getattr(record, RATELIMIT_SUMMARY_ATTR, None):
+            if s[-1:] != "\n":
+                s = s + "\n"
+            s = s + summaries[:-1]
+        return s
+
+
+def _find_record_frame(record: logging.LogRecord):
+    """在当前线程的调用栈中找到产生这条记录的帧，找不到时返回None"""
+    if record.thread != threading.get_ident():
+        return None
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if frame.f_lineno == record.lineno and code.co_name == record.funcName and \
+                code.co_filename == record.pathname:
+            return frame
+        frame = frame.f_back
+    return None
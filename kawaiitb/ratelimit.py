@@ -0,0 +1,215 @@
+"""
+异常报告的限流。
+
+错误风暴时(下游挂了、配置写错了……)，每个异常都提取栈、美化、输出，会拖垮进程本身和日志管道。
+RateLimiter给每个异常回溯的指纹(见kawaiitb.utils.fingerprint)一个令牌桶，再加一个全局令牌桶。
+超出限制的异常只计数: 判断发生在提取StackSummary之前，只需要遍历traceback算一次指纹，几乎没有开销。
+每个指纹的第一次抑制开启一个时间窗口，窗口结束时产生一行汇总:
+    [KawaiiTB] ValueError in [requests] sessions.py: 4,812 suppressed in last 60s
+
+usage:
+>>> limiter = RateLimiter(rate=1, burst=5, global_rate=20, global_burst=100)
+>>> if limiter.allow(exc):
+...     KTBException.from_exception(exc).print()
+>>> for line in limiter.pop_summaries():
+...     sys.stderr.write(line)
+
+RateLimiter也可以作为logging的过滤器(handler.addFilter(limiter))，超出限制的带异常的记录会被丢弃，
+汇总行挂在下一条通过的记录上，由KawaiiFormatter输出。
+excepthook(配置config.ratelimit.*)和KTBReporter的ratelimit参数也使用它。
+"""
+import logging
+import threading
+import time
+from typing import Callable
+
+from kawaiitb.dedup import _etype_of
+from kawaiitb.kraceback import ENV, KTBException
+from kawaiitb.logging import RATELIMIT_SUMMARY_ATTR
+from kawaiitb.runtimeconfig import rc
+from kawaiitb.utils import get_frame_abs_filename, parse_filename_sp_namespace
+from kawaiitb.utils.fingerprint import FingerprintLines, fingerprint_exception
+
+__all__ = [
+    "TokenBucket",
+    "RateLimiter",
+]
+
+
+class TokenBucket:
+    """
+    令牌桶。桶里最多有capacity个令牌，每秒补充rate个，每次take消耗一个。
+    不是线程安全的，RateLimiter在锁里使用它。
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        if rate < 0 or capacity < 1:
+            raise ValueError("[KawaiiTB] rate must be non-negative and capacity at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        """取一个令牌，桶空时返回False"""
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def give_back(self):
+        """退还刚取出的令牌"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class _Suppressed:
+    __slots__ = ("start", "count", "etype", "origin")
+
+    def __init__(self, start: float, etype: str, origin: tuple[str, str] | None):
+        self.start = start
+        self.count = 0
+        self.etype = etype
+        self.origin = origin
+
+
+def _origin_of(exc: BaseException | KTBException) -> tuple[str, str] | None:
+    """最内层帧的(命名空间, 显示文件名)，汇总时显示异常发生的位置。每个窗口只取一次"""
+    if isinstance(exc, KTBException):
+        if not exc.stack:
+            return None
+        frame = exc.stack[-1]
+        return frame.namespace, frame.refined_filename
+    tb = exc.__traceback__
+    if tb is None:
+        return None
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    ENV.sync_cwd()
+    return parse_filename_sp_namespace(get_frame_abs_filename(tb.tb_frame), ENV)
+
+
+class RateLimiter:
+    """
+    按指纹和全局两级令牌桶限流。线程安全。
+
+    :param rate: 每个指纹每秒补充的令牌数，None表示不按指纹限流。
+    :param burst: 每个指纹的桶容量，即允许的突发数。
+    :param global_rate: 全局每秒补充的令牌数，None表示不限制总量。
+    :param global_burst: 全局桶容量。
+    :param window: 汇总窗口(秒)。
+    :param maxsize: 最多跟踪的指纹数，超出时丢弃最久没有出现的指纹的桶(它的汇总会提前产生)。
+    :param chain, lines, collapse_recursion: 计算指纹的选项，见kawaiitb.utils.fingerprint。
+    :param clock: 时钟，默认time.monotonic。
+    """
+
+    def __init__(self, rate: float | None = 1.0, burst: float = 10, *,
+                 global_rate: float | None = None, global_burst: float = 100,
+                 window: float = 60.0, maxsize: int = 4096, chain: bool = True,
+                 lines: FingerprintLines | None = None, collapse_recursion: bool | None = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if window <= 0:
+            raise ValueError("[KawaiiTB] window must be positive")
+        if maxsize <= 0:
+            raise ValueError("[KawaiiTB] maxsize must be positive")
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.maxsize = maxsize
+        self.chain = chain
+        self.lines = lines
+        self.collapse_recursion = collapse_recursion
+        self._clock = clock
+        now = clock()
+        if rate is not None:
+            TokenBucket(rate, burst, now)  # 参数不合法时在这里就报错，而不是第一次限流时
+        self._global = TokenBucket(global_rate, global_burst, now) if global_rate is not None else None
+        self._buckets: dict[str, TokenBucket] = {}  # 按最近出现的先后排列
+        self._suppressed: dict[str, _Suppressed] = {}  # 按窗口开始的先后排列
+        self._ended: list[_Suppressed] = []
+        self._lock = threading.Lock()
+
+    def fingerprint(self, exc: BaseException | KTBException) -> str:
+        if isinstance(exc, KTBException):
+            return exc.fingerprint(chain=self.chain, lines=self.lines, collapse_recursion=self.collapse_recursion)
+        return fingerprint_exception(exc, chain=self.chain, lines=self.lines, collapse_recursion=self.collapse_recursion)
+
+    def allow(self, exc: BaseException | KTBException) -> bool:
+        """是否允许报告这个异常。不允许时只计数"""
+        fingerprint = self.fingerprint(exc) if self.rate is not None else None
+        now = self._clock()
+        with self._lock:
+            bucket = None
+            if fingerprint is not None:
+                bucket = self._buckets.pop(fingerprint, None)
+                if bucket is None:
+                    bucket = TokenBucket(self.rate, self.burst, now)
+                self._buckets[fingerprint] = bucket  # 移到最后
+                if len(self._buckets) > self.maxsize:
+                    del self._buckets[next(iter(self._buckets))]
+                if not bucket.take(now):
+                    self._count(fingerprint, exc, now)
+                    return False
+            if self._global is not None and not self._global.take(now):
+                if bucket is not None:
+                    bucket.give_back()  # 没有报告出去，不占用这个指纹的配额
+                self._count(fingerprint or self.fingerprint(exc), exc, now)
+                return False
+            return True
+
+    def _count(self, fingerprint: str, exc, now: float):
+        suppressed = self._suppressed.get(fingerprint)
+        if suppressed is not None and now - suppressed.start >= self.window:
+            self._ended.append(self._suppressed.pop(fingerprint))
+            suppressed = None
+        if suppressed is None:
+            suppressed = self._suppressed[fingerprint] = _Suppressed(
+                now, _etype_of(exc), _origin_of(exc))
+            if len(self._suppressed) > self.maxsize:
+                self._ended.append(self._suppressed.pop(next(iter(self._suppressed))))
+        suppressed.count += 1
+
+    def pop_summaries(self) -> list[str]:
+        """结束所有已经到期的窗口，返回它们的汇总行"""
+        now = self._clock()
+        with self._lock:
+            for fingerprint, suppressed in list(self._suppressed.items()):
+                if now - suppressed.start < self.window:
+                    break  # 窗口按开始的先后排列，后面的都还没到期
+                self._ended.append(self._suppressed.pop(fingerprint))
+            return self._take_summaries(now)
+
+    def flush(self) -> list[str]:
+        """结束所有窗口(比如退出前)，返回汇总行"""
+        now = self._clock()
+        with self._lock:
+            self._ended.extend(self._suppressed.values())
+            self._suppressed.clear()
+            return self._take_summaries(now)
+
+    def _take_summaries(self, now: float) -> list[str]:
+        ended, self._ended = self._ended, []
+        return [rc.translate("ratelimit.summary", etype=suppressed.etype, location=self._location(suppressed.origin),
+                             count=suppressed.count, window=min(now - suppressed.start, self.window))
+                for suppressed in ended]
+
+    @staticmethod
+    def _location(origin: tuple[str, str] | None) -> str:
+        if origin is None:
+            return "<unknown>"
+        namespace, display = origin
+        if namespace in (".", ""):  # 与栈帧的显示相同，当前目录的文件不显示命名空间
+            return display
+        return rc.translate("config.file.parsed_filename", namespace=namespace, filename=display)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """作为logging过滤器使用: 丢弃超出限制的带异常的记录，汇总行挂在下一条通过的记录上"""
+        exc = record.exc_info[1] if record.exc_info else None
+        if exc is not None and not self.allow(exc):
+            return False
+        if summaries := self.pop_summaries():
+            setattr(record, RATELIMIT_SUMMARY_ATTR, getattr(record, RATELIMIT_SUMMARY_ATTR, "") + "".join(summaries))
+        return True
@@ -0,0 +1,221 @@
+"""
+在后台线程里渲染和输出已处理的异常。
+
+长时间运行的服务里，被捕获的异常也常常需要打印出来，
+但语法树分析、建议计算、路径分类这些美化工作不应该拖慢请求线程。
+
+KTBReporter.report在调用线程里只做快照: 构造KTBException
+(提取帧和位置、异常类型和字符串、处理器capture的数据)，不持有异常、帧或traceback的引用。
+快照放进有界队列，由后台线程调用format()渲染并写出。
+
+usage:
+>>> reporter = KTBReporter(overflow="drop_old")
+>>> try:
+...     handle_request()
+... except Exception as e:
+...     reporter.report(e)
+>>> reporter.close()  # 退出前写完队列里剩下的异常
+"""
+import atexit
+import itertools
+import queue
+import sys
+import threading
+import time
+from traceback import format_exception as orig_format_exception
+from typing import Literal, TextIO, TYPE_CHECKING
+
+from kawaiitb.kraceback import KTBException, write_traceback
+
+if TYPE_CHECKING:
+    from kawaiitb.dedup import Deduplicator
+    from kawaiitb.ratelimit import RateLimiter
+
+__all__ = [
+    "KTBReporter",
+    "OverflowPolicy",
+]
+
+OverflowPolicy = Literal["drop_new", "drop_old", "block"]
+_OVERFLOW_POLICIES = ("drop_new", "drop_old", "block")
+_STOP = object()  # 通知后台线程退出
+
+
+class KTBReporter:
+    """
+    异步的异常报告器。
+
+    :param file: 输出位置，默认为渲染时的sys.stderr。
+    :param maxsize: 队列中最多等待渲染的异常数。
+    :param overflow: 队列满时的策略:
+        - "drop_new": 丢弃新报告的异常(默认，报告永远不会阻塞)
+        - "drop_old": 丢弃队列中最旧的异常
+        - "block": 等待队列有空位，可以用report的timeout限制等待时间，超时则丢弃
+    :param chain: 是否输出异常链。
+    :param flush_at_exit: 解释器退出时是否写完队列里剩下的异常。
+    :param dedup: 去重器(kawaiitb.dedup.Deduplicator)。窗口内重复的异常在report时直接丢弃，不做快照，
+        窗口结束后的汇总行在下一次写出时或关闭时输出。
+    :param ratelimit: 限流器(kawaiitb.ratelimit.RateLimiter)。超出限制的异常在report时只计数，不做快照，
+        汇总行的输出时机与dedup相同。
+    """
+
+    def __init__(self, file: TextIO | None = None, *, maxsize: int = 1024, overflow: OverflowPolicy = "drop_new",
+                 chain: bool = True, flush_at_exit: bool = True, dedup: "Deduplicator | None" = None,
+                 ratelimit: "RateLimiter | None" = None):
+        if overflow not in _OVERFLOW_POLICIES:
+            raise ValueError(f"[KawaiiTB] Invalid overflow policy {overflow!r}, expected one of {_OVERFLOW_POLICIES}")
+        if maxsize <= 0:
+            raise ValueError("[KawaiiTB] maxsize must be positive")
+        self.file = file
+        self.overflow = overflow
+        self.chain = chain
+        self.dedup = dedup
+        self.ratelimit = ratelimit
+        self._queue: "queue.Queue[KTBException | object]" = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._dropped = 0
+        self._flush_at_exit = flush_at_exit
+        if flush_at_exit:
+            atexit.register(self.close)
+
+    @property
+    def dropped(self) -> int:
+        """因为队列满而丢弃的异常数"""
+        return self._dropped
+
+    @property
+    def pending(self) -> int:
+        """还没有写出的异常数(包括正在渲染的)"""
+        return self._queue.unfinished_tasks
+
+    def report(self, exc: BaseException | None = None, *, timeout: float | None = None) -> bool:
+        """
+        报告一个异常。exc为None时报告当前正在处理的异常。
+        返回异常是否进入了队列(被丢弃或报告器已关闭时返回False)。
+        """
+        if exc is None:
+            exc = sys.exc_info()[1]
+            if exc is None:
+                return False
+        if self._closed:
+            return False
+        if self.ratelimit is not None and not self.ratelimit.allow(exc):
+            return False
+        if self.dedup is not None and self.dedup.hit(exc)[1]:
+            return False
+        snapshot = KTBException(type(exc), exc, exc.__traceback__, compact=True)
+        self._ensure_worker()
+        return self._put(snapshot, timeout)
+
+    def _put(self, snapshot: KTBException, timeout: float | None) -> bool:
+        if self.overflow == "block":
+            try:
+                self._queue.put(snapshot, timeout=timeout)
+                return True
+            except queue.Full:
+                self._count_dropped()
+                return False
+
+        while True:
+            try:
+                self._queue.put_nowait(snapshot)
+                return True
+            except queue.Full:
+                if self.overflow == "drop_new":
+                    self._count_dropped()
+                    return False
+            # drop_old: 挤掉最旧的一个再试。并发时可能被别的线程抢先，所以要循环
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._queue.task_done()
+            self._count_dropped()
+
+    def _count_dropped(self):
+        with self._lock:
+            self._dropped += 1
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="kawaiitb-reporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._write(item)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, snapshot: KTBException):
+        file = self.file if self.file is not None else sys.stderr
+        try:
+            summaries = self._pop_summaries()
+            write_traceback(itertools.chain(summaries, snapshot.format(chain=self.chain)), file, streaming=False)
+        except Exception as ktb_self_raised_exc:
+            # 渲染失败时至少留下原始的异常信息，后台线程不能因此退出
+            try:
+                file.write(
+                    f"{getattr(snapshot.exc_type, '__qualname__', snapshot.exc_type)}: {snapshot.exc_str}\n"
+                    "\nKawaiiTB occurred another exception while formatting this exception:\n" +
+                    "".join(orig_format_exception(ktb_self_raised_exc)) +
+                    "\nPlease report this to the KawaiiTB developers.\n"
+                )
+                file.flush()
+            except Exception:
+                pass
+
+    def _pop_summaries(self) -> list[str]:
+        summaries = self.ratelimit.pop_summaries() if self.ratelimit is not None else []
+        if self.dedup is not None:
+            summaries += self.dedup.pop_summaries()
+        return summaries
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """等待队列里的异常全部写出。返回是否在超时前写完"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if deadline is None:
+                    self._queue.all_tasks_done.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: float | None = None) -> bool:
+        """不再接受新的报告，写完队列里剩下的异常后停止后台线程。返回是否在超时前写完"""
+        if self._closed:
+            return True
+        self._closed = True
+        if self._flush_at_exit:
+            atexit.unregister(self.close)
+        if self._thread is None:
+            return True
+        flushed = self.flush(timeout)
+        if flushed:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        summaries = [*(self.ratelimit.flush() if self.ratelimit is not None else ()),
+                     *(self.dedup.flush() if self.dedup is not None else ())]
+        if summaries:
+            file = self.file if self.file is not None else sys.stderr
+            write_traceback(summaries, file, streaming=False)
+        return flushed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
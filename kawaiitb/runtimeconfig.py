@@ -15,8 +15,11 @@ __all__ = [
     "rc",
 ]
 
+import string
 import warnings
 from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import TextIO, Type, TYPE_CHECKING, Optional, Literal
 
 from kawaiitb._default_config import DEFAULT_CONFIG, EXTENDED
@@ -26,11 +29,86 @@ if TYPE_CHECKING:
     from kawaiitb.kwihandler import ErrorSuggestHandler
 
 _config = DEFAULT_CONFIG.copy()
+_config_version = 0  # 配置每次变化(加载配置、注册处理器)时加一，编译好的翻译表据此失效
+
+
+def _bump_config_version():
+    global _config_version
+    _config_version += 1
 
 
 def update_config(config_data: dict):
+    validate_templates(config_data["translate_keys"])
     _config["translate_keys"] |= config_data["translate_keys"]
     _config["default_lang"] = config_data.get("default_lang", _config["default_lang"])
+    _bump_config_version()
+
+
+_formatter = string.Formatter()
+
+
+@lru_cache(maxsize=4096)
+def _parse_template(source: str) -> tuple[tuple[str, str | None, str | None, str | None], ...]:
+    """解析模板为(字面量, 字段名, 格式说明, 转换)段。模板不合法时抛出ValueError"""
+    return tuple(_formatter.parse(source))
+
+
+class Template:
+    """
+    预解析的翻译模板。
+    简单字段({name}、{name!r}、{name:>4})直接拼接，其余(属性/下标访问、嵌套格式说明)交给str.format。
+    """
+    __slots__ = ("source", "_segments")
+
+    def __init__(self, source: str):
+        self.source = source
+        segments = _parse_template(source)
+        simple = all(
+            name is None or (name.isidentifier() and "{" not in (spec or ""))
+            for _, name, spec, _ in segments
+        )
+        self._segments = segments if simple else None
+
+    def render(self, kwargs: dict) -> str:
+        if self._segments is None:
+            return self.source.format(**kwargs)
+        parts = []
+        for literal, name, spec, conversion in self._segments:
+            if literal:
+                parts.append(literal)
+            if name is None:
+                continue
+            value = kwargs[name]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            elif conversion == "a":
+                value = ascii(value)
+            parts.append(format(value, spec or ""))
+        return "".join(parts)
+
+
+def compile_template(value):
+    """
+    把翻译值编译成模板。
+    非字符串(列表、数字...)和不需要格式化的纯字符串原样返回，其余字符串返回Template。
+    """
+    if not isinstance(value, str) or ("{" not in value and "}" not in value):
+        return value
+    return Template(value)
+
+
+def validate_templates(translate_keys: dict):
+    """检查所有翻译模板是否合法，不合法时抛出ValueError，避免每次渲染时才出错"""
+    for lang, data in translate_keys.items():
+        for key, value in data.items():
+            if not isinstance(value, str):
+                continue
+            try:
+                _parse_template(value)
+            except ValueError as e:
+                raise ValueError(f"[KawaiiTB] Invalid template for '{key}' in language '{lang}': {e}") from None
 
 
 def load_config(config: dict | TextIO = None):
@@ -48,6 +126,16 @@ def load_config(config: dict | TextIO = None):
             raise TypeError("[KawaiiTB] config must be a dict or a file-like object")
         update_config(config_data)
 
+    _validate_config()
+
+    # 重置默认语言
+    if "rc" in globals() and "default_lang" in _config:
+        rc.change_language(_config["default_lang"])
+
+
+def _validate_config():
+    """验证语言继承关系，修正不存在的父语言，并检查继承环"""
+    _bump_config_version()
     # 验证继承合法性
     for lang, data in _config["translate_keys"].items():
         if "extend" in data:
@@ -82,10 +170,6 @@ def load_config(config: dict | TextIO = None):
     if processed != len(_config["translate_keys"]):
         raise Exception("[KawaiiTB] A circular dependency exists in the language configuration!")
 
-    # 重置默认语言
-    if "rc" in globals() and "default_lang" in _config:
-        rc.change_language(_config["default_lang"])
-
 
 def set_config(config: dict, extend: str = "default"):
     load_config({
@@ -115,16 +199,95 @@ class RuntimeConfig:
         self.langs = _config["translate_keys"].keys()
         self.default_config = _config["translate_keys"]["default"]
         self.handlers = []
+        self._batch_depth = 0  # batch_registration的嵌套深度
+        self._batch_dirty = False  # 批量注册期间是否有待验证的翻译键
+        # 编译好的翻译表: 语言 -> 已经应用了继承和EXTENDED、模板已经预解析的扁平字典。按需编译，配置版本变化时清空
+        self._tables: dict[str, dict] = {}
+        self._tables_version = -1
+
+    @property
+    def lang(self) -> str:
+        """当前使用的语言"""
+        return self._lang
+
+    @property
+    def version(self) -> int:
+        """配置版本。配置或处理器注册发生变化时增加，可用于缓存翻译结果"""
+        return _config_version
+
+    def _compile_table(self, lang: str, depth: int = 0) -> dict:
+        """把一个语言编译成扁平的翻译表"""
+        table = self._tables.get(lang)
+        if table is not None:
+            return table
+        data = _config["translate_keys"][lang]
+        if lang == "default":
+            table = {}
+        else:
+            parent = data.get("extend", "default")
+            if parent == lang or not self._check_lang(parent):
+                parent = "default"
+            if depth >= MAX_EXTEND_DEPTH:
+                warnings.warn(f"[KawaiiTB] Exceeded maximum extend depth for language: {lang}")
+                parent = "default"
+            table = dict(self._compile_table(parent, depth + 1))
+        # 优先使用该语言已有的配置。模板在这里预先解析，translate时只需要拼接
+        table.update((key, compile_template(value)) for key, value in data.items() if value != EXTENDED)
+        self._tables[lang] = table
+        return table
+
+    def _table(self) -> dict:
+        """当前语言的翻译表"""
+        if self._tables_version != _config_version:
+            self._tables = {}
+            self._tables_version = _config_version
+        lang = self._lang
+        table = self._tables.get(lang)
+        if table is not None:
+            return table
+        if not self._check_lang(lang):  # 检查所选的语言是否存在, 否则使用默认语言
+            warnings.warn(f"[KawaiiTB] Language {lang} is not exist, using default language instead.")
+            warnings.warn('langs:' + str(self.langs))
+            lang = "default"
+        return self._compile_table(lang)
 
     def register_handler(self, Handler: Type["ErrorSuggestHandler"]):
-        """注册处理器的翻译键."""
+        """
+        注册处理器的翻译键.
+        处理器可能在配置加载之后才被导入(见KTBException.load_default_handlers)，
+        所以这里只填补缺失的键，不覆盖用户已经配置的键，也不重置当前语言。
+        """
         transkeys = Handler.translation_keys()
         if transkeys is not None and len(transkeys) > 0:
+            validate_templates(transkeys)
             for lang, data in transkeys.items():
-                if lang not in _config["translate_keys"]:
-                    _config["translate_keys"][lang] = {}
-                _config["translate_keys"][lang] |= data
-            load_config()
+                # 原地填补缺失的键，代价只与这个处理器的键数有关，与语言里已有的键数无关
+                table = _config["translate_keys"].setdefault(lang, {})
+                for key, value in data.items():
+                    table.setdefault(key, value)
+            if self._batch_depth:
+                # 批量注册期间只合并。继承关系的验证和配置版本的变化(翻译表随之重新编译)都等到批量结束时统一做一次
+                self._batch_dirty = True
+            else:
+                _validate_config()
+
+    @contextmanager
+    def batch_registration(self):
+        """
+        批量注册处理器。期间注册的处理器只合并翻译键，退出时统一验证一次语言继承关系。
+        翻译表本来就是第一次translate时才编译的，所以批量注册的代价与处理器数量无关。
+        可以嵌套，最外层退出时才验证。
+>>> with rc.batch_registration():
+...     import my_handlers  # 里面注册了很多处理器
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_dirty:
+                self._batch_dirty = False
+                _validate_config()
 
     def _get_key(self, lang, key):
         return _config["translate_keys"][lang][key]
@@ -143,34 +306,16 @@ class RuntimeConfig:
             self._lang = lang
 
     def translate(self, key: str, /, **kwargs):
-        lang = self._lang
-        depth_out = True
-        for _ in range(MAX_EXTEND_DEPTH):
-            if not self._check_lang(lang):  # 检查所选的语言是否存在, 否则使用默认语言
-                warnings.warn(f"[KawaiiTB] Language {lang} is not exist, using default language instead.")
-                warnings.warn('langs:' + str(self.langs))
-                lang = "default"
-                continue
-
-            if self._check_key(lang, key) \
-                    and self._get_key(lang, key) != EXTENDED:  # 优先使用该语言已有的配置
-                if kwargs:
-                    return self._get_key(lang, key).format(**kwargs)
-                return self._get_key(lang, key)
-
-            if lang == "default":  # 如果连默认配置都不存在这个键，返回未知配置提示
-                warnings.warn(f"[KawaiiTB] Unknown translate key: {key}")
-                return f"<Unknown config: {key}>"
-
-            if self._check_key(lang, "extend"):  # 如果继承自其他语言……
-                lang = self._get_key(lang, "extend")
-                continue
-
-            # 其他情况，走默认配置
-            lang = "default"
-
-        warnings.warn(f"[KawaiiTB] Exceeded maximum extend depth for key: {key}")
-        return f"<[KawaiiTB] Unreachable translate key: {key}>"
+        try:
+            value = self._table()[key]
+        except KeyError:  # 如果连默认配置都不存在这个键，返回未知配置提示
+            warnings.warn(f"[KawaiiTB] Unknown translate key: {key}")
+            return f"<Unknown config: {key}>"
+        if value.__class__ is Template:
+            return value.render(kwargs) if kwargs else value.source
+        if kwargs:
+            return value.format(**kwargs)
+        return value
 
     def get_config(self, key: str, config_type: type = str, _use_default=False, **kwargs):
         if _use_default:
@@ -0,0 +1,386 @@
+"""
+KTBException的二进制快照。
+
+快照只包含普通数据: 帧和位置、当时读到的源代码行、局部变量的repr、胜出处理器capture的信息(含有非普通数据时退回基础处理器)、异常链和异常组，
+不引用任何帧、traceback或异常对象。快照可以跨进程传输(multiprocessing、ProcessPoolExecutor)，
+也可以存下来，等源码不在了再用任意语言重新渲染。
+
+usage:
+>>> from kawaiitb import snapshot
+>>> data = snapshot.dumps(exc)  # 在子进程里
+>>> ktb = snapshot.loads(data)  # 在父进程或收集器里
+>>> print("".join(ktb.format()))
+
+KTBException本身也可以pickle，pickle时使用同样的格式。
+
+保存到文件后可以用命令行重新渲染:
+    python -m kawaiitb.snapshot crash.ktbs --lang zh_hans
+
+格式: MAGIC + 版本号(varint) + 编码后的异常节点表。
+值的编码是带类型标签的长度前缀编码，只支持None、布尔、整数、浮点数、字符串、列表和字典。
+异常链和异常组在节点表中用下标互相引用，解码时不需要递归。
+
+还原时不会因为快照的内容导入任何模块: 异常类型和处理器类型只在sys.modules中查找，
+找不到的异常类型用同名的替身类型代替(继承最近的内置异常)，找不到的处理器退回基础处理器。
+"""
+import builtins
+import collections.abc
+import struct
+import sys
+from typing import BinaryIO
+
+from kawaiitb.kraceback import KTBException, StackSummary, FrameSummary
+from kawaiitb.kwihandler import ErrorSuggestHandler, _is_plain_data
+from kawaiitb.utils import safe_string
+
+__all__ = [
+    "MAGIC",
+    "SNAPSHOT_VERSION",
+    "dumps",
+    "loads",
+    "dump",
+    "load",
+    "main",
+]
+
+MAGIC = b"KTBSNAP"
+SNAPSHOT_VERSION = 1  # 快照结构有不兼容的变化时加一
+
+# 值的类型标签
+_NONE = b"N"
+_TRUE = b"T"
+_FALSE = b"F"
+_INT = b"I"
+_FLOAT = b"D"
+_STR = b"S"
+_LIST = b"L"
+_DICT = b"M"
+
+_DOUBLE = struct.Struct("<d")
+
+
+# ---------- 值的编码 ----------
+
+def _write_varint(out: bytearray, n: int):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_str(out: bytearray, s: str):
+    data = s.encode("utf-8", "surrogatepass")
+    _write_varint(out, len(data))
+    out += data
+
+
+def _encode_value(out: bytearray, value):
+    # 快照里的值嵌套很浅(最深是 节点-帧列表-帧-局部变量)，递归即可
+    if value is None:
+        out += _NONE
+    elif value is True:
+        out += _TRUE
+    elif value is False:
+        out += _FALSE
+    elif isinstance(value, int):
+        out += _INT
+        _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))  # zigzag
+    elif isinstance(value, float):
+        out += _FLOAT
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        out += _STR
+        _write_str(out, value)
+    elif isinstance(value, (list, tuple)):
+        out += _LIST
+        _write_varint(out, len(value))
+        for item in value:
+            _encode_value(out, item)
+    elif isinstance(value, dict):
+        out += _DICT
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _write_str(out, key)
+            _encode_value(out, item)
+    else:
+        raise TypeError(f"[KawaiiTB] Cannot snapshot value of type {type(value).__name__}")
+
+
+class _Reader:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes, pos: int = 0):
+        self.data = data
+        self.pos = pos
+
+    def varint(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def str(self) -> str:
+        size = self.varint()
+        end = self.pos + size
+        if end > len(self.data):
+            raise IndexError
+        s = self.data[self.pos:end].decode("utf-8", "surrogatepass")
+        self.pos = end
+        return s
+
+    def value(self):
+        tag = self.data[self.pos:self.pos + 1]
+        if not tag:
+            raise IndexError
+        self.pos += 1
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT:
+            n = self.varint()
+            return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+        if tag == _FLOAT:
+            (value,) = _DOUBLE.unpack_from(self.data, self.pos)
+            self.pos += _DOUBLE.size
+            return value
+        if tag == _STR:
+            return self.str()
+        if tag == _LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == _DICT:
+            return {self.str(): self.value() for _ in range(self.varint())}
+        raise ValueError(f"[KawaiiTB] Corrupted snapshot: unknown tag {tag!r}")
+
+
+# ---------- KTBException <-> 节点表 ----------
+
+def _frame_record(frame: FrameSummary) -> list:
+    return [frame.filename, frame.lineno, frame.end_lineno, frame.colno, frame.end_colno, frame.name,
+            frame.namespace, frame.abs_filename, frame.refined_filename, frame.original_line, frame.locals_]
+
+
+def _frame_from_record(record: list) -> FrameSummary:
+    (filename, lineno, end_lineno, colno, end_colno, name,
+     namespace, abs_filename, refined_filename, line, locals_) = record
+    frame = FrameSummary(filename, lineno, name, namespace, abs_filename, refined_filename,
+                         lookup_line=False, line=line if line is not None else "",
+                         end_lineno=end_lineno, colno=colno, end_colno=end_colno)
+    frame.locals_ = locals_  # 已经是repr过的字符串，不能再经过构造函数
+    return frame
+
+
+def _type_record(exc_type) -> list:
+    if exc_type is None:
+        return [None, None, None]
+    base = next((t.__name__ for t in getattr(exc_type, "__mro__", ()) if t.__module__ == "builtins"),
+                "BaseException")
+    return [exc_type.__module__, exc_type.__qualname__, base]
+
+
+def _handler_record(ktb: KTBException) -> list | None:
+    if ktb.exc_type is None:
+        return None
+    handler = ktb._select_handler()
+    state = vars(handler)
+    if not all(_is_plain_data(value) for value in state.values()):
+        # 丢掉任何一个属性，还原后的handle都可能出错，整个退回基础处理器
+        return [ErrorSuggestHandler.__module__, ErrorSuggestHandler.__qualname__, {}]
+    return [type(handler).__module__, type(handler).__qualname__, dict(state)]
+
+
+def _node_record(ktb: KTBException, index_of) -> list:
+    notes = ktb.__notes__
+    if isinstance(notes, collections.abc.Sequence) and not isinstance(notes, (str, bytes)):
+        notes = [safe_string(note, 'note') for note in notes]
+    elif notes is not None:
+        notes = [safe_string(notes, '__notes__', func=repr)]
+    return [
+        _type_record(ktb.exc_type),
+        ktb.exc_str,
+        ktb.final_exc_str,
+        notes,
+        ktb.__suppress_context__,
+        ktb.max_group_width,
+        ktb.max_group_depth,
+        [_frame_record(frame) for frame in ktb.stack],
+        _handler_record(ktb),
+        index_of(ktb.__cause__),
+        index_of(ktb.__context__),
+        None if ktb.exceptions is None else [index_of(sub) for sub in ktb.exceptions],
+    ]
+
+
+def _to_records(root: KTBException) -> list:
+    nodes: list[KTBException] = [root]
+    indices = {id(root): 0}
+
+    def index_of(ktb):
+        if ktb is None:
+            return -1
+        if id(ktb) not in indices:
+            indices[id(ktb)] = len(nodes)
+            nodes.append(ktb)
+        return indices[id(ktb)]
+
+    records = []
+    i = 0
+    while i < len(nodes):  # index_of会在遍历过程中追加新节点
+        records.append(_node_record(nodes[i], index_of))
+        i += 1
+    return records
+
+
+def _lookup(module: str, qualname: str):
+    """在已经导入的模块中查找对象，不触发导入"""
+    obj = sys.modules.get(module)
+    for part in qualname.split("."):
+        if obj is None:
+            return None
+        obj = getattr(obj, part, None)
+    return obj
+
+
+_stand_in_types: dict[tuple[str, str, str], type] = {}
+
+
+def _restore_type(record: list):
+    module, qualname, base = record
+    if module is None:
+        return None
+    exc_type = _lookup(module, qualname)
+    if isinstance(exc_type, type) and issubclass(exc_type, BaseException):
+        return exc_type
+    key = (module, qualname, base)
+    if key not in _stand_in_types:
+        base_type = getattr(builtins, base, BaseException)
+        if not (isinstance(base_type, type) and issubclass(base_type, BaseException)):
+            base_type = BaseException
+        stand_in = type(qualname.rpartition(".")[2], (base_type,), {"__module__": module})
+        stand_in.__qualname__ = qualname
+        _stand_in_types[key] = stand_in
+    return _stand_in_types[key]
+
+
+def _restore_handler(record: list | None) -> ErrorSuggestHandler | None:
+    if record is None:
+        return None
+    module, qualname, state = record
+    handler_type = _lookup(module, qualname)
+    if not (isinstance(handler_type, type) and issubclass(handler_type, ErrorSuggestHandler)):
+        handler_type, state = ErrorSuggestHandler, {}
+    handler = object.__new__(handler_type)
+    handler.__dict__.update(state)
+    return handler
+
+
+def _from_records(records: list) -> KTBException:
+    KTBException.load_default_handlers()  # 内置处理器所在的模块需要已经导入
+    nodes = [object.__new__(KTBException) for _ in records]
+
+    def node_at(index):
+        return None if index == -1 else nodes[index]
+
+    for ktb, record in zip(nodes, records):
+        (type_record, exc_str, final_exc_str, notes, suppress_context, max_group_width, max_group_depth,
+         frames, handler_record, cause, context, exceptions) = record
+        ktb.max_group_width = max_group_width
+        ktb.max_group_depth = max_group_depth
+        ktb.stack = StackSummary.from_list([_frame_from_record(frame) for frame in frames])
+        ktb.exc_type = _restore_type(type_record)
+        ktb.exc_str = exc_str
+        ktb.__notes__ = notes
+        ktb.final_exc_str = final_exc_str
+        handler = _restore_handler(handler_record)
+        ktb._handlers = [] if handler is None else [handler]
+        ktb._suggest_handler = handler
+        ktb._exc_only_cache = {}
+        ktb._render_cache = {}
+        ktb.__suppress_context__ = suppress_context
+        ktb.__cause__ = node_at(cause)
+        ktb.__context__ = node_at(context)
+        ktb.exceptions = None if exceptions is None else [node_at(i) for i in exceptions]
+    return nodes[0]
+
+
+# ---------- 公开接口 ----------
+
+def dumps(exc: KTBException | BaseException) -> bytes:
+    """把KTBException(或者异常，会先以compact模式构造KTBException)编码为快照"""
+    if not isinstance(exc, KTBException):
+        exc = KTBException(type(exc), exc, exc.__traceback__, compact=True)
+    out = bytearray(MAGIC)
+    _write_varint(out, SNAPSHOT_VERSION)
+    _encode_value(out, _to_records(exc))
+    return bytes(out)
+
+
+def loads(data: bytes) -> KTBException:
+    """从快照还原KTBException，可以用当前的语言和配置重新格式化"""
+    if not data.startswith(MAGIC):
+        raise ValueError("[KawaiiTB] Not a KawaiiTB snapshot")
+    reader = _Reader(data, len(MAGIC))
+    try:
+        version = reader.varint()
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"[KawaiiTB] Unsupported snapshot version {version}, expected {SNAPSHOT_VERSION}")
+        records = reader.value()
+        if reader.pos != len(data):
+            raise ValueError("[KawaiiTB] Corrupted snapshot: trailing data")
+        return _from_records(records)
+    except (IndexError, TypeError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError("[KawaiiTB] Corrupted snapshot") from e
+
+
+def dump(exc: KTBException | BaseException, file: BinaryIO):
+    """把快照写入二进制文件"""
+    file.write(dumps(exc))
+
+
+def load(file: BinaryIO) -> KTBException:
+    """从二进制文件读取快照"""
+    return loads(file.read())
+
+
+def main(argv: list[str] | None = None) -> int:
+    """命令行: 重新渲染保存下来的快照"""
+    import argparse
+    from kawaiitb.kraceback import write_traceback
+    from kawaiitb.runtimeconfig import rc
+
+    parser = argparse.ArgumentParser(prog="python -m kawaiitb.snapshot",
+                                     description="Render saved KawaiiTB snapshots.")
+    parser.add_argument("files", nargs="+", help="snapshot files")
+    parser.add_argument("--lang", help="language to render in")
+    parser.add_argument("--no-chain", action="store_true", help="do not render chained exceptions")
+    parser.add_argument("--json", action="store_true", help="output structured JSON instead of text")
+    args = parser.parse_args(argv)
+
+    if args.lang:
+        rc.change_language(args.lang)
+    status = 0
+    for filename in args.files:
+        try:
+            with open(filename, "rb") as f:
+                ktb = load(f)
+        except (OSError, ValueError) as e:
+            print(f"{filename}: {e}", file=sys.stderr)
+            status = 1
+            continue
+        if args.json:
+            ktb.to_json(sys.stdout, chain=not args.no_chain)
+            sys.stdout.write("\n")
+        else:
+            write_traceback(ktb.format(chain=not args.no_chain), sys.stdout)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,11 @@
+import atexit
+import itertools
 import os
 import sys
 from functools import wraps
 from traceback import format_exception as orig_format_exception
 from typing import overload, Optional, Literal
 
-from kawaiitb.kraceback import KTBException
 from kawaiitb.runtimeconfig import rc, load_config
 from kawaiitb.utils.fromtraceback import parse_value_tb, sentinel as _sentinel
 from kawaiitb.utils import SupportsReading, readables
@@ -138,24 +139,99 @@ def load(lang: Optional[SupportsReading | str] = None,
     raise ValueError("Invalid arguments")
 
 
+_excepthook_dedup = None
+
+
+def _get_excepthook_dedup(window):
+    """excepthook使用的去重器，配置的窗口变化时重建"""
+    global _excepthook_dedup
+    from kawaiitb.dedup import Deduplicator
+    if _excepthook_dedup is None:
+        atexit.register(_flush_excepthook_dedup)
+    elif _excepthook_dedup.window == window:
+        return _excepthook_dedup
+    else:
+        _flush_excepthook_dedup()
+    _excepthook_dedup = Deduplicator(window)
+    return _excepthook_dedup
+
+
+def _flush_excepthook_dedup():
+    if _excepthook_dedup is not None and (summaries := _excepthook_dedup.flush()):
+        sys.stderr.write("".join(summaries))
+        sys.stderr.flush()
+
+
+_excepthook_ratelimit = None
+_excepthook_ratelimit_params = None
+
+
+def _get_excepthook_ratelimit(params):
+    """excepthook使用的限流器，配置的参数变化时重建。params为(rate, burst, global_rate, global_burst, window)"""
+    global _excepthook_ratelimit, _excepthook_ratelimit_params
+    from kawaiitb.ratelimit import RateLimiter
+    if _excepthook_ratelimit is None:
+        atexit.register(_flush_excepthook_ratelimit)
+    elif _excepthook_ratelimit_params == params:
+        return _excepthook_ratelimit
+    else:
+        _flush_excepthook_ratelimit()
+    rate, burst, global_rate, global_burst, window = params
+    _excepthook_ratelimit = RateLimiter(rate or None, burst, global_rate=global_rate or None,
+                                        global_burst=global_burst, window=window)
+    _excepthook_ratelimit_params = params
+    return _excepthook_ratelimit
+
+
+def _flush_excepthook_ratelimit():
+    if _excepthook_ratelimit is not None and (summaries := _excepthook_ratelimit.flush()):
+        sys.stderr.write("".join(summaries))
+        sys.stderr.flush()
+
+
 def override(excepthook=True, console_prompt=None):
     if excepthook:
         @wraps(orig_format_exception)  # 签名对齐 traceback.format_exception
         def wrapped(exc, /, value=_sentinel, tb=_sentinel, limit=None, chain=True):
             try:
+                from kawaiitb.kraceback import KTBException, write_traceback  # 第一次出现异常时才导入
                 value, tb = parse_value_tb(exc, value, tb)
+                summaries = []
+                rate, global_rate = rc.translate("config.ratelimit.rate"), rc.translate("config.ratelimit.global_rate")
+                if rate or global_rate:
+                    # 超出限制的异常只计数，在去重和提取调用栈之前就丢弃
+                    limiter = _get_excepthook_ratelimit((
+                        rate, rc.translate("config.ratelimit.burst"),
+                        global_rate, rc.translate("config.ratelimit.global_burst"),
+                        rc.translate("config.ratelimit.window")))
+                    summaries = limiter.pop_summaries()
+                    if not limiter.allow(value):
+                        if summaries:
+                            write_traceback(summaries, sys.stderr)
+                        return
+                if window := rc.translate("config.dedup.window"):
+                    # 窗口内重复的异常回溯只计数，不构造KTBException
+                    dedup = _get_excepthook_dedup(window)
+                    summaries += dedup.pop_summaries()
+                    if dedup.hit(value)[1]:
+                        if summaries:
+                            write_traceback(summaries, sys.stderr)
+                        return
                 te = KTBException(type(value), value, tb, limit=limit, compact=True)
-                for line in te.format(chain=chain):
-                    sys.stderr.write(line)
-                    sys.stderr.flush()
+                write_traceback(itertools.chain(summaries, te.format(chain=chain)), sys.stderr)
             except Exception as ktb_self_raised_exc:
-                orig_format_exception(exc, value=_sentinel, tb=_sentinel, limit=None, chain=True)
-                sys.stderr.write("\nKawaiiTB occurred another exception while formatting this exception:\n")
-                sys.stderr.flush()
-                orig_format_exception(exc, value=_sentinel, tb=_sentinel, limit=None, chain=True)
-                sys.stderr.write("\nPlease report this to the KawaiiTB developers.\n")
+                # 退回到标准库的格式，并附上KawaiiTB自己的异常
+                if value is _sentinel:
+                    original = orig_format_exception(exc, limit=limit, chain=chain)
+                else:
+                    original = orig_format_exception(exc, value, tb, limit=limit, chain=chain)
+                sys.stderr.write(
+                    "".join(original) +
+                    "\nKawaiiTB occurred another exception while formatting this exception:\n" +
+                    "".join(orig_format_exception(ktb_self_raised_exc)) +
+                    "\nPlease report this to the KawaiiTB developers.\n"
+                )
                 sys.stderr.flush()
-            sys.stderr.flush()
 
         wrapped.__kawaiitb__ = True  # take over by KawaiiTB
         sys.excepthook = wrapped
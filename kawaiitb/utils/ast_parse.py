@@ -1,5 +1,347 @@
-import astroid
-from astroid import nodes
+"""
+语法树查询。
+
+内置处理器只需要节点类型、节点的源码字符串和按位置遍历子节点，不需要astroid的类型推断，
+所以这里在标准库ast之上提供一层很薄的查询接口:
+- parse_source / parse_file: 解析源码，并给每个节点挂上parent
+- node_to_string: 节点的源码字符串(ast.unparse)
+- walk_inside: 按位置区间遍历节点
+astroid现在是可选依赖(pip install kawaii-traceback[astroid])，
+只有需要类型推断的第三方处理器才用得到astroid_walk_inside。
+
+解析结果按文件缓存(所有处理器共享)，总源码大小有上限，按LRU淘汰。
+linecache.checkcache发现文件变化时会丢弃旧的行列表，缓存据此失效。
+缓存的语法树是共享的，处理器不要修改它。
+
+walk_inside使用挂在语法树上的区间索引(NodeIndex)，同一棵树被多次查询时只在第一次建索引，
+之后每次查询的开销接近返回的节点数。
+
+处理器只关心出错位置附近的节点，parse_statement只解析包含这个位置的那一条语句，
+对于生成出来的超大模块比解析整个文件快得多。无法单独解析的语句返回None，调用方回退到parse_file。
+"""
+import ast
+import functools
+import linecache
+import re
+import threading
+import tokenize
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Iterator, NamedTuple
+
+if TYPE_CHECKING:
+    from astroid import nodes
+
+__all__ = [
+    "parse_source",
+    "parse_file",
+    "parse_statement",
+    "astroid_parse_file",
+    "clear_parse_cache",
+    "node_to_string",
+    "NodeIndex",
+    "get_node_index",
+    "walk_inside",
+    "astroid_walk_inside",
+]
+
+
+def parse_source(source: str) -> ast.Module | None:
+    """解析源码并给每个节点设置parent属性(根节点的parent为None)。源码无法解析时返回None"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):  # 文件在运行后被修改了，或者干脆不是python源码
+        return None
+    tree.parent = None
+    for node in ast.walk(tree):
+        for child in ast.iter_child_nodes(node):
+            child.parent = node
+    return tree
+
+
+PARSE_CACHE_MAX_SOURCE = 8 * 1024 * 1024  # 缓存中源码的总大小上限(字符数)
+
+
+class _ParseEntry(NamedTuple):
+    stamp: tuple  # 解析时linecache中的(size, mtime)
+    size: int  # 源码的字符数，计入缓存总大小
+    result: Any
+    lines: list[str]  # 解析时linecache中的行列表本身，用于确认linecache没有重新读取过文件
+
+
+class _ParseCache:
+    """
+    按文件缓存解析结果的LRU。
+    键为(解析器, 文件名)，条目记录解析时linecache中的(size, mtime, 行列表)，任意一项变化都视为失效。
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[tuple[str, str], _ParseEntry]" = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(filename: str) -> tuple:
+        entry = linecache.cache.get(filename)
+        return (entry[0], entry[1]) if entry is not None and len(entry) == 4 else (None, None)
+
+    def get(self, kind: str, filename: str, parser: Callable[[str], Any]):
+        lines = linecache.getlines(filename)
+        stamp = self._stamp(filename)
+        key = (kind, filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stamp == stamp and entry.lines is lines:
+                self._entries.move_to_end(key)
+                return entry.result
+
+        source = "".join(lines)
+        result = parser(source)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old.size
+            if len(source) <= PARSE_CACHE_MAX_SOURCE:
+                self._entries[key] = _ParseEntry(stamp, len(source), result, lines)
+                self._total += len(source)
+                while self._total > PARSE_CACHE_MAX_SOURCE:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._total -= evicted.size
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+
+
+_parse_cache = _ParseCache()
+
+
+def parse_file(filename: str) -> ast.Module | None:
+    """从linecache读取文件并解析，结果会被缓存"""
+    return _parse_cache.get("ast", filename, parse_source)
+
+
+STATEMENT_ANCHOR_SEARCH = 200  # 向上寻找语句锚点的最大行数
+
+# 只会出现在语句开头的关键字。if/for/else/async等也可能是括号内续行的开头，不能用作锚点
+_ANCHOR_KEYWORDS = frozenset({
+    "def", "class", "return", "import", "raise", "pass", "break", "continue",
+    "global", "nonlocal", "del", "assert", "try", "while", "with", "elif", "except", "finally",
+})
+_ANCHOR_RE = re.compile(r"[ \t\f]*([a-z]+)\b")
+
+
+def _find_anchor(lines: list[str], lineno: int) -> int | None:
+    """向上寻找一个必定是逻辑行开头的行: 文件第一行，或者以语句关键字开头的行"""
+    for row in range(lineno, max(1, lineno - STATEMENT_ANCHOR_SEARCH) - 1, -1):
+        if row == 1:
+            return 1
+        match = _ANCHOR_RE.match(lines[row - 1])
+        if match is not None and match.group(1) in _ANCHOR_KEYWORDS:
+            return row
+    return None
+
+
+def _logical_line_span(lines: list[str], anchor: int, start_line: int, end_line: int):
+    """
+    从锚点开始分词，找到包含[start_line, end_line]的逻辑行，返回(首行, 末行, 是否以冒号结尾)。
+    区间跨越了多个逻辑行时返回None。
+    """
+    # 去掉每行的缩进再分词: 只需要逻辑行的边界，这样从文件中间开始分词也不会出现缩进错误
+    feed = iter([line.lstrip(" \t\f") for line in lines[anchor - 1:]])
+    first = None
+    last_op = None
+    try:
+        for tok in tokenize.generate_tokens(functools.partial(next, feed, "")):
+            if tok.type in (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT):
+                continue
+            if tok.type == tokenize.ENDMARKER:
+                return None
+            row = anchor - 1 + tok.start[0]
+            if tok.type == tokenize.NEWLINE:
+                if row >= start_line:
+                    if first is None or first > start_line or row < end_line:
+                        return None
+                    return first, row, last_op == ":"
+                first = None
+                continue
+            if first is None:
+                first = row
+            last_op = tok.string if tok.type == tokenize.OP else None
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    return None
+
+
+def _is_decorated(lines: list[str], lineno: int) -> bool:
+    for row in range(lineno - 1, 0, -1):
+        stripped = lines[row - 1].strip()
+        if stripped and not stripped.startswith("#"):
+            return stripped.startswith("@") or stripped.endswith(")")  # 多行装饰器以右括号结尾
+    return False
+
+
+def parse_statement(filename: str, start_line: int | None, end_line: int | None) -> ast.Module | None:
+    """
+    只解析包含[start_line, end_line]的最小语句，返回只含这条语句的Module(带parent)。
+    节点的位置已经映射回文件坐标，可以直接传给walk_inside。
+    复合语句的头部(if x.y:等)会补一个pass再解析。
+    语句无法单独解析(装饰器、else/except分支、位置信息缺失等)时返回None，调用方应回退到parse_file。
+    """
+    if start_line is None or end_line is None:
+        return None
+    lines = linecache.getlines(filename)
+    if not 1 <= start_line <= end_line <= len(lines):
+        return None
+    anchor = _find_anchor(lines, start_line)
+    if anchor is None:
+        return None
+    span = _logical_line_span(lines, anchor, start_line, end_line)
+    if span is None:
+        return None
+    first, last, is_header = span
+
+    snippet = lines[first - 1:last]
+    indent = len(snippet[0]) - len(snippet[0].lstrip(" \t\f"))
+    snippet[0] = snippet[0][indent:]  # 续行在括号内或反斜杠之后，缩进无关紧要，只需要处理第一行
+    if not snippet[-1].endswith("\n"):
+        snippet[-1] += "\n"
+    if is_header:
+        snippet.append(" pass\n")
+    tree = parse_source("".join(snippet))
+    if tree is None or not tree.body:
+        return None
+    if isinstance(tree.body[0], (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and _is_decorated(lines, first):
+        return None  # 装饰器不在这条逻辑行里，单独解析会丢掉它们
+
+    if is_header:  # 补上的pass不属于源码，去掉它的位置，免得被区间遍历产生出来
+        filler = getattr(tree.body[-1], "body", None)
+        if filler and isinstance(filler[-1], ast.Pass):
+            filler[-1].lineno = filler[-1].end_lineno = None
+            filler[-1].col_offset = filler[-1].end_col_offset = None
+
+    offset = first - 1
+    for node in ast.walk(tree):
+        lineno = getattr(node, "lineno", None)
+        if lineno is None:
+            continue
+        if lineno == 1:
+            node.col_offset += indent
+        node.lineno = lineno + offset
+        end_lineno = getattr(node, "end_lineno", None)
+        if end_lineno is not None:
+            if end_lineno == 1:
+                node.end_col_offset += indent
+            node.end_lineno = end_lineno + offset
+    return tree
+
+
+def _astroid_parse_source(source: str):
+    import astroid
+    return astroid.parse(source)
+
+
+def astroid_parse_file(filename: str):
+    """parse_file的astroid版本。需要安装astroid"""
+    return _parse_cache.get("astroid", filename, _astroid_parse_source)
+
+
+def clear_parse_cache():
+    _parse_cache.clear()
+
+
+def node_to_string(node: ast.AST) -> str:
+    """节点的源码字符串"""
+    return ast.unparse(node)
+
+
+_COL_MASK = (1 << 32) - 1
+
+
+def _position_key(line: int, col: int) -> int:
+    """把(行, 列)编码成一个可比较的整数"""
+    return (line << 32) | min(max(col, 0), _COL_MASK)
+
+
+def _node_position(node) -> tuple[int, int, int, int] | None:
+    lineno = getattr(node, "lineno", None)
+    col_offset = getattr(node, "col_offset", None)
+    end_lineno = getattr(node, "end_lineno", None)
+    end_col_offset = getattr(node, "end_col_offset", None)
+    if lineno is None or col_offset is None or end_lineno is None or end_col_offset is None:
+        return None
+    return lineno, col_offset, end_lineno, end_col_offset
+
+
+class NodeIndex:
+    """
+    语法树节点的区间索引。
+    节点按起始位置排序，结束位置和先序序号存在平行数组里。
+    查询时二分找到起点落在区间内的节点，逐个检查终点，最后按先序(外层在前)返回。
+    与递归遍历的规则一致: 缺少位置信息的节点(如ast.arguments)不会被产生，也不会继续向下查找。
+    """
+    __slots__ = ("_starts", "_ends", "_order", "_nodes")
+
+    def __init__(self, root, children: Callable[[Any], Iterator[Any]]):
+        entries = []  # (起点, 终点, 先序序号, 节点)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            position = _node_position(node)
+            if position is not None:
+                lineno, col_offset, end_lineno, end_col_offset = position
+                entries.append((_position_key(lineno, col_offset), _position_key(end_lineno, end_col_offset),
+                                len(entries), node))
+            elif node is not root:
+                continue
+            stack.extend(reversed(list(children(node))))
+        entries.sort(key=lambda entry: entry[0])  # 稳定排序，起点相同时外层节点在前
+        self._starts = array("q", (entry[0] for entry in entries))
+        self._ends = array("q", (entry[1] for entry in entries))
+        self._order = array("l", (entry[2] for entry in entries))
+        self._nodes = [entry[3] for entry in entries]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def query(self, start_line: int, end_line: int, start_col: int, end_col: int) -> list:
+        """完全位于区间内的节点，按先序排列"""
+        if None in (start_line, end_line, start_col, end_col):
+            return []
+        low = _position_key(start_line, start_col)
+        high = _position_key(end_line, end_col)
+        ends = self._ends
+        hits = [i for i in range(bisect_left(self._starts, low), bisect_right(self._starts, high))
+                if ends[i] <= high]
+        hits.sort(key=self._order.__getitem__)
+        return [self._nodes[i] for i in hits]
+
+
+def _ast_children(node):
+    return ast.iter_child_nodes(node)
+
+
+def _astroid_children(node):
+    from astroid import nodes
+    return (child for child in node.get_children() if isinstance(child, nodes.NodeNG))
+
+
+def get_node_index(node, children: Callable[[Any], Iterator[Any]] = _ast_children) -> NodeIndex:
+    """取出挂在节点上的区间索引，第一次查询时建立"""
+    index = getattr(node, "_kawaiitb_node_index", None)
+    if index is None:
+        index = NodeIndex(node, children)
+        node._kawaiitb_node_index = index
+    return index
+
+
+def walk_inside(node: ast.AST, start_line: int, end_line: int, start_col: int, end_col: int) -> Iterator[ast.AST]:
+    """按先序产生完全位于区间内的节点，规则与astroid_walk_inside一致"""
+    yield from get_node_index(node).query(start_line, end_line, start_col, end_col)
 
 
 def is_point_before(line: int, col: int, start_line: int, start_col: int):
@@ -26,7 +368,7 @@ def is_point_inside(line: int, col: int, start_line: int, end_line: int, start_c
     )
 
 
-def is_completely_inside(node: nodes.NodeNG, start_line: int, end_line: int, start_col: int, end_col: int):
+def is_completely_inside(node, start_line: int, end_line: int, start_col: int, end_col: int):
     if any((
         not hasattr(node, 'lineno') or node.lineno is None,
         not hasattr(node, 'col_offset') or node.col_offset is None,
@@ -39,7 +381,7 @@ def is_completely_inside(node: nodes.NodeNG, start_line: int, end_line: int, sta
     )
 
 
-def is_partially_inside(node: nodes.NodeNG, start_line: int, end_line: int, start_col: int, end_col: int):
+def is_partially_inside(node, start_line: int, end_line: int, start_col: int, end_col: int):
     if any((
         not hasattr(node, 'lineno') or node.lineno is None,
         not hasattr(node, 'col_offset') or node.col_offset is None,
@@ -52,12 +394,6 @@ def is_partially_inside(node: nodes.NodeNG, start_line: int, end_line: int, star
     )
 
 
-def astroid_walk_inside(node: nodes.NodeNG, start_line: int, end_line: int, start_col: int, end_col: int):
-    if is_completely_inside(node, start_line, end_line, start_col, end_col):
-        yield node
-    for child in node.get_children():  # 这里不能检查部分包含，因为部分大节点可能缺结束位，无法判断是否包含
-        if isinstance(child, nodes.NodeNG) and \
-                is_partially_inside(child, start_line, end_line, start_col, end_col):
-            yield from astroid_walk_inside(child, start_line, end_line, start_col, end_col)
-
-
+def astroid_walk_inside(node: "nodes.NodeNG", start_line: int, end_line: int, start_col: int, end_col: int):
+    """astroid版本的walk_inside，供需要类型推断的第三方处理器使用。需要安装astroid"""
+    yield from get_node_index(node, _astroid_children).query(start_line, end_line, start_col, end_col)
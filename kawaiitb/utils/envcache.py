@@ -0,0 +1,126 @@
+"""
+环境探测结果的磁盘缓存。
+
+_ENV探测标准库和site-packages路径需要大量的文件系统访问(exists/resolve)，
+对于短命的CLI进程和fork出来的子进程来说很不划算。
+这里把探测结果按解释器前缀、sys.path和site目录的mtime做键，存成一个小json文件。
+每个虚拟环境、每次sys.path变化或安装包都会产生新的键，所以写入时只保留最新的几个缓存文件。
+
+缓存目录:
+- 环境变量 KAWAIITB_CACHE_DIR 指定的目录。设为空字符串则禁用磁盘缓存。
+- Windows: %LOCALAPPDATA%/kawaiitb
+- 其他: $XDG_CACHE_HOME/kawaiitb，默认 ~/.cache/kawaiitb
+"""
+import hashlib
+import json
+import os
+import site
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+__all__ = [
+    "ENV_KAWAIITB_CACHE_DIR",
+    "get_cache_dir",
+    "env_cache_key",
+    "load_env_cache",
+    "save_env_cache",
+]
+
+ENV_KAWAIITB_CACHE_DIR = "KAWAIITB_CACHE_DIR"
+_CACHE_FORMAT = 1  # 缓存内容的格式版本，格式变化时修改
+_CACHE_KEEP = 8  # 缓存目录里最多保留的环境缓存文件数
+
+
+def get_cache_dir() -> Path | None:
+    """返回缓存目录，禁用时返回None"""
+    if ENV_KAWAIITB_CACHE_DIR in os.environ:
+        cache_dir = os.environ[ENV_KAWAIITB_CACHE_DIR]
+        return Path(cache_dir) if cache_dir else None
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    if not base:
+        return None
+    return Path(base) / "kawaiitb"
+
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def env_cache_key() -> str:
+    """当前解释器环境的缓存键。任何可能影响探测结果的东西变化时，键都会变化"""
+    try:
+        site_dirs = list(site.getsitepackages())
+    except AttributeError:  # 某些虚拟环境的site模块没有getsitepackages
+        site_dirs = []
+    material = {
+        "format": _CACHE_FORMAT,
+        "version": sys.version,
+        "prefix": sys.prefix,
+        "base_prefix": getattr(sys, "base_prefix", sys.prefix),
+        "path": sys.path,
+        "mtimes": [_mtime(p) for p in (sys.prefix, getattr(sys, "base_prefix", sys.prefix), *site_dirs)],
+    }
+    return hashlib.sha1(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_env_cache(key: str) -> dict[str, Any] | None:
+    """读取缓存，未命中或缓存损坏时返回None"""
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    try:
+        with open(cache_dir / f"env-{key}.json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def save_env_cache(key: str, data: dict[str, Any]) -> None:
+    """写入缓存。写入失败(只读文件系统、没有权限等)时静默忽略"""
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再替换，避免并发的进程读到写了一半的文件
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, prefix=".env-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_name, cache_dir / f"env-{key}.json")
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+    except OSError:
+        return
+    _prune_env_cache(cache_dir)
+
+
+def _prune_env_cache(cache_dir: Path) -> None:
+    """只保留最新的_CACHE_KEEP个缓存文件，旧环境留下的文件删掉"""
+    entries = []
+    for path in cache_dir.glob("env-*.json"):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except OSError:
+            pass  # 被并发的进程删掉了
+    if len(entries) <= _CACHE_KEEP:
+        return
+    entries.sort(reverse=True)
+    for _, path in entries[_CACHE_KEEP:]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,125 @@
+"""
+异常回溯的指纹。
+
+指纹由异常类型和每一帧的(绝对文件名, 函数名, 行号)计算，跨进程稳定，用于识别重复出现的同一个异常回溯(见kawaiitb.dedup)。
+可以直接从异常计算(fingerprint_exception，不需要构造KTBException，很便宜)，
+也可以从KTBException计算(KTBException.fingerprint，也适用于从快照还原的异常)，两者结果一致。
+
+归一化选项:
+- lines: 行号怎么参与指纹
+    - "number": 使用行号(默认)
+    - "text": 使用该行的源代码文本，代码在别处增删行导致行号漂移时指纹不变
+    - "ignore": 不使用行号，同一个函数里不同位置的异常视为相同
+- collapse_recursion: 栈中再次出现的帧不再参与指纹，递归深度不同的同一个异常视为相同
+两个选项的默认值来自配置config.fingerprint.lines和config.fingerprint.collapse_recursion。
+"""
+import linecache
+from hashlib import blake2b
+from typing import Iterable, Iterator, Literal
+
+from kawaiitb.runtimeconfig import rc
+from kawaiitb.utils.utils import get_frame_abs_filename
+
+__all__ = [
+    "FingerprintLines",
+    "fingerprint_exception",
+    "fingerprint_ktb",
+]
+
+FingerprintLines = Literal["number", "text", "ignore"]
+_FINGERPRINT_LINES = ("number", "text", "ignore")
+
+# (异常类型名, [(绝对文件名, 函数名, 行号, 行文本), ...])，行文本只在lines="text"时提取
+_ChainItem = tuple[str, Iterable[tuple[str, str, int | None, str | None]]]
+
+
+def _resolve_options(lines, collapse_recursion) -> tuple[str, bool]:
+    if lines is None:
+        lines = rc.translate("config.fingerprint.lines")
+    if lines not in _FINGERPRINT_LINES:
+        raise ValueError(f"[KawaiiTB] Invalid fingerprint lines option {lines!r}, expected one of {_FINGERPRINT_LINES}")
+    if collapse_recursion is None:
+        collapse_recursion = rc.translate("config.fingerprint.collapse_recursion")
+    return lines, bool(collapse_recursion)
+
+
+def _type_name(exc_type) -> str:
+    return f"{exc_type.__module__}.{exc_type.__qualname__}"
+
+
+def _digest(items: Iterable[_ChainItem], lines: str, collapse_recursion: bool) -> str:
+    h = blake2b(digest_size=8)
+    for type_name, frames in items:
+        parts = [type_name]
+        seen = set()
+        for abs_filename, name, lineno, line in frames:
+            if lines == "number":
+                key = (abs_filename, name, lineno)
+            elif lines == "text":
+                key = (abs_filename, name, line or lineno)  # 取不到源码时退回行号
+            else:
+                key = (abs_filename, name)
+            if collapse_recursion:
+                if key in seen:
+                    continue
+                seen.add(key)
+            parts.append("\0".join(map(str, key)))
+        parts.append("\x01")  # 链上各个异常之间的分隔
+        h.update("\n".join(parts).encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+def _walk_chain(exc, chain: bool, is_group) -> Iterator:
+    """按格式化的顺序产生异常链和异常组中的每个异常，与KTBException.format选择链的规则相同"""
+    queue = [exc]
+    seen = set()
+    while queue:
+        e = queue.pop()
+        while e is not None and id(e) not in seen:
+            seen.add(id(e))
+            yield e
+            if is_group(e):
+                queue.extend(reversed(e.exceptions))
+            if not chain:
+                break
+            if e.__cause__ is not None:
+                e = e.__cause__
+            elif e.__context__ is not None and not e.__suppress_context__:
+                e = e.__context__
+            else:
+                e = None
+
+
+def fingerprint_exception(exc: BaseException, *, chain: bool = True,
+                          lines: FingerprintLines | None = None, collapse_recursion: bool | None = None) -> str:
+    """直接从异常和它的traceback计算指纹，不提取源码、不分类文件名、不运行处理器"""
+    lines, collapse_recursion = _resolve_options(lines, collapse_recursion)
+
+    def frames(tb):
+        # tb_lineno与co_positions的行号来自同一张位置表，不需要计算完整的位置
+        while tb is not None:
+            f = tb.tb_frame
+            lineno = tb.tb_lineno
+            filename = f.f_code.co_filename
+            line = linecache.getline(filename, lineno).strip() if lines == "text" and lineno else None
+            yield get_frame_abs_filename(f) or filename, f.f_code.co_name, lineno, line
+            tb = tb.tb_next
+
+    items = ((_type_name(type(e)), frames(e.__traceback__))
+             for e in _walk_chain(exc, chain, lambda e: isinstance(e, BaseExceptionGroup)))
+    return _digest(items, lines, collapse_recursion)
+
+
+def fingerprint_ktb(ktb_exc, *, chain: bool = True,
+                    lines: FingerprintLines | None = None, collapse_recursion: bool | None = None) -> str:
+    """从KTBException计算指纹，见KTBException.fingerprint"""
+    lines, collapse_recursion = _resolve_options(lines, collapse_recursion)
+
+    def frames(stack):
+        for frame in stack:
+            line = frame.line if lines == "text" else None
+            yield frame.abs_filename or frame.filename, frame.name, frame.lineno, line
+
+    items = (("" if e.exc_type is None else _type_name(e.exc_type), frames(e.stack))
+             for e in _walk_chain(ktb_exc, chain, lambda e: e.exceptions is not None))
+    return _digest(items, lines, collapse_recursion)
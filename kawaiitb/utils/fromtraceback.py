@@ -23,9 +23,15 @@ All Rights Reserved.
 Used under the PSF LICENSE AGREEMENT FOR PYTHON 3.12:
 https://docs.python.org/3.12/license.html
 """
-import itertools
+import dis
+import linecache
 import sys
-import textwrap
+import threading
+import weakref
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, NamedTuple
 
 __all__ = [
     "sentinel",
@@ -33,13 +39,20 @@ __all__ = [
     "walk_stack",
     "walk_tb",
     "walk_tb_with_full_positions",
+    "Operand",
+    "FailingOperation",
+    "locate_failing_operation",
+    "get_code_instructions",
     "get_code_position",
+    "get_code_positions_table",
+    "clear_code_position_cache",
     "byte_offset_to_character_offset",
     "ExceptionPrintContext",
     "levenshtein_distance",
     "compute_suggestion_error",
     "substitution_cost",
     "display_width",
+    "display_width_prefix",
 ]
 
 
@@ -81,11 +94,273 @@ def walk_tb_with_full_positions(tb):
         tb = tb.tb_next
 
 
+class Operand(NamedTuple):
+    """One operand of a failing operation, in evaluation order."""
+    text: str | None  # source text of the operand, None when unknown
+    positions: tuple  # (lineno, end_lineno, col_offset, end_col_offset)
+    opname: str  # the last instruction of the operand's subexpression
+    argval: Any  # argval of that instruction
+    simple: bool  # the operand is a single load (name or constant)
+
+
+class FailingOperation(NamedTuple):
+    """The bytecode operation an exception was raised from.
+
+    kind is one of "binary" (argval is the operator, e.g. "/"),
+    "attribute" (argval is the attribute name, method tells whether it
+    was loaded to be called), "call" (operands are the callee followed by
+    the arguments) or "import" (argval is the module or name imported).
+    """
+    kind: str
+    opname: str
+    argval: Any
+    positions: tuple
+    operands: tuple[Operand, ...]
+    method: bool = False
+
+
+# Instructions that don't produce an operand of their own and may sit
+# between an operand and the instruction consuming it.
+_TRANSPARENT_OPS = frozenset({"PRECALL", "KW_NAMES", "CACHE", "EXTENDED_ARG", "NOP", "PUSH_NULL"})
+_CONST_LOADS = frozenset({"LOAD_CONST", "LOAD_SMALL_INT"})
+_NAME_LOADS = frozenset({
+    "LOAD_NAME", "LOAD_FAST", "LOAD_FAST_CHECK", "LOAD_FAST_BORROW", "LOAD_GLOBAL",
+    "LOAD_DEREF", "LOAD_CLASSDEREF",
+})
+# Instructions pushing more than one operand; operands can't be told apart.
+_MULTI_PUSH_OPS = frozenset({"LOAD_FAST_LOAD_FAST", "LOAD_FAST_BORROW_LOAD_FAST_BORROW"})
+_CALL_OPS = frozenset({"CALL", "CALL_KW"})
+_JUMP_OPS = frozenset(dis.hasjrel) | frozenset(dis.hasjabs) | frozenset(getattr(dis, "hasjump", ()))
+
+
+def _span_contains(outer, inner):
+    if None in inner:
+        return False
+    return (outer[0], outer[2]) <= (inner[0], inner[2]) and (inner[1], inner[3]) <= (outer[1], outer[3])
+
+
+def _slice_source(filename, positions):
+    lineno, end_lineno, col, end_col = positions
+    if lineno != end_lineno:
+        return None
+    line = linecache.getline(filename, lineno)
+    if not line:
+        return None
+    start = byte_offset_to_character_offset(line, col)
+    end = byte_offset_to_character_offset(line, end_col)
+    return line[start:end] or None
+
+
+def _collect_operands(code, instructions, index, count):
+    # The last instruction of each operand's subexpression spans the whole
+    # subexpression, and positions of nested instructions nest inside it,
+    # so operands are peeled off right to left by their spans. Anything
+    # that breaks straight-line evaluation (jumps, jump targets) makes the
+    # split ambiguous and we give up.
+    operands = []
+    j = index - 1
+    for _ in range(count):
+        while j >= 0 and instructions[j].opname in _TRANSPARENT_OPS:
+            j -= 1
+        if j < 0:
+            return None
+        producer = instructions[j]
+        span = tuple(producer.positions)
+        if None in span:
+            return None
+        first = j
+        while first > 0 and _span_contains(span, tuple(instructions[first - 1].positions)):
+            first -= 1
+        for instruction in instructions[first:index + 1]:
+            if instruction.opcode in _JUMP_OPS or instruction.opname in _MULTI_PUSH_OPS or \
+                    (instruction is not instructions[first] and instruction.is_jump_target):
+                return None
+        simple = producer.opname in (_CONST_LOADS | _NAME_LOADS) and \
+            all(instruction.opname in _TRANSPARENT_OPS for instruction in instructions[first:j])
+        if simple:
+            text = repr(producer.argval) if producer.opname in _CONST_LOADS else producer.argval
+        else:
+            text = _slice_source(code.co_filename, span)
+        operands.append(Operand(text, span, producer.opname, producer.argval, simple))
+        j = first - 1
+    operands.reverse()
+    return tuple(operands)
+
+
+def _call_operands(code, instructions, index):
+    # Callee and arguments of the CALL/CALL_KW at *index*. CALL_KW (3.13+)
+    # also pops the tuple of keyword names, loaded right before it with the
+    # span of the callee or of the whole call; it isn't an operand and its
+    # span would swallow the real ones, so it is skipped.
+    call = instructions[index]
+    if call.opname == "CALL_KW":
+        kwnames = instructions[index - 1] if index > 0 else None
+        if kwnames is None or kwnames.opname not in _CONST_LOADS or not isinstance(kwnames.argval, tuple):
+            return None
+        index -= 1
+    return _collect_operands(code, instructions, index, call.arg + 1)
+
+
+def _is_callee(code, instructions, index, positions):
+    # Whether the value loaded at *index* is called right away. The opcode
+    # alone can't tell: 3.12+ only sets the method bit of LOAD_ATTR when it
+    # can use the method-call protocol, and 3.11 loads attributes of
+    # imported modules with a plain LOAD_ATTR.
+    for j in range(index + 1, len(instructions)):
+        instruction = instructions[j]
+        if instruction.opcode in _JUMP_OPS:
+            return False
+        if instruction.opname in _CALL_OPS and _span_contains(tuple(instruction.positions), positions):
+            operands = _call_operands(code, instructions, j)
+            return operands is not None and operands[0].positions == positions
+    return False
+
+
+def locate_failing_operation(code, lasti):
+    """Describe the operation at byte offset *lasti* of *code* from the bytecode alone.
+
+    Operand text is sliced from the source with co_positions when the
+    source is available; names and constants are known even without it.
+    Returns None when the operation isn't one of the supported kinds or
+    its operands can't be isolated.
+    """
+    if lasti < 0:
+        return None
+    instructions, offsets = get_code_instructions(code)
+    index = offsets.get(lasti)
+    if index is None:
+        return None
+    failing = instructions[index]
+    if failing.opname == "PRECALL" and index + 1 < len(instructions):
+        # 3.11 specializes PRECALL for builtins and performs the call in it
+        index += 1
+        failing = instructions[index]
+    positions = tuple(failing.positions)
+    if None in positions or failing.is_jump_target:
+        return None
+
+    opname = failing.opname
+    if opname in ("IMPORT_NAME", "IMPORT_FROM"):
+        return FailingOperation("import", opname, failing.argval, positions, ())
+    if opname == "BINARY_OP":
+        kind, argval = "binary", failing.argrepr
+        operands = _collect_operands(code, instructions, index, 2)
+    elif opname in ("LOAD_ATTR", "LOAD_METHOD"):
+        operands = _collect_operands(code, instructions, index, 1)
+        if operands is None:
+            return None
+        method = opname == "LOAD_METHOD" or _is_callee(code, instructions, index, positions)
+        return FailingOperation("attribute", opname, failing.argval, positions, operands, method)
+    elif opname in _CALL_OPS:
+        kind, argval = "call", failing.arg
+        operands = _call_operands(code, instructions, index)
+    else:
+        return None
+    if operands is None or not all(_span_contains(positions, operand.positions) for operand in operands):
+        return None
+    return FailingOperation(kind, opname, argval, positions, operands)
+
+
 def get_code_position(code, instruction_index):
     if instruction_index < 0:
         return None, None, None, None
-    positions_gen = code.co_positions()
-    return next(itertools.islice(positions_gen, instruction_index // 2, None))
+    table = get_code_positions_table(code)
+    base = (instruction_index // 2) * 4
+    if base + 4 > len(table):
+        return None, None, None, None
+    return tuple(None if v == _NO_POSITION else v for v in table[base:base + 4])
+
+
+# Position tables are cached per code object. co_positions() is O(bytecode
+# length) to walk, and the same hot functions tend to raise over and over.
+# Each table is a flat array of 4 ints (lineno, end_lineno, col, end_col) per
+# instruction, with _NO_POSITION standing in for None. Entries are keyed by
+# id(code) and dropped by a weakref callback when the code object dies, so
+# the cache never keeps code objects (and their module globals) alive.
+#
+# Lookups, inserts and evictions hold _code_cache_lock: tracebacks are
+# formatted from several threads (reporter worker, threaded servers). The
+# lock is reentrant because a weakref callback can fire from a garbage
+# collection triggered while the same thread holds it.
+_NO_POSITION = -1
+_POSITION_CACHE_MAXSIZE = 1024
+_position_cache: "OrderedDict[int, tuple[weakref.ref, array]]" = OrderedDict()
+_code_cache_lock = threading.RLock()
+
+
+def _code_cache_get(cache, code):
+    key = id(code)
+    with _code_cache_lock:
+        entry = cache.get(key)
+        if entry is None or entry[0]() is not code:
+            return None
+        try:
+            cache.move_to_end(key)
+        except KeyError:
+            pass  # dropped by a weakref callback in between; the value is still good
+        return entry[1]
+
+
+def _code_cache_put(cache, code, value, maxsize):
+    key = id(code)
+    try:
+        ref = weakref.ref(code, lambda r, key=key: _code_cache_drop(cache, key, r))
+    except TypeError:
+        # Not weak-referenceable (e.g. an exotic code-like object); skip caching.
+        return
+    with _code_cache_lock:
+        cache[key] = (ref, value)
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+
+def _code_cache_drop(cache, key, ref):
+    with _code_cache_lock:
+        entry = cache.get(key)
+        if entry is not None and entry[0] is ref:
+            del cache[key]
+
+
+def _build_positions_table(code):
+    table = array('i')
+    for positions in code.co_positions():
+        table.extend(_NO_POSITION if v is None else v for v in positions)
+    return table
+
+
+def get_code_positions_table(code):
+    """Return the flat position table of *code*, computing it at most once
+    while the code object is alive (bounded LRU)."""
+    table = _code_cache_get(_position_cache, code)
+    if table is None:
+        table = _build_positions_table(code)
+        _code_cache_put(_position_cache, code, table, _POSITION_CACHE_MAXSIZE)
+    return table
+
+
+# Disassembled instructions are cached the same way, together with an
+# offset -> index map, so locating the failing operation of a hot (or large)
+# code object doesn't re-disassemble the whole body for every traceback.
+_INSTRUCTION_CACHE_MAXSIZE = 256
+_instruction_cache: "OrderedDict[int, tuple[weakref.ref, tuple[tuple, dict]]]" = OrderedDict()
+
+
+def get_code_instructions(code):
+    """Return (instructions, {offset: index}) for *code*, disassembling it at
+    most once while the code object is alive (bounded LRU)."""
+    cached = _code_cache_get(_instruction_cache, code)
+    if cached is None:
+        instructions = tuple(dis.get_instructions(code))
+        cached = instructions, {instruction.offset: index for index, instruction in enumerate(instructions)}
+        _code_cache_put(_instruction_cache, code, cached, _INSTRUCTION_CACHE_MAXSIZE)
+    return cached
+
+
+def clear_code_position_cache():
+    """Drop every per-code-object cache (position tables and instructions)."""
+    with _code_cache_lock:
+        _position_cache.clear()
+        _instruction_cache.clear()
 
 
 def byte_offset_to_character_offset(str_, offset):
@@ -95,6 +370,45 @@ def byte_offset_to_character_offset(str_, offset):
 
 _WIDE_CHAR_SPECIFIERS = "WF"
 
+# Display widths are looked up per 256-code-point page. A page is a bytes
+# object of widths (1 or 2) filled from unicodedata the first time a
+# character from it is seen; source code touches only a handful of pages.
+_WIDTH_PAGE_BITS = 8
+_WIDTH_PAGE_MASK = (1 << _WIDTH_PAGE_BITS) - 1
+_width_pages: "dict[int, bytes]" = {}
+
+
+def _width_page(page):
+    table = _width_pages.get(page)
+    if table is None:
+        import unicodedata
+
+        start = page << _WIDTH_PAGE_BITS
+        table = bytes(
+            2 if unicodedata.east_asian_width(chr(cp)) in _WIDE_CHAR_SPECIFIERS else 1
+            for cp in range(start, start + _WIDTH_PAGE_MASK + 1)
+        )
+        _width_pages[page] = table
+    return table
+
+
+@lru_cache(maxsize=1024)
+def display_width_prefix(line):
+    """Cumulative display widths of *line*: entry i is the width of line[:i].
+
+    Computed in one pass and cached with the line, so every offset of a
+    frame is a single lookup.
+    """
+    prefix = array('I', [0])
+    total = 0
+    pages = _width_pages
+    for char in line:
+        cp = ord(char)
+        table = pages.get(cp >> _WIDTH_PAGE_BITS) or _width_page(cp >> _WIDTH_PAGE_BITS)
+        total += table[cp & _WIDTH_PAGE_MASK]
+        prefix.append(total)
+    return prefix
+
 
 def display_width(line, offset):
     """Calculate the extra amount of width space the given source
@@ -105,12 +419,11 @@ def display_width(line, offset):
     if line.isascii():
         return offset
 
-    import unicodedata
-
-    return sum(
-        2 if unicodedata.east_asian_width(char) in _WIDE_CHAR_SPECIFIERS else 1
-        for char in line[:offset]
-    )
+    # Same clamping as slicing line[:offset]
+    length = len(line)
+    if offset < 0:
+        offset = max(length + offset, 0)
+    return display_width_prefix(line)[min(offset, length)]
 
 
 class ExceptionPrintContext:
@@ -125,15 +438,27 @@ class ExceptionPrintContext:
     def emit(self, text_gen, margin_char=None):
         if margin_char is None:
             margin_char = '|'
-        indent_str = self.indent()
-        if self.exception_group_depth:
-            indent_str += margin_char + ' '
+        indent_str = _emit_prefix(self.exception_group_depth, margin_char)
 
         if isinstance(text_gen, str):
-            yield textwrap.indent(text_gen, indent_str, lambda line: True)
+            yield _indent_all_lines(text_gen, indent_str)
         else:
             for text in text_gen:
-                yield textwrap.indent(text, indent_str, lambda line: True)
+                yield _indent_all_lines(text, indent_str)
+
+
+@lru_cache(maxsize=64)
+def _emit_prefix(exception_group_depth, margin_char):
+    if not exception_group_depth:
+        return ''
+    return ' ' * (2 * exception_group_depth) + margin_char + ' '
+
+
+def _indent_all_lines(text, prefix):
+    # Same as textwrap.indent(text, prefix, lambda line: True)
+    if not prefix:
+        return text
+    return ''.join([prefix + line for line in text.splitlines(True)])
 
 
 _MAX_CANDIDATE_ITEMS = 750
@@ -14,7 +14,7 @@ SupportsReading = Union[*readables]
 
 __all__ = ["sys_getframe", "safe_string", "extract_caret_anchors_from_line_segment", "safe_string",
            "fromtraceback", "is_sysstdlib_name", "get_module_file_combined_key", "get_module_exec_file",
-           "parse_filename_sp_namespace", "get_this_module_frame", "readables", "SupportsReading"]
+           "get_frame_abs_filename", "parse_filename_sp_namespace", "get_this_module_frame", "readables", "SupportsReading"]
 
 def safe_string(value: Any, what: str, func: Callable[[Any], str] = str):
     try:
@@ -27,7 +27,9 @@ def is_sysstdlib_name(name: str) -> bool:
     return name in sys.builtin_module_names or name in sys.stdlib_module_names
 
 
+@lru_cache(maxsize=1024)
 def extract_caret_anchors_from_line_segment(segment):
+    """代码段中主操作符的锚点位置。同一段代码(递归、重试、同一处反复抛出)只解析一次"""
     import ast
 
     try:
@@ -143,20 +145,43 @@ def get_module_exec_file(frame) -> str | None:
     """获取模块的执行文件路径"""
     return frame.f_globals.get('__file__', None)
 
+
+def get_frame_abs_filename(frame) -> str | None:
+    """帧的绝对执行文件名。相对路径的文件名(如Cython编译时记录的路径)取模块的__file__"""
+    filename = frame.f_code.co_filename
+    if not filename.startswith("<") and not os.path.isabs(filename):
+        return get_module_exec_file(frame)  # 谨防 Cython 偷家
+    return filename
+
+_CLASSIFY_CACHE_MAXSIZE = 4096
+
+
 def parse_filename_sp_namespace(filename: str, env = None) -> tuple[str, str]:
-    """处理模块文件名，返回格式化后的命名空间和显示字符串"""
+    """
+    处理模块文件名，返回格式化后的命名空间和显示字符串
+    结果按文件名缓存在env上，env更新(update/工作目录变化)时失效
+    """
 
     if not env:
         return '', filename
 
+    cache = env.classify_cache
+    result = cache.get(filename)
+    if result is None:
+        result = _parse_filename_sp_namespace(filename, env)
+        if len(cache) >= _CLASSIFY_CACHE_MAXSIZE:
+            cache.clear()
+        cache[filename] = result
+    return result
+
+
+def _parse_filename_sp_namespace(filename: str, env) -> tuple[str, str]:
     # 标准化路径，确保使用相同的分隔符
     filename = os.path.normpath(filename)
-    cwd = os.path.normpath(env.cwd)
+    cwd = env.normalized_cwd
 
     def _parse_path_with_site_packages(filename: str, base_path: str) -> tuple[str, str] | None:
         """解析路径，处理标准库和site-packages中的模块"""
-        if not filename.startswith(base_path):
-            return None
         rel_path = os.path.relpath(filename, base_path)
         parts = rel_path.split(os.sep)
         if len(parts) == 0:
@@ -177,21 +202,13 @@ def parse_filename_sp_namespace(filename: str, env = None) -> tuple[str, str]:
                 return module_name, str(os.path.join(*parts))  # noqa
             return None
 
-    # 检查是否在relative to工作目录下的虚拟环境下。提前检查避免误认为是工作目录。
-    # 排序先检查长路径，避免检查短路径时包含长路径的情况，也避免了集合遍历的随机性
-    for path in sorted(env.all_import_paths_acwd, key=lambda p: len(str(p)), reverse=True):
-        result = _parse_path_with_site_packages(filename, os.path.normpath(path))
-        if result:
-            return result
-
-    # 检查是否在工作目录下
-    if filename.startswith(cwd):
-        rel_path = os.path.relpath(filename, cwd)
-        return '.', rel_path
-
-    # 检查是否在库路径下（包括标准库和site-packages）
-    for path in sorted(env.all_import_paths - env.all_import_paths_acwd, key=lambda p: len(str(p)), reverse=True):
-        result = _parse_path_with_site_packages(filename, os.path.normpath(path))
+    # 先检查工作目录下的虚拟环境，避免误认为是工作目录；再检查工作目录；最后检查其他库路径(包括标准库和site-packages)
+    # 候选根目录由env的前缀树按顺序给出
+    for root in env.import_roots_of(filename):
+        if root is env.CWD:
+            rel_path = os.path.relpath(filename, cwd)
+            return '.', rel_path
+        result = _parse_path_with_site_packages(filename, root)
         if result:
             return result
 
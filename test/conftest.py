@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import kawaiitb
+from kawaiitb.utils.envcache import ENV_KAWAIITB_CACHE_DIR
+
+# 整个测试会话的磁盘缓存都写到临时目录，不碰开发者真实的~/.cache/kawaiitb。
+# 有的测试模块在导入(收集)时就会触发环境探测，所以在pytest_configure里设置，而不是用fixture
+_previous = None
+_cache_dir = None
+
+
+def pytest_configure(config):
+    global _previous, _cache_dir
+    _previous = os.environ.get(ENV_KAWAIITB_CACHE_DIR)
+    _cache_dir = tempfile.mkdtemp(prefix="kawaiitb-cache-")
+    os.environ[ENV_KAWAIITB_CACHE_DIR] = _cache_dir
+
+
+def pytest_unconfigure(config):
+    if _previous is None:
+        os.environ.pop(ENV_KAWAIITB_CACHE_DIR, None)
+    else:
+        os.environ[ENV_KAWAIITB_CACHE_DIR] = _previous
+    shutil.rmtree(_cache_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def restore_lang():
+    """测试结束后恢复当前语言"""
+    lang = kawaiitb.rc.lang
+    yield
+    kawaiitb.rc.change_language(lang)
+
+
+@pytest.fixture
+def default_lang(restore_lang):
+    """在default语言下运行，结束后恢复"""
+    kawaiitb.rc.change_language("default")
+
+
+@pytest.fixture
+def restore_config(restore_lang):
+    """
+    测试结束后移除用load_config、set_config添加的语言，恢复被替换的语言和默认语言。
+    translate_keys与DEFAULT_CONFIG共用同一个字典，所以原地恢复。
+    已有语言里的键不恢复: 测试期间导入的处理器注册的键要留下。
+    """
+    from kawaiitb import runtimeconfig
+    config = runtimeconfig._config
+    translate_keys = dict(config["translate_keys"])
+    default_lang = config["default_lang"]
+    yield
+    current = config["translate_keys"]
+    for lang in [lang for lang in current if lang not in translate_keys]:
+        del current[lang]
+    current.update(translate_keys)
+    config["default_lang"] = default_lang
+    runtimeconfig._bump_config_version()
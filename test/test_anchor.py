@@ -76,3 +76,23 @@ class TestAnchor(KTBTestBase, console_output=False):
     _ = person.nonexistent_attribute  # noqa
         ^^^^^^^^^^^^^^^^^^^^^^^^^^^^""" in tb
 
+
+    def test_anchor_layout_cached(self, restore_config):
+        """同一处代码的锚行只计算一次，语言或配置变化后重新渲染"""
+        from kawaiitb.kraceback import _anchor_line
+        from kawaiitb.runtimeconfig import load_config
+
+        def render():
+            try:
+                _ = "s" + 1  # noqa
+            except TypeError as e:
+                return "".join(kawaiitb.traceback.format_exception(e))
+
+        render()
+        hits = _anchor_line.cache_info().hits
+        assert "~~~~^~~" in render()
+        assert _anchor_line.cache_info().hits > hits
+
+        load_config({"translate_keys": {"test_anchor": {"extend": "default", "config.anchor.primary": "="}}})
+        kawaiitb.rc.change_language("test_anchor")
+        assert "====^==" in render()
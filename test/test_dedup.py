@@ -0,0 +1,94 @@
+import io
+import logging
+import sys
+
+import pytest
+
+import kawaiitb
+from kawaiitb.dedup import Deduplicator
+from test.utils.utils import FakeClock, caught_error
+
+
+@pytest.mark.usefixtures("default_lang")
+class TestDeduplicator:
+    def test_window(self):
+        """窗口内只有第一次需要渲染，窗口结束后汇总重复次数"""
+        clock = FakeClock()
+        dedup = Deduplicator(10, clock=clock)
+        results = [dedup.hit(caught_error()) for _ in range(4)]
+        fingerprint = results[0][0]
+        assert results == [(fingerprint, 0), (fingerprint, 1), (fingerprint, 2), (fingerprint, 3)]
+        assert dedup.pop_summaries() == []
+
+        clock.now = 10
+        assert dedup.hit(caught_error()) == (fingerprint, 0)  # 新窗口
+        assert dedup.pop_summaries() == [
+            f"[KawaiiTB] RuntimeError (fingerprint {fingerprint}) was seen 3 more times\n"]
+        dedup.hit(caught_error())
+        assert len(dedup.flush()) == 1 and dedup.flush() == []
+
+    def test_maxsize(self):
+        """跟踪的指纹数有上限，最早的窗口提前结束"""
+        dedup = Deduplicator(10, maxsize=1, clock=FakeClock())
+        first = caught_error()
+        dedup.hit(first)
+        dedup.hit(first)
+        dedup.hit(ValueError("other"))
+        assert len(dedup.pop_summaries()) == 1
+        assert dedup.hit(first)[1] == 0
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            Deduplicator(0)
+
+
+@pytest.mark.usefixtures("restore_config", "default_lang")
+class TestDedupIntegration:
+    def test_excepthook(self, monkeypatch):
+        """配置了config.dedup.window时excepthook只渲染一次"""
+        from kawaiitb import tools
+        stream = io.StringIO()
+        monkeypatch.setattr("sys.stderr", stream)
+        monkeypatch.setattr(tools, "_excepthook_dedup", None)
+        kawaiitb.load_config({"translate_keys": {"test_dedup": {"extend": "default", "config.dedup.window": 60}}})
+        kawaiitb.rc.change_language("test_dedup")
+        previous = sys.excepthook
+        try:
+            tools.override(excepthook=True, console_prompt=False)
+            for _ in range(5):
+                e = caught_error()
+                sys.excepthook(type(e), e, e.__traceback__)
+            assert stream.getvalue().count("RuntimeError: again") == 1
+            tools._flush_excepthook_dedup()
+            assert "was seen 4 more times" in stream.getvalue()
+        finally:
+            sys.excepthook = previous
+
+    def test_formatter(self):
+        """重复的记录只输出一行说明"""
+        from kawaiitb.logging import KawaiiFormatter
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(KawaiiFormatter("%(message)s", dedup=Deduplicator(60)))
+        logger = logging.getLogger("kawaiitb.test.dedup")
+        logger.propagate = False
+        logger.handlers[:] = [handler]
+        for _ in range(3):
+            try:
+                raise RuntimeError("again")
+            except RuntimeError:
+                logger.exception("failed")
+        text = stream.getvalue()
+        assert text.count("Traceback (most recent call last)") == 1
+        assert "omitted, repeated 2 times" in text
+
+    def test_reporter(self):
+        """重复的异常在report时直接丢弃，关闭时输出汇总"""
+        from kawaiitb.reporter import KTBReporter
+        stream = io.StringIO()
+        with KTBReporter(stream, dedup=Deduplicator(60), flush_at_exit=False) as reporter:
+            accepted = [reporter.report(caught_error()) for _ in range(3)]
+        assert accepted == [True, False, False]
+        text = stream.getvalue()
+        assert text.count("RuntimeError: again") == 1
+        assert "was seen 2 more times" in text
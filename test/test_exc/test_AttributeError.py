@@ -276,6 +276,29 @@ class TestAttributeError(KTBTestBase, console_output=False, packing_handler=Attr
 
     # region 4. 其他
 
+    def test_attrerror_raising_property(self):
+        """对象上求值会抛出异常的property不影响构造，分类时也不会求值"""
+        from kawaiitb import KTBException
+        calls = []
+
+        class Bar:
+            @property
+            def boom(self):
+                calls.append(1)
+                raise RuntimeError("boom")
+
+            def fetch(self):
+                pass
+
+        with pytest.raises(AttributeError) as excinfo:
+            Bar().fetche()  # noqa
+        ktb = KTBException.from_exception(excinfo.value)
+        handler = ktb._handlers[0]
+        assert isinstance(handler, AttributeErrorHandler)
+        assert "boom" in handler.candidate_vars["UP"] and "fetch" in handler.candidate_vars["UC"]
+        assert calls == []
+        self._assert_suggestions("".join(ktb.format_exception_only()), include=["fetch"])
+
     def test_attrerror_circular_import(self):
         """测试循环导入引发的AttributeError"""
         with pytest.raises(AttributeError) as excinfo:
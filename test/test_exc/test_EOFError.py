@@ -16,3 +16,20 @@ class TestEOFError(KTBTestBase, console_output=False):
         self.try_print_exc(e)
         assert "EOFError" in tbmsg
 
+
+    def test_eof_error_messages(self):
+        """空消息使用翻译，自定义消息原样输出，处理器不保留异常本身"""
+        import warnings
+        from kawaiitb import KTBException
+        for exc, expected in ((EOFError(), "EOFError.msg"), (EOFError("stream closed"), None)):
+            ktb = KTBException(type(exc), exc, None)
+            handler = ktb._handlers[0]
+            assert isinstance(handler, EOFErrorHandler)
+            assert exc not in vars(handler).values()
+            assert handler.err_msg_key == (expected and "native." + expected)
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")  # 不应该出现未知翻译键
+                text = "".join(ktb.format_exception_only())
+            assert "Unknown config" not in text
+            if expected is None:
+                assert "stream closed" in text
@@ -25,3 +25,13 @@ class TestZeroDivisionError(KTBTestBase, console_output=False):
         self.try_print_exc(e)
         # 表达式 12 + 8 - 9 -66 // 6 为0，引发除零
         assert "'12 + x - 9 + -y // 6'" in tb
+
+    def test_without_source(self):
+        """没有源码时从字节码取得除数"""
+        code = compile("a, b = 1, 0\na / b\n", "<kawaiitb-no-source>", "exec")
+        with pytest.raises(ZeroDivisionError) as excinfo:
+            exec(code, {})
+        e = excinfo.value
+        e = e.with_traceback(e.__traceback__.tb_next)  # 从exec出来的帧开始
+        ktb, handler, msgs, tb = self.pack_exc(ZeroDivisionErrorHandler, e)
+        assert handler.divisor == "b"
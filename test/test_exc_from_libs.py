@@ -6,6 +6,7 @@ import kawaiitb
 from kawaiitb import kraceback
 from test.utils.utils import KTBTestBase
 
+@pytest.mark.usefixtures("restore_config")
 class TestExceptionFromLibs(KTBTestBase, console_output=False, packing_handler=kawaiitb.ErrorSuggestHandler):
     def test_from_std_lib(self):
         """测试从stdlib引发的错误，这里尝试错误地解码SGVsbG8为base64"""
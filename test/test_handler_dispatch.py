@@ -0,0 +1,132 @@
+import pytest
+
+import kawaiitb
+from kawaiitb import KTBException, ErrorSuggestHandler
+from kawaiitb.handlers.defaults import ZeroDivisionErrorHandler, AttributeErrorHandler, AssertionErrorHandler
+from kawaiitb.handlers.vanilla import SyntaxErrorSuggestHandler, ImportErrorSuggestHandler
+from test.utils.utils import KTBTestBase
+
+
+class TestHandlerDispatch(KTBTestBase, console_output=False):
+    def test_only_matching_handlers_built(self):
+        """ZeroDivisionError只构建胜出的处理器"""
+        with pytest.raises(ZeroDivisionError) as excinfo:
+            _ = 1 / 0
+        ktb = KTBException.from_exception(excinfo.value)
+        handler_types = {type(handler) for handler in ktb._handlers}
+        assert handler_types == {ZeroDivisionErrorHandler}  # 只构建胜出的处理器
+
+    def test_subclass_matches_by_mro(self):
+        """异常子类通过MRO找到父类声明的处理器"""
+        class MyImportError(ModuleNotFoundError):
+            pass
+
+        handler_types = KTBException.handler_types_for(MyImportError)
+        assert ImportErrorSuggestHandler in handler_types
+        assert ErrorSuggestHandler in handler_types
+        assert ZeroDivisionErrorHandler not in handler_types
+        assert KTBException.handler_types_for(MyImportError) is handler_types  # 缓存
+
+    def test_register_rebuilds_index(self):
+        """注册新处理器后分派缓存需要重建"""
+        class Marker(Exception):
+            pass
+
+        before = KTBException.handler_types_for(Marker)
+
+        class MarkerHandler(ErrorSuggestHandler, priority=2.0, exc_types=Marker):
+            @classmethod
+            def translation_keys(cls):
+                return {}
+
+        try:
+            KTBException.register(MarkerHandler)
+            after = KTBException.handler_types_for(Marker)
+            assert MarkerHandler not in before
+            assert MarkerHandler in after
+            assert MarkerHandler not in KTBException.handler_types_for(ValueError)
+        finally:
+            KTBException._handler_types.remove(MarkerHandler)
+            KTBException._dispatch_index.clear()
+            KTBException._dispatch_cache.clear()
+
+    def test_chained_exception_format(self, default_lang):
+        """链式异常每一层都能选到自己的处理器"""
+        zero = 0
+        for explicit in (True, False):
+            try:
+                try:
+                    _ = 1 / zero  # 不用字面量1/0，它有专门的彩蛋提示
+                except ZeroDivisionError as e:
+                    if explicit:
+                        raise AssertionError("chained") from e
+                    raise AssertionError("chained")
+            except AssertionError as e:
+                tb = "".join(kawaiitb.traceback.format_exception(e))
+            separator = kawaiitb.rc.translate("stack.cause" if explicit else "stack.context")
+            assert "ZeroDivisionError: division by zero" in tb
+            assert "AssertionError: chained" in tb
+            assert tb.index("ZeroDivisionError") < tb.index(separator) < tb.index("AssertionError: chained")
+
+    def test_failing_capture_falls_back(self):
+        """胜出的处理器capture失败时退回到基础处理器，KTBException照常构建"""
+        class BrokenError(Exception):
+            pass
+
+        class BrokenHandler(ErrorSuggestHandler, priority=2.0, exc_types=BrokenError):
+            def capture(self, ktb_exc, exc_value, exc_traceback):
+                raise RuntimeError("capture failed")
+
+            @classmethod
+            def translation_keys(cls):
+                return {}
+
+        try:
+            KTBException.register(BrokenHandler)
+            ktb = KTBException(BrokenError, BrokenError("broken"), None)
+            assert [type(handler) for handler in ktb._handlers] == [ErrorSuggestHandler]
+            assert "broken" in "".join(ktb.format_exception_only())
+        finally:
+            KTBException._handler_types.remove(BrokenHandler)
+            KTBException._dispatch_index.clear()
+            KTBException._dispatch_cache.clear()
+
+    def test_applies_filters_by_value(self):
+        """applies在类级别按异常值筛选，落选时由低优先级处理器认领"""
+        with pytest.raises(ImportError) as excinfo:
+            import kawaiitb_not_exist  # noqa
+        ktb = KTBException.from_exception(excinfo.value)
+        assert not any(isinstance(handler, ImportErrorSuggestHandler) for handler in ktb._handlers)
+
+    def test_legacy_can_handle_shim(self):
+        """重写了can_handle的旧式处理器仍然会被构建并在格式化时参与竞争"""
+        class LegacyError(Exception):
+            pass
+
+        class LegacyHandler(ErrorSuggestHandler, priority=2.0, exc_types=LegacyError):
+            def __init__(self, exc_type, exc_value, exc_traceback, **kwargs):
+                super().__init__(exc_type, exc_value, exc_traceback, **kwargs)
+                self._can_handle = str(exc_value) == "legacy"
+
+            def can_handle(self, ktb_exc) -> bool:
+                return self._can_handle
+
+            @classmethod
+            def translation_keys(cls):
+                return {}
+
+            def handle(self, ktb_exc):
+                yield "legacy handled\n"
+
+        assert LegacyHandler.is_legacy()
+        assert not ZeroDivisionErrorHandler.is_legacy()
+        try:
+            KTBException.register(LegacyHandler)
+            ktb = KTBException(LegacyError, LegacyError("legacy"), None)
+            assert "legacy handled" in "".join(ktb.format_exception_only())
+            ktb = KTBException(LegacyError, LegacyError("other"), None)
+            assert "legacy handled" not in "".join(ktb.format_exception_only())
+        finally:
+            KTBException._handler_types.remove(LegacyHandler)
+            KTBException._dispatch_index.clear()
+            KTBException._dispatch_cache.clear()
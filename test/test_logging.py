@@ -0,0 +1,88 @@
+import io
+import logging
+import sys
+
+import pytest
+
+import kawaiitb
+from kawaiitb.logging import KawaiiFormatter
+from kawaiitb.runtimeconfig import load_config
+
+
+def _make_logger(name, *formatters):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers.clear()
+    streams = []
+    for formatter in formatters:
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        streams.append(stream)
+    return logger, streams
+
+
+@pytest.mark.usefixtures("restore_config")
+class TestKawaiiFormatter:
+    def test_exception_rendered_once(self, monkeypatch):
+        """同一个异常发给多个处理器时只渲染一次"""
+        from kawaiitb import KTBException
+        formatter = KawaiiFormatter("%(message)s")
+        logger, (first, second) = _make_logger("kawaiitb.test.once", formatter, formatter)
+
+        calls = []
+        original_format = KTBException.format
+
+        def counting_format(self, *args, **kwargs):
+            calls.append(1)
+            return original_format(self, *args, **kwargs)
+
+        monkeypatch.setattr(KTBException, "format", counting_format)
+        try:
+            raise ValueError("logged")
+        except ValueError:
+            logger.exception("failed")
+        assert len(calls) == 1
+        assert first.getvalue() == second.getvalue()
+        assert first.getvalue().startswith("failed\n")
+        assert "raise ValueError(\"logged\")" in first.getvalue()
+
+    def test_plain_formatter_unaffected(self):
+        """与标准库Formatter共用一条记录时互不影响"""
+        logger, (kawaii, plain) = _make_logger("kawaiitb.test.mixed", KawaiiFormatter("%(message)s"),
+                                               logging.Formatter("%(message)s"))
+        load_config({"translate_keys": {"test_logging": {"extend": "default", "stack.summary": "KAWAII:\n"}}})
+        kawaiitb.rc.change_language("test_logging")
+        try:
+            raise KeyError("mixed")
+        except KeyError:
+            logger.exception("failed")
+        assert "KAWAII:" in kawaii.getvalue()
+        assert "Traceback (most recent call last)" in plain.getvalue()
+
+    def test_cache_follows_language(self):
+        """语言变化后同一条记录重新渲染"""
+        formatter = KawaiiFormatter("%(message)s")
+        try:
+            raise ValueError("lang")
+        except ValueError:
+            record = logging.LogRecord("kawaiitb.test.lang", logging.ERROR, __file__, 0, "failed", None,
+                                       sys.exc_info())
+        kawaiitb.rc.change_language("default")
+        text = formatter.format(record)
+        assert formatter.format(record) == text
+        assert record.exc_text is None
+        kawaiitb.rc.change_language("zh_hans")
+        assert formatter.format(record) != text
+
+    def test_stack_info(self):
+        """stack_info=True时从存活的帧提取调用栈"""
+        logger, (stream,) = _make_logger("kawaiitb.test.stack", KawaiiFormatter("%(message)s"))
+        kawaiitb.rc.change_language("default")
+        logger.info("with stack", stack_info=True)
+        text = stream.getvalue()
+        assert "Stack (most recent call last):" in text
+        assert "test_stack_info" in text
+        assert 'logger.info("with stack", stack_info=True)' in text
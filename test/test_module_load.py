@@ -21,6 +21,7 @@ another_lang = "Test summary 1234567890"
 kirakira = "☆pypy被玩坏了☆这肯定不是py的问题☆绝对不是☆"
 
 
+@pytest.mark.usefixtures("restore_config")
 class TestKTBLoad(KTBTestBase, console_output=False):
     def test_module_load(self):
         def is_changed():
@@ -72,3 +73,23 @@ class TestKTBLoad(KTBTestBase, console_output=False):
         assert another_lang in self.get_exception_summary()
         unload()
         assert sys.excepthook == sys.__excepthook__, "kawaiitb.unload() 未能正确卸载异常钩子"
+
+
+def test_autoload_is_lazy():
+    """autoload只安装钩子，不导入处理器和astroid；第一次出现异常时才导入"""
+    import subprocess
+    code = (
+        "import sys, kawaiitb.autoload\n"
+        "print('kawaiitb.handlers' in sys.modules, 'astroid' in sys.modules)\n"
+        "import kawaiitb\n"
+        "kawaiitb.rc.change_language('zh_hans')\n"
+        "try:\n"
+        "    1 / 0\n"
+        "except ZeroDivisionError as e:\n"
+        "    out = ''.join(kawaiitb.traceback.format_exception(e))\n"
+        "print('kawaiitb.handlers' in sys.modules, kawaiitb.rc._lang, 'astroid' in sys.modules)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    before, after = result.stdout.splitlines()
+    assert before == "False False"
+    assert after == "True zh_hans False"  # 延迟注册处理器不会重置语言；内置处理器不依赖astroid
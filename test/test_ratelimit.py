@@ -0,0 +1,123 @@
+import io
+import logging
+import sys
+
+import pytest
+
+import kawaiitb
+from kawaiitb.ratelimit import RateLimiter, TokenBucket
+from test.utils.utils import FakeClock, caught_error
+
+
+@pytest.mark.usefixtures("default_lang")
+class TestRateLimiter:
+    def test_bucket(self):
+        """令牌按速率补充，不超过容量"""
+        bucket = TokenBucket(2, 3, 0)
+        assert [bucket.take(0) for _ in range(4)] == [True, True, True, False]
+        assert bucket.take(0.5) and not bucket.take(0.5)
+        assert [bucket.take(100) for _ in range(4)] == [True, True, True, False]
+        with pytest.raises(ValueError):
+            TokenBucket(1, 0, 0)
+
+    def test_per_fingerprint(self):
+        """每个指纹各自限流，超出的只计数，窗口结束时汇总"""
+        clock = FakeClock()
+        limiter = RateLimiter(1, 2, window=60, clock=clock)
+        assert [limiter.allow(caught_error()) for _ in range(5000)][:3] == [True, True, False]
+        assert limiter.allow(caught_error(ValueError, "other"))  # 另一个指纹不受影响
+        assert limiter.pop_summaries() == []
+
+        clock.now = 60
+        summaries = limiter.pop_summaries()
+        assert len(summaries) == 1
+        assert summaries[0].startswith("[KawaiiTB] RuntimeError in ")
+        assert summaries[0].endswith("utils.py: 4,998 suppressed in last 60s\n")
+        assert limiter.allow(caught_error())  # 令牌已经补充
+        assert limiter.flush() == []
+
+    def test_global(self):
+        """全局限流对所有指纹生效，被全局拒绝时不占用指纹的配额"""
+        clock = FakeClock()
+        limiter = RateLimiter(None, global_rate=1, global_burst=2, window=10, clock=clock)
+        assert [limiter.allow(e) for e in (caught_error(), caught_error(ValueError, "other"), caught_error(), caught_error(ValueError, "other"))] == [True, True, False, False]
+        assert len(limiter.flush()) == 2
+
+        limiter = RateLimiter(1, 1, global_rate=1, global_burst=1, clock=clock)
+        assert limiter.allow(caught_error(ValueError, "other"))
+        assert not limiter.allow(caught_error())  # 被全局拒绝
+        clock.now += 1
+        assert limiter.allow(caught_error())  # 指纹的令牌还在
+
+    def test_ktb_exception(self):
+        """对快照和原始异常的判断一致"""
+        from kawaiitb.kraceback import KTBException
+        limiter = RateLimiter(1, 1, clock=FakeClock())
+        e = caught_error()
+        assert limiter.allow(e)
+        assert not limiter.allow(KTBException(type(e), e, e.__traceback__))
+        assert "RuntimeError in" in limiter.flush()[0]
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            RateLimiter(1, window=0)
+        with pytest.raises(ValueError):
+            RateLimiter(-1)
+
+
+@pytest.mark.usefixtures("restore_config", "default_lang")
+class TestRateLimitIntegration:
+    def test_excepthook(self, monkeypatch):
+        """配置了config.ratelimit.rate时excepthook超出限制的异常不渲染"""
+        from kawaiitb import tools
+        stream = io.StringIO()
+        monkeypatch.setattr("sys.stderr", stream)
+        monkeypatch.setattr(tools, "_excepthook_ratelimit", None)
+        kawaiitb.load_config({"translate_keys": {"test_ratelimit": {
+            "extend": "default", "config.ratelimit.rate": 0.001, "config.ratelimit.burst": 2}}})
+        kawaiitb.rc.change_language("test_ratelimit")
+        previous = sys.excepthook
+        try:
+            tools.override(excepthook=True, console_prompt=False)
+            for _ in range(5):
+                e = caught_error()
+                sys.excepthook(type(e), e, e.__traceback__)
+            assert stream.getvalue().count("RuntimeError: again") == 2
+            tools._flush_excepthook_ratelimit()
+            assert "3 suppressed" in stream.getvalue()
+        finally:
+            sys.excepthook = previous
+
+    def test_filter(self):
+        """作为logging过滤器时丢弃超出限制的记录，汇总行附在下一条记录后面"""
+        from kawaiitb.logging import KawaiiFormatter
+        clock = FakeClock()
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(KawaiiFormatter("%(message)s"))
+        handler.addFilter(RateLimiter(1, 1, window=10, clock=clock))
+        logger = logging.getLogger("kawaiitb.test.ratelimit")
+        logger.propagate = False
+        logger.handlers[:] = [handler]
+        for _ in range(3):
+            try:
+                raise RuntimeError("again")
+            except RuntimeError:
+                logger.exception("failed")
+        clock.now = 10
+        logger.warning("later")
+        text = stream.getvalue()
+        assert text.count("Traceback (most recent call last)") == 1
+        assert "later\n[KawaiiTB] RuntimeError in " in text
+        assert text.endswith("test_ratelimit.py: 2 suppressed in last 10s\n")
+
+    def test_reporter(self):
+        """超出限制的异常在report时直接丢弃，关闭时输出汇总"""
+        from kawaiitb.reporter import KTBReporter
+        stream = io.StringIO()
+        with KTBReporter(stream, ratelimit=RateLimiter(1, 1), flush_at_exit=False) as reporter:
+            accepted = [reporter.report(caught_error()) for _ in range(3)]
+        assert accepted == [True, False, False]
+        text = stream.getvalue()
+        assert text.count("RuntimeError: again") == 1
+        assert "2 suppressed in last" in text
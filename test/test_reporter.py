@@ -0,0 +1,87 @@
+import io
+import threading
+
+import pytest
+
+import kawaiitb
+from kawaiitb.reporter import KTBReporter
+
+
+def _exc(msg="reported"):
+    try:
+        raise ValueError(msg)
+    except ValueError as e:
+        return e
+
+
+class _BlockingStream(io.StringIO):
+    """第一次写入时阻塞，直到release被设置"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.started.set()
+        self.release.wait(5)
+        return super().write(text)
+
+
+class TestReporter:
+    def test_report_and_flush(self):
+        """后台线程渲染并写出，flush等待写完"""
+        stream = io.StringIO()
+        with KTBReporter(stream, flush_at_exit=False) as reporter:
+            assert reporter.report(_exc("first"))
+            assert reporter.report(_exc("second"))
+            assert reporter.flush(timeout=5)
+            text = stream.getvalue()
+        assert "first" in text and "second" in text
+        assert "ValueError" in text
+
+    def test_report_current_exception(self):
+        """不传异常时报告正在处理的异常"""
+        stream = io.StringIO()
+        reporter = kawaiitb.KTBReporter(stream, flush_at_exit=False)
+        assert not reporter.report()
+        try:
+            raise KeyError("current")
+        except KeyError:
+            assert reporter.report()
+        reporter.close(timeout=5)
+        assert "current" in stream.getvalue()
+        assert not reporter.report(_exc())  # 关闭后不再接受
+
+    @pytest.mark.parametrize("overflow, kept", [("drop_new", "first"), ("drop_old", "third")])
+    def test_overflow(self, overflow, kept):
+        """队列满时按策略丢弃"""
+        stream = _BlockingStream()
+        reporter = KTBReporter(stream, maxsize=1, overflow=overflow, flush_at_exit=False)
+        reporter.report(_exc("blocker"))
+        assert stream.started.wait(5)  # 后台线程正在写blocker，队列已空
+        reporter.report(_exc("first"))
+        reporter.report(_exc("second"))
+        reporter.report(_exc("third"))
+        assert reporter.dropped == 2
+        stream.release.set()
+        assert reporter.close(timeout=5)
+        text = stream.getvalue()
+        assert kept in text
+        assert sum(word in text for word in ("first", "second", "third")) == 1
+
+    def test_block_timeout(self):
+        """block策略在超时后丢弃"""
+        stream = _BlockingStream()
+        reporter = KTBReporter(stream, maxsize=1, overflow="block", flush_at_exit=False)
+        reporter.report(_exc("blocker"))
+        assert stream.started.wait(5)
+        assert reporter.report(_exc("queued"), timeout=0.01)
+        assert not reporter.report(_exc("late"), timeout=0.01)
+        assert reporter.dropped == 1
+        stream.release.set()
+        assert reporter.close(timeout=5)
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            KTBReporter(overflow="explode")
@@ -0,0 +1,101 @@
+import pytest
+
+import kawaiitb
+from kawaiitb import rc
+from kawaiitb._default_config import EXTENDED
+from kawaiitb.runtimeconfig import load_config, Template
+
+
+@pytest.mark.usefixtures("restore_config")
+class TestTranslateTables:
+    def test_inheritance_resolved(self):
+        """编译后的翻译表已经应用了继承和EXTENDED"""
+        load_config({
+            "translate_keys": {
+                "test_parent": {"extend": "default", "test.key": "parent {x}", "test.other": "parent other"},
+                "test_child": {"extend": "test_parent", "test.key": EXTENDED, "test.own": "own"},
+            },
+        })
+        rc.change_language("test_child")
+        assert rc.translate("test.key", x=1) == "parent 1"
+        assert rc.translate("test.other") == "parent other"
+        assert rc.translate("test.own") == "own"
+        assert rc.translate("exception.exc_line_noval", etype="E") == \
+            rc._compile_table("default")["exception.exc_line_noval"].source.format(etype="E")
+        with pytest.warns(UserWarning):
+            assert rc.translate("test.missing").startswith("<Unknown config")
+
+    def test_rebuilt_on_change(self):
+        """配置变化后翻译表重新编译"""
+        load_config({"translate_keys": {"test_rebuild": {"test.key": "v1"}}})
+        rc.change_language("test_rebuild")
+        assert rc.translate("test.key") == "v1"
+        version = rc.version
+        load_config({"translate_keys": {"test_rebuild": {"test.key": "v2"}}})
+        rc.change_language("test_rebuild")
+        assert rc.version > version
+        assert rc.translate("test.key") == "v2"
+
+    def test_table_reused(self):
+        """配置不变时重复使用同一张表"""
+        kawaiitb.rc.change_language("zh_hans")
+        assert rc._table() is rc._table()
+
+
+class TestTemplates:
+    def test_render_matches_format(self):
+        """预解析的模板与str.format结果一致"""
+        for source, kwargs in [
+            ("plain {a} and {b!r}", {"a": 1, "b": "x"}),
+            ("{a:>5}|{a:<3}|{{escaped}}", {"a": 42}),
+            ("{a.real} {b[0]}", {"a": 3, "b": [7]}),  # 复杂字段交给str.format
+        ]:
+            assert Template(source).render(kwargs) == source.format(**kwargs)
+
+    def test_no_kwargs_returns_source(self, restore_config):
+        load_config({"translate_keys": {"test_tpl": {"test.key": "keep {braces}"}}})
+        rc.change_language("test_tpl")
+        assert rc.translate("test.key") == "keep {braces}"
+        assert rc.translate("test.key", braces="b") == "keep b"
+
+    def test_invalid_template_fails_at_load(self, restore_config):
+        """不合法的模板在加载配置时报错，且不会被合并进配置"""
+        with pytest.raises(ValueError, match="test.bad"):
+            load_config({"translate_keys": {"test_bad": {"test.bad": "oops {"}}})
+        assert "test_bad" not in rc.langs
+
+
+class TestBatchRegistration:
+    def test_validates_once(self, monkeypatch):
+        """批量注册期间不逐个验证，结束时验证一次"""
+        from kawaiitb import runtimeconfig
+        from kawaiitb.kwihandler import ErrorSuggestHandler
+
+        calls = []
+        original = runtimeconfig._validate_config
+        monkeypatch.setattr(runtimeconfig, "_validate_config", lambda: calls.append(1) or original())
+
+        def make_handler(i):
+            class BatchHandler(ErrorSuggestHandler, priority=-1.0):
+                @classmethod
+                def translation_keys(cls):
+                    return {"default": {f"test.batch.{i}": f"batch {{n}} {i}"}}
+            return BatchHandler
+
+        default_keys = runtimeconfig._config["translate_keys"]["default"]
+        version = rc.version
+        with rc.batch_registration():
+            with rc.batch_registration():  # 可以嵌套
+                for i in range(5):
+                    rc.register_handler(make_handler(i))
+            assert calls == []
+            assert rc.version == version  # 翻译表等到批量结束时才失效
+        assert calls == [1]
+        assert rc.version > version
+        assert runtimeconfig._config["translate_keys"]["default"] is default_keys  # 原地合并
+        lang = rc._lang
+        rc.change_language("default")
+        try:
+            assert rc.translate("test.batch.3", n=1) == "batch 1 3"
+        finally:
+            rc.change_language(lang)
@@ -0,0 +1,115 @@
+import pickle
+
+import pytest
+
+import kawaiitb
+from kawaiitb import KTBException, snapshot
+
+
+def _chained_ktb():
+    class LocalError(ValueError):  # 无法按名字找回的类型
+        pass
+
+    def inner():
+        items = {"a": 1}
+        return 1 / (items["a"] - 1)
+
+    try:
+        try:
+            inner()
+        except ZeroDivisionError:
+            raise LocalError("snapshot")
+    except LocalError as e:
+        e.add_note("a note")
+        return KTBException.from_exception(e, capture_locals=True)
+
+
+class _HoldError(Exception):
+    pass
+
+
+class _HoldHandler(kawaiitb.ErrorSuggestHandler, priority=2.0, exc_types=_HoldError):
+    """capture保存了无法编码的对象，只在test_non_plain_state_falls_back中注册"""
+    def capture(self, ktb_exc, exc_value, exc_traceback):
+        self._held = object()
+
+    @classmethod
+    def translation_keys(cls):
+        return {}
+
+    def handle(self, ktb_exc):
+        yield f"held {type(self._held).__name__}\n"
+
+
+@pytest.mark.usefixtures("restore_lang")
+class TestSnapshot:
+    def test_roundtrip(self):
+        """还原后的渲染结果与原来一致"""
+        kawaiitb.rc.change_language("default")
+        ktb = _chained_ktb()
+        data = snapshot.dumps(ktb)
+        assert data.startswith(snapshot.MAGIC)
+        restored = snapshot.loads(data)
+        assert list(restored.format()) == list(ktb.format())
+        assert restored.to_dict() == ktb.to_dict()
+        assert restored.__context__.exc_type is ZeroDivisionError
+        assert restored.exc_type.__qualname__ == ktb.exc_type.__qualname__
+        assert issubclass(restored.exc_type, ValueError)  # 替身类型继承最近的内置异常
+
+    def test_rerender_in_other_language(self):
+        """快照可以用别的语言重新渲染"""
+        kawaiitb.rc.change_language("default")
+        ktb = _chained_ktb()
+        restored = snapshot.loads(snapshot.dumps(ktb))
+        kawaiitb.rc.change_language("zh_hans")
+        text = "".join(restored.format())
+        assert text == "".join(ktb.format())
+        assert "异常回溯" in text
+
+    def test_pickle(self):
+        ktb = _chained_ktb()
+        restored = pickle.loads(pickle.dumps(ktb))
+        assert list(restored.format()) == list(ktb.format())
+
+    def test_eoferror_roundtrip(self):
+        """胜出处理器的状态完整保存，还原后照常渲染"""
+        kawaiitb.rc.change_language("default")
+        for exc in (EOFError(), EOFError("EOF when reading a line"), EOFError("custom")):
+            ktb = KTBException.from_exception(exc)
+            restored = snapshot.loads(snapshot.dumps(ktb))
+            assert type(restored._suggest_handler) is type(ktb._select_handler())
+            assert list(restored.format_exception_only()) == list(ktb.format_exception_only())
+
+    def test_non_plain_state_falls_back(self):
+        """处理器状态含有无法编码的属性时，快照退回基础处理器而不是丢掉属性"""
+        try:
+            KTBException.register(_HoldHandler)
+            ktb = KTBException.from_exception(_HoldError("hold"))
+            assert "held object" in "".join(ktb.format_exception_only())
+            restored = snapshot.loads(snapshot.dumps(ktb))
+            assert type(restored._suggest_handler) is kawaiitb.ErrorSuggestHandler
+            assert "hold" in "".join(restored.format_exception_only())
+        finally:
+            KTBException._handler_types.remove(_HoldHandler)
+            KTBException._dispatch_index.clear()
+            KTBException._dispatch_cache.clear()
+
+    def test_invalid(self):
+        data = snapshot.dumps(_chained_ktb())
+        with pytest.raises(ValueError, match="Not a KawaiiTB snapshot"):
+            snapshot.loads(b"garbage")
+        with pytest.raises(ValueError, match="Corrupted"):
+            snapshot.loads(data[:-3])
+        with pytest.raises(ValueError, match="version"):
+            snapshot.loads(snapshot.MAGIC + b"\x7f" + data[len(snapshot.MAGIC) + 1:])
+
+    def test_cli(self, tmp_path, capsys):
+        kawaiitb.rc.change_language("default")
+        ktb = _chained_ktb()
+        path = tmp_path / "crash.ktbs"
+        with open(path, "wb") as f:
+            snapshot.dump(ktb, f)
+        assert snapshot.main([str(path), "--lang", "zh_hans"]) == 0
+        out = capsys.readouterr().out
+        assert "异常回溯" in out and "a note" in out
+        assert snapshot.main([str(tmp_path / "missing.ktbs")]) == 1
@@ -1,4 +1,6 @@
 import asyncio
+import copy
+import sys
 
 import pytest
 
@@ -7,6 +9,7 @@ from kawaiitb.kraceback import ENV
 from test.utils.utils import KTBTestBase, setup_test
 
 
+@pytest.mark.usefixtures("restore_config")
 class TestExceptionFormatting(KTBTestBase, console_output=True):
     def test_recursive_exception(self):
         """测试递归异常深度溢出"""
@@ -145,3 +148,157 @@ Exception: test
         assert r"self._loop.run_until_complete(task)" in tb
         assert r"future.result()" in tb
         assert r'raise Exception("test")' in tb
+
+
+class _CountingStream:
+    def __init__(self):
+        self.writes = []
+        self.flushes = 0
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TestOutput(KTBTestBase, console_output=False):
+    @staticmethod
+    def _exc():
+        try:
+            raise ValueError("output test")
+        except ValueError as e:
+            return e
+
+    def test_print_single_write(self):
+        """默认一次写出整个traceback"""
+        stream = _CountingStream()
+        ktb = kawaiitb.KTBException.from_exception(self._exc())
+        ktb.print(file=stream)
+        assert len(stream.writes) == 1 and stream.flushes == 1
+        assert stream.writes[0] == "".join(ktb.format())
+
+    def test_print_streaming(self):
+        """streaming逐段写出"""
+        stream = _CountingStream()
+        ktb = kawaiitb.KTBException.from_exception(self._exc())
+        ktb.print(file=stream, streaming=True)
+        assert len(stream.writes) > 1
+        assert stream.flushes == len(stream.writes)
+        assert "".join(stream.writes) == "".join(ktb.format())
+
+    def test_excepthook_single_write(self, monkeypatch):
+        """excepthook一次写出，格式化失败时退回标准库格式"""
+        from kawaiitb import tools
+        stream = _CountingStream()
+        monkeypatch.setattr("sys.stderr", stream)
+        previous = sys.excepthook
+        try:
+            tools.override(excepthook=True, console_prompt=False)
+            e = self._exc()
+            sys.excepthook(type(e), e, e.__traceback__)
+            assert len(stream.writes) == 1
+            assert "output test" in stream.writes[0]
+
+            stream.writes.clear()
+            monkeypatch.setattr(kawaiitb.KTBException, "format", None)  # 让格式化出错
+            sys.excepthook(type(e), e, e.__traceback__)
+            text = "".join(stream.writes)
+            assert "Traceback (most recent call last)" in text and "output test" in text
+            assert "KawaiiTB occurred another exception" in text
+        finally:
+            sys.excepthook = previous
+
+
+class TestRenderCache(KTBTestBase, console_output=False):
+    @staticmethod
+    def _ktb():
+        try:
+            try:
+                raise KeyError("inner")
+            except KeyError:
+                raise ValueError("render cache")
+        except ValueError as e:
+            return kawaiitb.KTBException.from_exception(e)
+
+    def test_format_cached(self, monkeypatch):
+        """同一个异常多次格式化只渲染一次，换语言后只重新生成文本"""
+        ktb = self._ktb()
+        kawaiitb.rc.change_language("default")
+        first = list(ktb.format())
+        assert list(ktb.format()) == first
+        assert list(ktb.format(chain=False)) != first
+
+        calls = []
+        monkeypatch.setattr(type(ktb._handlers[0]), "can_handle",
+                            lambda self, ktb_exc: calls.append(1) or True)
+        assert list(ktb.format()) == first
+        assert calls == []  # 命中缓存，没有重新选择处理器
+
+        kawaiitb.rc.change_language("zh_hans")
+        assert list(ktb.format()) != first
+        assert calls == []  # 处理器选择与语言无关
+
+        ktb.invalidate()
+        list(ktb.format())
+        assert calls
+
+    def test_eq_ignores_cache(self):
+        """渲染缓存不影响相等比较"""
+        a = self._ktb()
+        b = copy.copy(a)
+        b._render_cache, b._exc_only_cache = {}, {}
+        list(a.format())
+        assert a._render_cache and not b._render_cache
+        assert a == b
+
+
+class TestExport(KTBTestBase, console_output=False):
+    def test_to_dict(self):
+        """结构化导出包含帧、处理器的发现、notes和异常链"""
+        class Box:
+            value = 1
+
+        try:
+            try:
+                Box().valeu  # noqa
+            except AttributeError as e:
+                raise KeyError("export") from e
+        except KeyError as e:
+            e.add_note("exported note")
+            data = kawaiitb.KTBException.from_exception(e).to_dict()
+
+        assert data["schema"] == 1
+        assert data["type"] == "KeyError" and data["notes"] == ["exported note"]
+        frame = data["stack"][0]
+        assert frame["name"] == "test_to_dict" and frame["line"] == 'raise KeyError("export") from e'
+        assert frame["positions"]["lineno"] == frame["positions"]["end_lineno"]
+        cause = data["cause"]
+        assert cause["type"] == "AttributeError" and cause["cause"] is None
+        assert cause["handler"]["type"] == "AttributeErrorHandler"
+        assert cause["handler"]["findings"]["suggestions"] == ["value"]
+        assert "candidates" not in cause["handler"]["findings"]
+
+    def test_to_dict_group(self):
+        zero = 0
+        try:
+            1 / zero
+        except ZeroDivisionError as e:
+            division = e
+        try:
+            raise ExceptionGroup("group", [division, ValueError("v")])
+        except ExceptionGroup as e:
+            data = kawaiitb.KTBException.from_exception(e).to_dict(chain=False)
+        first, second = data["exceptions"]
+        assert first["handler"]["findings"]["divisor"] == "zero"
+        assert second["type"] == "ValueError" and "schema" not in second
+
+    def test_to_json_streaming(self):
+        """to_json分段写入，结果与返回的字符串一致"""
+        import json
+        from test.test_tb_format import _CountingStream
+        ktb = kawaiitb.KTBException.from_exception(ValueError("json"))
+        stream = _CountingStream()
+        assert ktb.to_json(stream) is None
+        assert "".join(stream.writes) == ktb.to_json()
+        assert json.loads(ktb.to_json()) == ktb.to_dict()
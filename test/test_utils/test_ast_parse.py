@@ -0,0 +1,127 @@
+import ast
+import linecache
+
+from kawaiitb.utils import ast_parse
+from kawaiitb.utils.ast_parse import parse_source, parse_file, parse_statement, node_to_string, walk_inside, \
+    clear_parse_cache, get_node_index
+
+
+class TestAstParse:
+    def test_parent_links(self):
+        """每个节点都有parent"""
+        tree = parse_source("x = a.b(c)\n")
+        assert tree.parent is None
+        attr = next(node for node in ast.walk(tree) if isinstance(node, ast.Attribute))
+        assert isinstance(attr.parent, ast.Call)
+        assert isinstance(attr.parent.parent, ast.Assign)
+
+    def test_invalid_source(self):
+        """无法解析的源码返回None"""
+        assert parse_source("def (:\n") is None
+
+    def test_walk_inside(self):
+        """只产生完全位于区间内的节点，先序"""
+        source = "y = 1\nz = foo(a) / (b - c)\n"
+        tree = parse_source(source)
+        found = [node_to_string(node) for node in walk_inside(tree, 2, 2, 4, 20)]
+        assert found[0] == "foo(a) / (b - c)"
+        assert "b - c" in found
+        assert "1" not in found
+
+    def test_node_index_cached(self):
+        """区间索引挂在语法树上，多次查询只建一次，结果按先序排列"""
+        tree = parse_source("d = {k.a: v.b for k, v in x}\nz = foo(a) / (b - c)\n")
+        index = get_node_index(tree)
+        assert get_node_index(tree) is index
+        found = [node_to_string(node) for node in walk_inside(tree, 1, 1, 4, 99)]
+        assert found == ["{k.a: v.b for k, v in x}", "k.a", "k", "v.b", "v"]  # 不进入没有位置信息的comprehension
+        assert [node_to_string(node) for node in walk_inside(tree, 2, 2, 4, 10)] == ["foo(a)", "foo", "a"]
+        assert list(walk_inside(tree, 2, 2, None, None)) == []
+
+    def test_node_to_string(self):
+        tree = parse_source("assert a  ==  b\n")
+        assert node_to_string(tree.body[0].test) == "a == b"
+
+
+class TestParseCache:
+    def setup_method(self):
+        clear_parse_cache()
+
+    def test_cached_until_file_changes(self, tmp_path):
+        """同一个文件只解析一次，文件变化后重新解析"""
+        path = tmp_path / "mod.py"
+        path.write_text("x = 1\n")
+        filename = str(path)
+        first = parse_file(filename)
+        assert parse_file(filename) is first
+
+        path.write_text("x = 2\ny = 3\n")
+        linecache.checkcache(filename)
+        second = parse_file(filename)
+        assert second is not first
+        assert len(second.body) == 2
+
+    def test_bounded_by_source_size(self, tmp_path, monkeypatch):
+        """缓存的源码总大小有上限"""
+        monkeypatch.setattr(ast_parse, "PARSE_CACHE_MAX_SOURCE", 20)
+        files = []
+        for i in range(3):
+            path = tmp_path / f"m{i}.py"
+            path.write_text(f"value{i} = {i}\n")  # 11个字符
+            files.append(str(path))
+            parse_file(files[-1])
+        entries = ast_parse._parse_cache._entries
+        assert list(entries) == [("ast", files[-1])]
+        assert ast_parse._parse_cache._total <= 20
+
+
+STATEMENT_SOURCE = """\
+class A:
+    def f(self):
+        value = foo(
+            a.b,
+            c)
+        if self.x.y:
+            pass
+        y = 1; q.w
+
+    @deco.attr
+    def g(self):
+        pass
+"""
+
+
+class TestParseStatement:
+    def _check_same_as_full_parse(self, filename, line):
+        tree = parse_statement(filename, line, line)
+        assert tree is not None
+        full = parse_file(filename)
+        found = [(type(n), n.lineno, n.col_offset, n.end_lineno, n.end_col_offset)
+                 for n in walk_inside(tree, line, line, 0, 999)]
+        expected = [(type(n), n.lineno, n.col_offset, n.end_lineno, n.end_col_offset)
+                    for n in walk_inside(full, line, line, 0, 999)]
+        assert found == expected
+        return tree
+
+    def test_positions_mapped_to_file(self, tmp_path):
+        """只解析所在语句，节点位置与解析整个文件时一致"""
+        path = tmp_path / "mod.py"
+        path.write_text(STATEMENT_SOURCE)
+        filename = str(path)
+        tree = self._check_same_as_full_parse(filename, 4)  # 多行表达式的续行
+        assert isinstance(tree.body[0], ast.Assign)
+        tree = self._check_same_as_full_parse(filename, 6)  # 复合语句的头部
+        assert isinstance(tree.body[0], ast.If)
+        tree = self._check_same_as_full_parse(filename, 8)  # 分号分隔的多条语句
+        assert len(tree.body) == 2
+
+    def test_fallback_when_not_isolated(self, tmp_path):
+        """装饰器、空行等无法单独解析的位置返回None"""
+        path = tmp_path / "mod.py"
+        path.write_text(STATEMENT_SOURCE)
+        filename = str(path)
+        assert parse_statement(filename, 10, 10) is None  # 装饰器
+        assert parse_statement(filename, 11, 11) is None  # 被装饰的函数
+        assert parse_statement(filename, 9, 9) is None  # 空行
+        assert parse_statement(filename, 6, 8) is None  # 跨越多个逻辑行
+        assert parse_statement(filename, None, None) is None
@@ -0,0 +1,179 @@
+import gc
+
+import pytest
+
+from kawaiitb.utils import fromtraceback
+from kawaiitb.utils.fromtraceback import (
+    get_code_position, get_code_positions_table, clear_code_position_cache, walk_tb_with_full_positions,
+    locate_failing_operation,
+)
+
+
+def _sample(a, b):
+    c = a + b
+    return (c
+            * 2)
+
+
+class TestCodePositionCache:
+    def setup_method(self):
+        clear_code_position_cache()
+
+    def test_matches_co_positions(self):
+        """缓存的位置表与co_positions逐条一致"""
+        code = _sample.__code__
+        expected = list(code.co_positions())
+        for index, positions in enumerate(expected):
+            assert get_code_position(code, index * 2) == positions
+        assert get_code_position(code, -1) == (None, None, None, None)
+
+    def test_table_is_cached(self):
+        """同一个代码对象只计算一次"""
+        code = _sample.__code__
+        assert get_code_positions_table(code) is get_code_positions_table(code)
+
+    def test_entry_dropped_with_code(self):
+        """代码对象被回收后缓存条目随之删除"""
+        namespace = {}
+        exec("def f():\n    return 1\n", namespace)
+        code = namespace.pop("f").__code__
+        get_code_positions_table(code)
+        key = id(code)
+        assert key in fromtraceback._position_cache
+        del code
+        gc.collect()
+        assert key not in fromtraceback._position_cache
+
+    def test_bounded(self, monkeypatch):
+        """缓存条目数有上限"""
+        monkeypatch.setattr(fromtraceback, "_POSITION_CACHE_MAXSIZE", 2)
+        codes = []
+        for i in range(4):
+            namespace = {}
+            exec(f"def f{i}():\n    return {i}\n", namespace)
+            codes.append(namespace[f"f{i}"].__code__)
+            get_code_positions_table(codes[-1])
+        assert len(fromtraceback._position_cache) == 2
+        assert id(codes[-1]) in fromtraceback._position_cache
+
+    def test_entry_evicted_during_lookup(self, monkeypatch):
+        """查找和move_to_end之间条目被回调删除时不报错"""
+        code = _sample.__code__
+        table = get_code_positions_table(code)
+        cache = fromtraceback._position_cache
+
+        class _Racy(type(cache)):
+            def move_to_end(self, key, last=True):
+                del self[key]  # 模拟弱引用回调或其他线程抢先淘汰了条目
+                super().move_to_end(key, last)
+        monkeypatch.setattr(fromtraceback, "_position_cache", _Racy(cache))
+        assert fromtraceback.get_code_positions_table(code) == table
+
+    def test_threads(self):
+        """多线程并发查询和淘汰时结果正确"""
+        import threading
+        codes = []
+        for i in range(8):
+            namespace = {}
+            exec(f"def f{i}():\n    return {i}\n", namespace)
+            codes.append(namespace[f"f{i}"].__code__)
+        errors = []
+
+        def work():
+            try:
+                for _ in range(200):
+                    for code in codes:
+                        assert len(get_code_positions_table(code)) == 4 * len(list(code.co_positions()))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+
+    def test_walk_tb(self):
+        """walk_tb_with_full_positions给出与原生一致的位置"""
+        try:
+            _sample(1, None)
+        except TypeError as e:
+            tb = e.__traceback__
+        frames = list(walk_tb_with_full_positions(tb))
+        inner_frame, positions = frames[-1]
+        assert inner_frame.f_code is _sample.__code__
+        assert positions == next(iter(
+            p for i, p in enumerate(_sample.__code__.co_positions())
+            if i == tb.tb_next.tb_lasti // 2
+        ))
+
+
+def _failing_operation(source, filename="<kawaiitb-test>"):
+    """执行源码，返回最内层帧出错的操作。filename不在linecache中，模拟没有源码的情况"""
+    code = compile(source, filename, "exec")
+    try:
+        exec(code, {})
+    except Exception as e:
+        tb = e.__traceback__
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        return locate_failing_operation(tb.tb_frame.f_code, tb.tb_lasti)
+    pytest.fail("source did not raise")
+
+
+class TestLocateFailingOperation:
+    def test_binary(self):
+        """除法的操作符和操作数"""
+        operation = _failing_operation("a = 1\nb = a / (a - 1)\n")
+        assert operation.kind == "binary" and operation.argval == "/"
+        left, right = operation.operands
+        assert left.simple and left.text == "a"
+        assert not right.simple and right.text is None  # 没有源码时复杂操作数取不到文本
+        assert right.positions == (2, 2, 9, 14)
+
+    def test_attribute(self):
+        """属性名、对象和是否被调用"""
+        operation = _failing_operation("x = 1\nx.foo()\n")
+        assert operation.kind == "attribute" and operation.argval == "foo"
+        assert operation.operands[0].text == "x"
+        assert operation.method
+        operation = _failing_operation("x = 1\nprint(x.foo)\n")
+        assert operation.argval == "foo" and not operation.method
+
+    def test_call(self):
+        """函数调用的被调用者和参数"""
+        operation = _failing_operation("g = iter(())\nnext(g)\n")
+        assert operation.kind == "call"
+        callee, arg = operation.operands
+        assert callee.simple and callee.argval == "next"
+        assert arg.text == "g"
+
+    def test_call_with_keywords(self):
+        """带关键字参数的调用(3.13+的CALL_KW)与普通调用结果一致"""
+        operation = _failing_operation("g = None\ng(1, k=2)\n")
+        assert operation.kind == "call" and operation.argval == 2
+        assert [operand.text for operand in operation.operands] == ["g", "1", "2"]
+        operation = _failing_operation("x = 1\nx.foo(1, k=2)\n")
+        assert operation.kind == "attribute" and operation.argval == "foo"
+        assert operation.method
+
+    def test_undecidable(self):
+        """分支表达式的操作数无法确定时返回None"""
+        assert _failing_operation("a = 0\nb = 1 / (a if a else 0)\n") is None
+
+    def test_instructions_cached(self, monkeypatch):
+        """同一个代码对象只反汇编一次"""
+        import dis
+        clear_code_position_cache()
+        code = compile("a = 1\nb = a / (a - 1)\n", "<kawaiitb-test>", "exec")
+        calls = []
+        get_instructions = dis.get_instructions
+        monkeypatch.setattr(dis, "get_instructions", lambda c: calls.append(c) or get_instructions(c))
+        try:
+            exec(code, {})
+        except ZeroDivisionError as e:
+            tb = e.__traceback__.tb_next
+        first = locate_failing_operation(code, tb.tb_lasti)
+        assert locate_failing_operation(code, tb.tb_lasti) == first
+        assert calls == [code]
+        assert locate_failing_operation(code, tb.tb_lasti + 1) is None  # 不是指令的起始偏移
@@ -0,0 +1,26 @@
+import unicodedata
+
+from kawaiitb.utils.fromtraceback import display_width, display_width_prefix
+
+
+def _slow_width(line, offset):
+    return sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in line[:offset])
+
+
+class TestDisplayWidth:
+    def test_matches_unicodedata(self):
+        """前缀表与逐字符计算一致"""
+        line = "x = '中文注释' + 1  # ｆｕｌｌ width 😀 and é\n"
+        for offset in range(-3, len(line) + 3):
+            assert display_width(line, offset) == _slow_width(line, offset)
+
+    def test_prefix_cached(self):
+        """同一行的前缀表只计算一次"""
+        line = "y = '重复的行'\n"
+        prefix = display_width_prefix(line)
+        assert display_width_prefix(line) is prefix
+        assert len(prefix) == len(line) + 1
+        assert prefix[-1] == _slow_width(line, len(line))
+
+    def test_ascii_fast_path(self):
+        assert display_width("plain ascii", 5) == 5
@@ -0,0 +1,69 @@
+import pytest
+
+from kawaiitb import KTBException
+from kawaiitb.utils.fingerprint import fingerprint_exception
+
+
+def _recurse(n):
+    if n == 0:
+        raise ValueError("deep")
+    _recurse(n - 1)
+
+
+def _raise_at(where):
+    if where == "a":
+        raise KeyError(where)
+    raise KeyError(where)
+
+
+def _catch(func, *args):
+    try:
+        func(*args)
+    except Exception as e:
+        return e
+
+
+class TestFingerprint:
+    def test_stable_and_consistent(self):
+        """直接从异常和从KTBException计算的指纹一致，还原的快照也一样"""
+        from kawaiitb import snapshot
+        e = _catch(_recurse, 2)
+        ktb = KTBException.from_exception(e)
+        assert fingerprint_exception(e) == ktb.fingerprint() == snapshot.loads(snapshot.dumps(ktb)).fingerprint()
+        assert len(ktb.fingerprint()) == 16
+        for lines in ("text", "ignore"):
+            assert fingerprint_exception(e, lines=lines) == ktb.fingerprint(lines=lines)
+
+    def test_recursion(self):
+        """递归深度不同的同一个异常默认视为相同"""
+        shallow, deep = _catch(_recurse, 2), _catch(_recurse, 7)
+        assert fingerprint_exception(shallow) == fingerprint_exception(deep)
+        assert fingerprint_exception(shallow, collapse_recursion=False) != \
+               fingerprint_exception(deep, collapse_recursion=False)
+
+    def test_lines(self):
+        """lines="ignore"时同一个函数里不同位置的异常视为相同"""
+        a, b = _catch(_raise_at, "a"), _catch(_raise_at, "b")
+        assert fingerprint_exception(a) != fingerprint_exception(b)
+        assert fingerprint_exception(a, lines="ignore") == fingerprint_exception(b, lines="ignore")
+        with pytest.raises(ValueError):
+            fingerprint_exception(a, lines="column")
+
+    def test_type_and_chain(self):
+        """异常类型和异常链参与指纹"""
+        def chained():
+            try:
+                _raise_at("a")
+            except KeyError:
+                raise ValueError("chained")
+
+        def unchained():
+            try:
+                _raise_at("a")
+            except KeyError:
+                pass
+            raise ValueError("chained")
+
+        assert fingerprint_exception(_catch(chained)) != fingerprint_exception(_catch(chained), chain=False)
+        assert fingerprint_exception(_catch(_recurse, 1)) != fingerprint_exception(_catch(_raise_at, "a"))
+        assert fingerprint_exception(_catch(unchained)) != fingerprint_exception(_catch(chained))
@@ -131,4 +131,137 @@ def test_parse_module_filename_qpy():
         )
         assert relative_path == expected_relative_path, (
             f"Failed for QPython path {file_path}: expected relative_path '{expected_relative_path}', got '{relative_path}'"
-        )
\ No newline at end of file
+        )
+
+@pytest.mark.skipif(os.name == 'nt', reason="Posix-specific test")
+def test_parse_module_filename_cache():
+    """分类结果按文件名缓存，env更新后失效"""
+    def make_env(cwd):
+        return _ENV(
+            cwd=PurePosixPath(cwd),
+            platform='posix',
+            stdlib_paths={PurePosixPath('/usr/lib/python3.12')},
+            site_packages={PurePosixPath('/usr/lib/python3.12/site-packages')})
+
+    env = make_env('/home/usr/project')
+    file_path = "/home/usr/project/main.py"
+    assert parse_filename_sp_namespace(file_path, env=env) == ('.', 'main.py')
+    assert env.classify_cache[file_path] == ('.', 'main.py')
+
+    version = env.version
+    env.update(cwd=PurePosixPath('/home/usr'), platform='posix',
+               stdlib_paths=env.stdlib_paths, site_packages=env.site_packages)
+    assert env.version > version
+    assert file_path not in env.classify_cache
+    assert parse_filename_sp_namespace(file_path, env=env) == ('.', 'project/main.py')
+
+
+def test_env_sync_cwd(tmp_path, monkeypatch):
+    """未指定cwd的env跟随进程工作目录变化"""
+    env = _ENV()
+    version = env.version
+    env.classify_cache["x"] = ("x", "x")
+    env.sync_cwd()
+    assert env.version == version  # 没变化时不失效
+
+    monkeypatch.chdir(tmp_path)
+    env.sync_cwd()
+    assert env.version > version
+    assert "x" not in env.classify_cache
+    assert env.cwd == tmp_path
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="Posix-specific test")
+def test_env_import_roots_order():
+    """前缀树按 工作目录内的导入路径 -> 工作目录 -> 其他导入路径 的顺序给出候选"""
+    env = _ENV(
+        cwd=PurePosixPath('/home/usr/project'),
+        platform='posix',
+        stdlib_paths={PurePosixPath('/usr/lib/python3.12'), PurePosixPath('/home')},
+        site_packages={
+            PurePosixPath('/home/usr/project/.venv/lib/python3.12/site-packages'),
+            PurePosixPath('/home/usr/project/.venv'),
+        })
+    roots = env.import_roots_of('/home/usr/project/.venv/lib/python3.12/site-packages/numpy/core.py')
+    assert roots == ['/home/usr/project/.venv/lib/python3.12/site-packages', '/home/usr/project/.venv',
+                     _ENV.CWD, '/home']
+    # 只按完整的路径组件匹配
+    assert env.import_roots_of('/home/usr/project2/main.py') == ['/home']
+    assert parse_filename_sp_namespace('/home/usr/project/.venv/lib/python3.12/site-packages/numpy/core.py',
+                                       env=env) == ('numpy', 'numpy/core.py')
+
+
+def test_env_lazy_discovery(monkeypatch):
+    """延迟构建的env在第一次使用时才探测"""
+    calls = []
+    monkeypatch.setattr(_ENV, "discover", lambda self: calls.append(1) or (set(), set()))
+    env = _ENV(lazy=True)
+    assert not env.discovered
+    assert calls == []
+    env.sync_cwd()  # 未探测时不触发探测
+    assert calls == []
+    assert env.classify_cache == {}
+    assert env.discovered
+    assert calls == [1]
+
+
+def test_env_lazy_discovery_threads(monkeypatch):
+    """多个线程同时触发探测时只探测一次，其他线程等到探测完成"""
+    import threading
+    import time
+    calls = []
+
+    def slow_discover(self):
+        calls.append(1)
+        time.sleep(0.05)
+        return set(), set()
+    monkeypatch.setattr(_ENV, "discover", slow_discover)
+    env = _ENV(lazy=True)
+    errors = []
+
+    def use():
+        try:
+            assert env.classify_cache == {}
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert calls == [1]
+    assert env.discovered
+
+
+def test_env_discovery_disk_cache(tmp_path, monkeypatch):
+    """探测结果缓存在磁盘上，后续的env直接读取"""
+    monkeypatch.setenv("KAWAIITB_CACHE_DIR", str(tmp_path))
+    env = _ENV()
+    assert list(tmp_path.glob("env-*.json"))
+
+    def no_probe(self):
+        raise AssertionError("should not probe the filesystem")
+    monkeypatch.setattr(_ENV, "get_stdlib_paths", no_probe)
+    cached_env = _ENV()
+    assert cached_env.stdlib_paths == env.stdlib_paths
+    assert cached_env.site_packages == env.site_packages
+
+    # 空字符串禁用磁盘缓存
+    monkeypatch.setenv("KAWAIITB_CACHE_DIR", "")
+    with pytest.raises(AssertionError):
+        _ENV()
+
+
+def test_env_disk_cache_prune(tmp_path, monkeypatch):
+    """缓存目录只保留最新的几个环境缓存文件"""
+    import os
+    from kawaiitb.utils import envcache
+    monkeypatch.setenv("KAWAIITB_CACHE_DIR", str(tmp_path))
+    for i in range(envcache._CACHE_KEEP + 3):
+        envcache.save_env_cache(f"k{i}", {})
+        os.utime(tmp_path / f"env-k{i}.json", (i, i))
+    envcache.save_env_cache("newest", {})
+    kept = {p.name for p in tmp_path.glob("env-*.json")}
+    assert len(kept) == envcache._CACHE_KEEP
+    assert "env-newest.json" in kept and "env-k0.json" not in kept
@@ -38,6 +38,7 @@ class KTBTestBase:
     def pack_exc(self, HandlerType, exc) -> tuple[KTBException, kawaiitb.ErrorSuggestHandler, list[str], str]:
         ktb = KTBException.from_exception(exc)
         handler = HandlerType(type(exc), exc, exc.__traceback__)
+        handler.capture(ktb, exc, exc.__traceback__)
         assert handler.can_handle(ktb)
         messages = list(handler.handle(ktb))
         return ktb, handler, messages, "".join(messages)
@@ -52,6 +53,23 @@ def raise_error(ExceptionType=Exception, msg="test"):
     raise ExceptionType(msg)
 
 
+def caught_error(ExceptionType=RuntimeError, msg="again") -> BaseException:
+    """抛出再捕获，返回带traceback的异常。同样的参数得到同样的指纹"""
+    try:
+        raise_error(ExceptionType, msg)
+    except ExceptionType as e:
+        return e
+
+
+class FakeClock:
+    """手动拨动的时钟，传给Deduplicator、RateLimiter的clock参数"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
 def setup_test(lang="neko_zh", **kwargs):
     kawaiitb.load(lang, **kwargs)
 